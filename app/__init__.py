@@ -3,10 +3,23 @@
 RAG-KG Customer Service QA System - FastAPI Application
 """
 
-from .main import app
-from .query_processor import QueryProcessor
-from .retrieval_system import RetrievalSystem
-from .answer_generator import AnswerGenerator
+import importlib
 
 __version__ = "1.0.0"
-__all__ = ["app", "QueryProcessor", "RetrievalSystem", "AnswerGenerator"]
\ No newline at end of file
+__all__ = ["app", "QueryProcessor", "RetrievalSystem", "AnswerGenerator"]
+
+# Exports are resolved on first access so that light submodules
+# (e.g. app.data_version, used by the ingestion scripts) can be
+# imported without building the FastAPI app.
+_EXPORTS = {
+    "app": "app.main",
+    "QueryProcessor": "app.query_processor",
+    "RetrievalSystem": "app.retrieval_system",
+    "AnswerGenerator": "app.answer_generator",
+}
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,109 +5,392 @@ Answer Generator for RAG-KG Customer Service QA System
 Generates natural language answers using retrieved information and OLLAMA models.
 """
 
+import re
+import time
+import asyncio
 import logging
-from typing import List, Dict, Any, Tuple
-import ollama
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from dotenv import load_dotenv
 import os
 
+from app.deadline import Deadline, STAGE_BUDGETS_MS
+from app.lazy import lazy_import
+from app.metrics import count_tokens, errors_total, record_stage, track, tokens_generated_total
+
+ollama = lazy_import('ollama')
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Role per intent, sent once as the system message
+SYSTEM_PROMPTS = {
+    'troubleshooting': """You are a customer service expert helping users solve technical problems.
+Use the provided sources to give step-by-step solutions. Be clear, concise, and actionable.""",
+    'feature_request': """You are a product manager responding to feature requests.
+Acknowledge the request and explain current capabilities or roadmap plans.""",
+    'bug_report': """You are a support engineer handling bug reports.
+Acknowledge the issue and provide immediate workarounds or next steps.""",
+    'general_inquiry': """You are a helpful customer service assistant.
+Provide clear, accurate information based on the available sources.""",
+}
+
+ANSWER_INSTRUCTIONS = """Instructions:
+1. Answer based primarily on the provided sources
+2. If sources don't contain enough information, say so clearly
+3. Be helpful, professional, and concise
+4. Include specific steps when applicable
+5. Reference source tickets when relevant"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about 4 characters per token for llama-style tokenizers)"""
+    return (len(text) + 3) // 4
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    """Word n-grams used to spot near-duplicate source texts"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
 class AnswerGenerator:
     """Generates answers using retrieved sources and LLM"""
 
     def __init__(self):
         self.model_name = os.getenv("LLM_MODEL", "llama2:7b-chat-q4_0")
-        self.max_context_length = 2048  # Limit context to avoid token limits
+        # Context window (num_ctx) shared by the prompt and the answer; sources fill
+        # what the prompt and num_predict leave, each capped at a share of it
+        self.max_context_length = int(os.getenv("MAX_CONTEXT_TOKENS", 2048))
+        self.max_source_tokens = int(os.getenv("CONTEXT_MAX_SOURCE_TOKENS", 200))
+        # Sources whose word 3-grams overlap at least this much (Jaccard) are dropped
+        self.dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+        self.async_client = ollama.AsyncClient(host=os.getenv("OLLAMA_BASE_URL"))
+        # How long Ollama keeps the model loaded after warm-up
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+        # Used to shorten answers to the request deadline: generation speed, and
+        # the shortest answer worth generating (below it the answer is extractive)
+        self.num_predict = 512
+        self.ms_per_token = float(os.getenv("GENERATION_MS_PER_TOKEN", 25))
+        self.min_answer_tokens = int(os.getenv("GENERATION_MIN_TOKENS", 64))
+
+    async def awarm(self):
+        """Load the answer model into Ollama and keep it resident"""
+        await self.async_client.generate(model=self.model_name, prompt='', keep_alive=self.keep_alive)
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to about max_tokens, at a word boundary"""
+        max_chars = max_tokens * 4
+        if len(text) <= max_chars:
+            return text
+        cut = text[:max_chars].rsplit(' ', 1)[0]
+        return cut + " ..."
+
+    def pack_context(self, sources: List[Dict[str, Any]],
+                     budget_tokens: int) -> Tuple[str, List[Dict[str, Any]]]:
+        """
+        Fill the token budget greedily with the highest-scoring sources, after
+        dropping near-duplicates, and render them grouped by ticket. Returns
+        the context text and the sources that were packed.
+        """
+        ranked = sorted(sources, key=lambda s: s.get('score', 0), reverse=True)
+
+        packed = []
+        kept_shingles = []
+        used_tokens = 0
+        duplicates = 0
+        for source in ranked:
+            text = " ".join(source.get('text', '').split())
+            if not text:
+                continue
+
+            shingles = _shingles(text)
+            if any(len(shingles & other) / (len(shingles | other) or 1) >= self.dedup_threshold
+                   for other in kept_shingles):
+                duplicates += 1
+                continue
+
+            text = self._truncate(text, self.max_source_tokens)
+            node_type = source.get('node_type', 'Unknown')
+            # Line cost, plus a ticket header the first time a ticket appears
+            cost = estimate_tokens(f"- [{node_type}] {text}\n")
+            if not any(p['ticket_id'] == source.get('ticket_id') for p in packed):
+                cost += estimate_tokens(f"Ticket {source.get('ticket_id', 'Unknown')} (score 0.00):\n")
+            if used_tokens + cost > budget_tokens:
+                continue
+
+            packed.append({**source, 'ticket_id': source.get('ticket_id', 'Unknown'), 'text': text})
+            kept_shingles.append(shingles)
+            used_tokens += cost
+
+        # Tickets in order of their best packed source; nodes by score within a ticket
+        tickets: Dict[str, List[Dict[str, Any]]] = {}
+        for source in packed:
+            tickets.setdefault(source['ticket_id'], []).append(source)
 
-    def format_sources(self, sources: List[Dict[str, Any]]) -> str:
-        """Format retrieved sources into context string"""
         context_parts = []
+        for ticket_id, ticket_sources in tickets.items():
+            lines = [f"Ticket {ticket_id} (score {ticket_sources[0].get('score', 0):.2f}):"]
+            lines += [f"- [{s.get('node_type', 'Unknown')}] {s['text']}" for s in ticket_sources]
+            context_parts.append("\n".join(lines))
 
-        for i, source in enumerate(sources[:5]):  # Limit to top 5 sources
-            ticket_id = source.get('ticket_id', 'Unknown')
-            node_type = source.get('node_type', 'Unknown')
-            text = source.get('text', '')[:300]  # Truncate long text
-            score = source.get('score', 0)
+        logger.info(f"Packed {len(packed)}/{len(sources)} sources from {len(tickets)} tickets "
+                    f"into ~{used_tokens} tokens ({duplicates} near-duplicates dropped)")
+        return "\n\n".join(context_parts), packed
 
-            context_parts.append(f"Source {i+1} (Score: {score:.2f}):\n"
-                               f"Ticket: {ticket_id}\n"
-                               f"Type: {node_type}\n"
-                               f"Content: {text}\n")
+    def format_sources(self, sources: List[Dict[str, Any]], budget_tokens: Optional[int] = None) -> str:
+        """Format retrieved sources into context string"""
+        budget_tokens = budget_tokens or self.max_context_length - self.num_predict
+        return self.pack_context(sources, budget_tokens)[0]
+
+    def _build_prompts(self, question: str, sources: List[Dict[str, Any]],
+                       processed_query: Dict[str, Any],
+                       num_predict: Optional[int] = None) -> Tuple[str, str]:
+        """
+        Build the system prompt (role and instructions, sent once) and the user
+        prompt (question and packed sources) within the context window.
+        """
+        # Get query intent for better prompting
+        intent = processed_query.get('intent', 'general_inquiry')
+        role = SYSTEM_PROMPTS.get(intent, SYSTEM_PROMPTS['general_inquiry'])
+        system_prompt = f"{role}\n\n{ANSWER_INSTRUCTIONS}"
+
+        scaffold = f"Question: {question}\n\nRelevant Information:\n\n\nAnswer:"
+        budget_tokens = (self.max_context_length - (num_predict or self.num_predict)
+                         - estimate_tokens(system_prompt) - estimate_tokens(scaffold))
+        context, _ = self.pack_context(sources, max(budget_tokens, 0))
+
+        prompt = f"""Question: {question}
 
-        return "\n".join(context_parts)
+Relevant Information:
+{context or 'No relevant sources found.'}
 
-    def generate(self, question: str, sources: List[Dict[str, Any]],
-                processed_query: Dict[str, Any]) -> Tuple[str, float]:
-        """Generate answer using retrieved sources"""
-        try:
-            # Format context from sources
-            context = self.format_sources(sources)
-
-            # Get query intent and entities for better prompting
-            intent = processed_query.get('intent', 'general_inquiry')
-            entities = processed_query.get('entities', {})
-
-            # Create intent-specific prompt
-            if intent == 'troubleshooting':
-                system_prompt = """You are a customer service expert helping users solve technical problems.
-Use the provided sources to give step-by-step solutions. Be clear, concise, and actionable."""
-            elif intent == 'feature_request':
-                system_prompt = """You are a product manager responding to feature requests.
-Acknowledge the request and explain current capabilities or roadmap plans."""
-            elif intent == 'bug_report':
-                system_prompt = """You are a support engineer handling bug reports.
-Acknowledge the issue and provide immediate workarounds or next steps."""
-            else:
-                system_prompt = """You are a helpful customer service assistant.
-Provide clear, accurate information based on the available sources."""
+Answer:"""
 
-            # Build the full prompt
-            prompt = f"""{system_prompt}
+        return system_prompt, prompt
 
-Question: {question}
+    def _generation_options(self, num_predict: Optional[int] = None) -> Dict[str, Any]:
+        """Sampling options for answer generation"""
+        return {
+            'temperature': 0.3,  # Lower temperature for more consistent answers
+            'top_p': 0.9,
+            'num_predict': num_predict or self.num_predict,  # Limit response length
+            'num_ctx': self.max_context_length
+        }
 
-Relevant Information:
-{context}
+    def _token_budget(self, deadline: Optional[Deadline]) -> Optional[int]:
+        """
+        num_predict that fits the deadline after prompt evaluation
+        (DEADLINE_GENERATION_MS), or None if only an extractive answer fits.
+        """
+        if deadline is None or not deadline.bounded:
+            return self.num_predict
+
+        available_ms = deadline.remaining_ms() - STAGE_BUDGETS_MS['generation']
+        num_predict = int(available_ms / self.ms_per_token)
+        if num_predict < self.min_answer_tokens:
+            deadline.degrade('generation', 'extractive')
+            return None
+        if num_predict < self.num_predict:
+            deadline.degrade('generation', f'num_predict={num_predict}')
+            return num_predict
+        return self.num_predict
+
+    def extractive_answer(self, question: str, sources: List[Dict[str, Any]],
+                          processed_query: Dict[str, Any]) -> Tuple[str, float]:
+        """Answer quoting the top sources, used when there is no time for the LLM"""
+        if not sources:
+            return self.generate_fallback(question, processed_query.get('intent', 'general_inquiry')), 0.0
+
+        lines = ["Here is what similar support tickets say:"]
+        seen = set()
+        for source in sources:
+            text = " ".join(source.get('text', '').split())
+            if not text or text in seen:
+                continue
+            seen.add(text)
+            lines.append(f"- {source.get('ticket_id', 'Unknown')}: {text[:300]}")
+            if len(seen) == 3:
+                break
+
+        answer = "\n".join(lines)
+        return answer, self._calculate_confidence(sources, answer, question)
+
+    def _fallback_answer(self) -> Tuple[str, float]:
+        fallback_answer = ("I'm sorry, I encountered an error while processing your question. "
+                         "Please try rephrasing your question or contact support directly.")
+        return fallback_answer, 0.0
 
-Instructions:
-1. Answer based primarily on the provided sources
-2. If sources don't contain enough information, say so clearly
-3. Be helpful, professional, and concise
-4. Include specific steps when applicable
-5. Reference source tickets when relevant
+    def generate(self, question: str, sources: List[Dict[str, Any]],
+                processed_query: Dict[str, Any],
+                deadline: Optional[Deadline] = None) -> Tuple[str, float]:
+        """Generate answer using retrieved sources, shortened or extractive under a tight deadline"""
+        num_predict = self._token_budget(deadline)
+        if num_predict is None:
+            return self.extractive_answer(question, sources, processed_query)
 
-Answer:"""
+        try:
+            system_prompt, prompt = self._build_prompts(question, sources, processed_query, num_predict)
 
             # Generate response
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': prompt}
-                ],
-                options={
-                    'temperature': 0.3,  # Lower temperature for more consistent answers
-                    'top_p': 0.9,
-                    'num_predict': 512  # Limit response length
-                }
-            )
+            with track('answer_generation'):
+                response = ollama.chat(
+                    model=self.model_name,
+                    messages=[
+                        {'role': 'system', 'content': system_prompt},
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    options=self._generation_options(num_predict)
+                )
+            count_tokens('answer_generation', response)
 
             answer = response['message']['content'].strip()
 
             # Calculate confidence based on sources and answer quality
             confidence = self._calculate_confidence(sources, answer, question)
 
-            logger.info(".2f")
+            logger.info(f"Answer generated with confidence {confidence:.2f}")
 
             return answer, confidence
 
         except Exception as e:
             logger.error(f"Answer generation failed: {str(e)}")
-            fallback_answer = ("I'm sorry, I encountered an error while processing your question. "
-                             "Please try rephrasing your question or contact support directly.")
-            return fallback_answer, 0.0
+            return self._fallback_answer()
+
+    async def agenerate(self, question: str, sources: List[Dict[str, Any]],
+                        processed_query: Dict[str, Any],
+                        deadline: Optional[Deadline] = None) -> Tuple[str, float]:
+        """
+        Async variant of generate used by the API. Generation that overruns
+        the deadline is abandoned for an extractive answer.
+        """
+        num_predict = self._token_budget(deadline)
+        if num_predict is None:
+            return self.extractive_answer(question, sources, processed_query)
+
+        try:
+            system_prompt, prompt = self._build_prompts(question, sources, processed_query, num_predict)
+
+            with track('answer_generation'):
+                response = await asyncio.wait_for(
+                    self.async_client.chat(
+                        model=self.model_name,
+                        messages=[
+                            {'role': 'system', 'content': system_prompt},
+                            {'role': 'user', 'content': prompt}
+                        ],
+                        options=self._generation_options(num_predict)
+                    ),
+                    timeout=deadline.timeout('generation') if deadline else None
+                )
+            count_tokens('answer_generation', response)
+
+            answer = response['message']['content'].strip()
+            confidence = self._calculate_confidence(sources, answer, question)
+
+            logger.info(f"Answer generated with confidence {confidence:.2f}")
+
+            return answer, confidence
+
+        except asyncio.TimeoutError:
+            # Without a deadline this is a client timeout from inside the generation call
+            logger.warning("Answer generation ran out of time, answering extractively")
+            if deadline:
+                deadline.degrade('generation', 'extractive')
+            return self.extractive_answer(question, sources, processed_query)
+
+        except Exception as e:
+            logger.error(f"Answer generation failed: {str(e)}")
+            return self._fallback_answer()
+
+    async def astream(self, question: str, sources: List[Dict[str, Any]],
+                      processed_query: Dict[str, Any],
+                      deadline: Optional[Deadline] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the answer as it is generated. Yields {'type': 'token', 'content': ...}
+        events, then one {'type': 'done', 'answer': ..., 'confidence': ..., 'tokens': ...}.
+        Under a tight deadline the answer is shortened, cut off or extractive.
+        """
+        parts = []
+        tokens = 0
+        num_predict = self._token_budget(deadline)
+        if num_predict is None:
+            answer, confidence = self.extractive_answer(question, sources, processed_query)
+            yield {'type': 'token', 'content': answer}
+            yield {'type': 'done', 'answer': answer, 'confidence': confidence, 'tokens': 0}
+            return
+
+        start = time.perf_counter()
+        try:
+            system_prompt, prompt = self._build_prompts(question, sources, processed_query, num_predict)
+
+            # Opening the stream (a cold model load) and every chunk wait are bounded by the deadline
+            stream = await asyncio.wait_for(
+                self.async_client.chat(
+                    model=self.model_name,
+                    messages=[
+                        {'role': 'system', 'content': system_prompt},
+                        {'role': 'user', 'content': prompt}
+                    ],
+                    options=self._generation_options(num_predict),
+                    stream=True
+                ),
+                timeout=deadline.timeout('generation') if deadline else None
+            )
+
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), timeout=deadline.timeout('generation') if deadline else None
+                    )
+                except StopAsyncIteration:
+                    break
+                content = chunk['message']['content']
+                if content:
+                    parts.append(content)
+                    yield {'type': 'token', 'content': content}
+                if chunk.get('done'):
+                    tokens = chunk.get('eval_count', 0)
+
+            answer = ''.join(parts).strip()
+            confidence = self._calculate_confidence(sources, answer, question)
+
+        except asyncio.TimeoutError:
+            # Without a deadline this is a client timeout from inside the stream
+            logger.warning("Streaming answer generation ran out of time")
+            if parts:
+                # Keep what was already sent and stop at the deadline
+                if deadline:
+                    deadline.degrade('generation', 'truncated')
+                tokens = len(parts)
+                answer = ''.join(parts).strip()
+                confidence = self._calculate_confidence(sources, answer, question)
+            else:
+                if deadline:
+                    deadline.degrade('generation', 'extractive')
+                answer, confidence = self.extractive_answer(question, sources, processed_query)
+                yield {'type': 'token', 'content': answer}
+
+        except Exception as e:
+            logger.error(f"Streaming answer generation failed: {str(e)}")
+            errors_total.inc(stage='answer_generation')
+            if parts:
+                # Keep what was already sent to the client
+                answer = ''.join(parts).strip()
+                confidence = self._calculate_confidence(sources, answer, question)
+            else:
+                answer, confidence = self._fallback_answer()
+                yield {'type': 'token', 'content': answer}
+
+        record_stage('answer_generation', time.perf_counter() - start)
+        if tokens:
+            tokens_generated_total.inc(tokens, stage='answer_generation')
+
+        logger.info(f"Answer streamed with confidence {confidence:.2f}")
+        yield {'type': 'done', 'answer': answer, 'confidence': confidence, 'tokens': tokens}
 
     def _calculate_confidence(self, sources: List[Dict[str, Any]], answer: str, question: str) -> float:
         """Calculate confidence score for the generated answer"""
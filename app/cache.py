@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Answer Caching for RAG-KG Customer Service QA System
+
+Caches final query responses so repeated questions skip the
+parse -> retrieve -> generate pipeline, and per-ticket subgraphs so popular
+tickets skip the graph query.
+"""
+
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+from app.data_version import data_version_stamp, ticket_versions
+from app.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+# Options that control caching or timing only and must not change the cache key
+# (answers degraded by a deadline are never cached)
+CACHE_CONTROL_OPTIONS = {'use_cache', 'use_semantic_cache', 'deadline_ms', 'include_timings'}
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return " ".join(question.lower().split()).rstrip('?!. ')
+
+
+def make_cache_key(question: str, context: Optional[Dict[str, Any]] = None,
+                   options: Optional[Dict[str, Any]] = None) -> str:
+    """Build a stable key from the normalized question, context and options"""
+    options = {k: v for k, v in (options or {}).items() if k not in CACHE_CONTROL_OPTIONS}
+    payload = json.dumps(
+        [normalize_question(question), context or {}, options],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """Bounded LRU cache with TTL, invalidated when the data version changes"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._data_version = data_version_stamp()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _check_data_version(self):
+        """Drop everything if the graph or vectors were rebuilt since the last lookup"""
+        stamp = data_version_stamp()
+        if stamp != self._data_version:
+            if self._entries:
+                logger.info(f"Data version changed, clearing {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._data_version = stamp
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        self._check_data_version()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        if not self.enabled:
+            return
+
+        self._check_data_version()
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SemanticCache:
+    """
+    Paraphrase cache: returns a cached answer when the question embedding is
+    within max_distance (cosine distance) of a cached question asked with the
+    same context and options. Vectors live in one preallocated, row-normalized
+    matrix; the least recently used row is overwritten when full.
+    """
+
+    def __init__(self, max_size: int = 512, max_distance: float = 0.08,
+                 ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+
+        # Allocated on first put: (max_size, dim) float32 vectors plus per-row
+        # scope, expiry and last use
+        self._vectors = None
+        self._scopes = None
+        self._expires = None
+        self._last_used = None
+        self._values: List[Any] = [None] * max_size
+        self._size = 0
+        self._clock = 0
+        self._data_version = data_version_stamp()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def scope_id(context: Optional[Dict[str, Any]] = None,
+                 options: Optional[Dict[str, Any]] = None) -> int:
+        """Answers are only shared between questions with the same context and options"""
+        return int(make_cache_key('', context, options)[:15], 16)
+
+    def _check_data_version(self):
+        stamp = data_version_stamp()
+        if stamp != self._data_version:
+            if self._size:
+                logger.info(f"Data version changed, clearing {self._size} semantic cache entries")
+            self.clear()
+            self._data_version = stamp
+
+    @staticmethod
+    def _normalize(embedding) -> Optional['np.ndarray']:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        return vector / norm
+
+    def get(self, embedding, scope: int) -> Optional[Tuple[Any, float]]:
+        """Return (cached value, cosine distance) for the closest match, if close enough"""
+        if not self.enabled:
+            return None
+
+        self._check_data_version()
+        if self._size == 0:
+            self.misses += 1
+            return None
+
+        query = self._normalize(embedding)
+        if query is None or query.shape[0] != self._vectors.shape[1]:
+            self.misses += 1
+            return None
+
+        n = self._size
+        similarities = self._vectors[:n] @ query
+        valid = (self._scopes[:n] == scope) & (self._expires[:n] >= time.monotonic())
+        similarities = np.where(valid, similarities, -np.inf)
+
+        best = int(np.argmax(similarities))
+        distance = 1.0 - float(similarities[best])
+        if not np.isfinite(similarities[best]) or distance > self.max_distance:
+            self.misses += 1
+            return None
+
+        self._clock += 1
+        self._last_used[best] = self._clock
+        self.hits += 1
+        return self._values[best], distance
+
+    def put(self, embedding, scope: int, value: Any):
+        if not self.enabled:
+            return
+
+        self._check_data_version()
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            # First entry, or the embedding model changed
+            self.clear()
+            self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            self._scopes = np.zeros(self.max_size, dtype=np.int64)
+            self._expires = np.zeros(self.max_size, dtype=np.float64)
+            self._last_used = np.zeros(self.max_size, dtype=np.int64)
+
+        if self._size < self.max_size:
+            slot = self._size
+            self._size += 1
+        else:
+            # Reuse an expired row if there is one, otherwise evict the LRU row
+            expired = np.flatnonzero(self._expires < time.monotonic())
+            slot = int(expired[0]) if expired.size else int(np.argmin(self._last_used))
+            self.evictions += 1
+
+        self._clock += 1
+        self._vectors[slot] = vector
+        self._scopes[slot] = scope
+        self._expires[slot] = time.monotonic() + self.ttl_seconds
+        self._last_used[slot] = self._clock
+        self._values[slot] = value
+
+    def clear(self):
+        self._size = 0
+        self._values = [None] * self.max_size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': self._size,
+            'max_size': self.max_size,
+            'max_distance': self.max_distance,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def _subgraph_bytes(nodes: List[Dict[str, Any]]) -> int:
+    """Approximate memory held by a list of node dicts"""
+    return sys.getsizeof(nodes) + sum(
+        sys.getsizeof(node) + sum(sys.getsizeof(value) for value in node.values()) for node in nodes
+    )
+
+
+class SubgraphCache:
+    """
+    Intra-issue trees per ticket, bounded by total bytes with LRU eviction.
+    Entries are keyed by ticket_id and the ticket's data version (written by
+    build_graph.py), so rebuilding a ticket invalidates only that ticket.
+    Tickets without a recorded version fall back to the global data version.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 2**20):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # ticket_id -> (version, nodes, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _drop(self, ticket_id: str):
+        self._bytes -= self._entries.pop(ticket_id)[2]
+
+    def lookup(self, ticket_ids: List[str]) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, str]]:
+        """
+        Cached trees of the tickets, and the current version of each miss.
+        Pass that version to `put`, so a rebuild during the fetch is not masked.
+        """
+        fallback = data_version_stamp()
+        versions = ticket_versions()
+        found, missing = {}, {}
+
+        with self._lock:
+            for ticket_id in dict.fromkeys(ticket_ids):
+                version = versions.get(ticket_id) or fallback
+                entry = self._entries.get(ticket_id)
+                if entry is not None and entry[0] == version:
+                    self._entries.move_to_end(ticket_id)
+                    found[ticket_id] = entry[1]
+                    self.hits += 1
+                    continue
+                if entry is not None:
+                    # The ticket was rebuilt since it was cached
+                    self._drop(ticket_id)
+                    self.invalidations += 1
+                missing[ticket_id] = version
+                self.misses += 1
+        return found, missing
+
+    def put(self, ticket_id: str, version: str, nodes: List[Dict[str, Any]]):
+        if not self.enabled:
+            return
+
+        size = _subgraph_bytes(nodes)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if ticket_id in self._entries:
+                self._drop(ticket_id)
+            self._entries[ticket_id] = (version, nodes, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
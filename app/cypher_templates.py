@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Cypher Templates for RAG-KG Customer Service QA System
+
+Precompiled, parameterized queries over the fixed intra-issue tree schema
+(Issue -> HAS_DESCRIPTION/HAS_COMMENT/HAS_RESOLUTION/MENTIONS_ENTITY/HAS_TAG).
+They replace LLM-written Cypher for subgraph extraction: the query text is
+constant, so Neo4j caches the plan, and all candidate tickets are fetched in
+a single UNWIND.
+"""
+
+from typing import Dict, List, Any, Optional, Tuple
+from app.query_filters import ISSUE_FILTER_FIELDS
+
+TREE_RELATIONSHIPS = ['HAS_DESCRIPTION', 'HAS_COMMENT', 'HAS_RESOLUTION', 'MENTIONS_ENTITY', 'HAS_TAG']
+
+# Each child label hangs off the Issue by exactly one tree relationship
+LABEL_RELATIONSHIPS: Dict[str, str] = {
+    'Description': 'HAS_DESCRIPTION',
+    'Comment': 'HAS_COMMENT',
+    'Resolution': 'HAS_RESOLUTION',
+    'Entity': 'MENTIONS_ENTITY',
+    'Tag': 'HAS_TAG',
+}
+
+# Cap on the nodes of a full ticket tree (fetched for the subgraph cache)
+FULL_TREE_NODES = 1000
+
+# Subtree of several tickets, restricted to $rel_types and ordered by their
+# position in $rel_types, capped at $per_ticket nodes per ticket. Each node
+# carries the node_id its embedding was stored under (generate_embeddings.py).
+TICKET_SUBTREES = """
+UNWIND $ticket_ids AS ticket_id
+MATCH (i:Issue {id: ticket_id})
+OPTIONAL MATCH (i)-[r:HAS_DESCRIPTION|HAS_COMMENT|HAS_RESOLUTION|MENTIONS_ENTITY|HAS_TAG]->(n)
+WHERE type(r) IN $rel_types
+WITH ticket_id, i, n, type(r) AS rel_type
+ORDER BY ticket_id, [idx IN range(0, size($rel_types) - 1) WHERE $rel_types[idx] = rel_type][0]
+WITH ticket_id, i,
+     [node IN collect({
+         text: CASE
+             WHEN n:Entity THEN n.type + ': ' + n.value
+             WHEN n:Tag THEN 'Tag: ' + n.name
+             ELSE n.text
+         END,
+         type: labels(n)[0],
+         node_id: CASE
+             WHEN n:Description THEN ticket_id + '_desc'
+             WHEN n:Resolution THEN ticket_id + '_res'
+             WHEN n:Comment THEN n.id
+             WHEN n:Entity THEN toLower(replace(ticket_id + '_entity_' + n.type + '_' + n.value, ' ', '_'))
+             WHEN n:Tag THEN toLower(replace(ticket_id + '_tag_' + n.name, ' ', '_'))
+         END
+     }) WHERE node.text IS NOT NULL] AS nodes
+RETURN ticket_id,
+       CASE WHEN $include_issue
+            THEN [{text: 'Title: ' + coalesce(i.title, '') + '. Status: ' + coalesce(i.status, '') +
+                         '. Priority: ' + coalesce(i.priority, ''), type: 'Issue',
+                  node_id: ticket_id + '_issue'}]
+            ELSE [] END + nodes[..$per_ticket] AS nodes
+"""
+
+# Relationship priority per query intent
+INTENT_RELATIONSHIPS: Dict[str, List[str]] = {
+    'troubleshooting': ['HAS_RESOLUTION', 'HAS_DESCRIPTION', 'HAS_COMMENT'],
+    'bug_report': ['HAS_DESCRIPTION', 'HAS_COMMENT', 'HAS_RESOLUTION', 'MENTIONS_ENTITY'],
+    'feature_request': ['HAS_DESCRIPTION', 'HAS_COMMENT', 'HAS_TAG'],
+    'general_inquiry': ['HAS_DESCRIPTION', 'HAS_RESOLUTION', 'HAS_COMMENT'],
+}
+
+# Extra relationships pulled in by the sections extracted from the query
+SECTION_RELATIONSHIPS: Dict[str, List[str]] = {
+    'issue description': ['HAS_DESCRIPTION'],
+    'root cause': ['HAS_RESOLUTION', 'HAS_COMMENT'],
+    'steps to reproduce': ['HAS_DESCRIPTION', 'HAS_COMMENT'],
+    'product': ['MENTIONS_ENTITY'],
+    'error': ['MENTIONS_ENTITY', 'HAS_TAG'],
+    'action': ['HAS_COMMENT'],
+}
+
+# Sections answered by the Issue node's own properties
+ISSUE_SECTIONS = {'issue summary', 'priority', 'status'}
+
+
+def issue_filter_clause(filters: Optional[Dict[str, Any]], alias: str = 'i') -> Tuple[str, Dict[str, Any]]:
+    """
+    WHERE condition (joined with AND, '' if none) and its parameters for the
+    product/status/priority filters on an Issue, with the property normalized
+    like app.query_filters.filter_value.
+    """
+    conditions, params = [], {}
+    for field in ISSUE_FILTER_FIELDS:
+        if not filters or field not in filters:
+            continue
+        value = filters[field]
+        prop = f"replace(replace(replace(toLower(trim(coalesce({alias}.{field}, ''))), ' ', '_'), '-', '_'), '/', '_')"
+        conditions.append(f"{prop} IN ${alias}_{field}")
+        params[f"{alias}_{field}"] = list(value) if isinstance(value, (list, tuple, set)) else [value]
+    return " AND ".join(conditions), params
+
+
+def select_template(intent: str, sections: List[str]) -> Tuple[List[str], bool]:
+    """
+    Pick the relationship types (in priority order) and whether to include the
+    Issue node, based on the query intent and its extracted sections.
+    """
+    rel_types = list(INTENT_RELATIONSHIPS.get(intent, INTENT_RELATIONSHIPS['general_inquiry']))
+    for section in sections:
+        for rel_type in SECTION_RELATIONSHIPS.get(section.lower(), []):
+            if rel_type not in rel_types:
+                rel_types.append(rel_type)
+
+    include_issue = any(section.lower() in ISSUE_SECTIONS for section in sections)
+    return rel_types, include_issue
+
+
+def select_subtree(tree: List[Dict[str, str]], rel_types: List[str], include_issue: bool,
+                   per_ticket: int) -> List[Dict[str, str]]:
+    """
+    Apply TICKET_SUBTREES' selection to a full ticket tree (fetched with all
+    TREE_RELATIONSHIPS and the Issue node), e.g. one from the subgraph cache.
+    """
+    rank = {rel_type: position for position, rel_type in enumerate(rel_types)}
+    children = [node for node in tree if LABEL_RELATIONSHIPS.get(node['type']) in rank]
+    children.sort(key=lambda node: rank[LABEL_RELATIONSHIPS[node['type']]])
+    head = [node for node in tree if node['type'] == 'Issue'] if include_issue else []
+    return head + children[:per_ticket]
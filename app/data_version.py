@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Data Version Stamps for RAG-KG Customer Service QA System
+
+The ingestion scripts bump a version stamp after rebuilding the graph or the
+vector collection; the API compares stamps to invalidate its caches. The graph
+build also records a content hash per ticket ('tickets'), so per-ticket caches
+only drop the tickets that actually changed.
+"""
+
+import json
+import os
+import time
+import uuid
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_VERSION_FILE = "data/data_version.json"
+
+# Last stamp read per file, keyed by path -> (mtime_ns, stamp, ticket versions)
+_stamp_cache: Dict[str, Any] = {}
+
+
+def data_version_path(path: Optional[str] = None) -> Path:
+    """Location of the data version file"""
+    return Path(path or os.getenv("DATA_VERSION_FILE", DEFAULT_DATA_VERSION_FILE))
+
+
+def load_data_version(path: Optional[str] = None) -> Dict[str, Any]:
+    """Load all component versions, or an empty dict if nothing was built yet"""
+    version_file = data_version_path(path)
+    try:
+        with open(version_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to read data version file {version_file}: {str(e)}")
+        return {}
+
+
+def _write_data_version(versions: Dict[str, Any], path: Optional[str] = None):
+    version_file = data_version_path(path)
+    version_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = version_file.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(versions, f, indent=2)
+    os.replace(tmp_file, version_file)
+    # Writes close together can keep the same mtime; don't serve the old stamp in this process
+    _stamp_cache.pop(str(version_file), None)
+
+
+def bump_data_version(component: str, path: Optional[str] = None,
+                      ticket_versions: Optional[Dict[str, str]] = None, replace_tickets: bool = False) -> str:
+    """
+    Record that a component ('graph', 'vectors') was rebuilt and return its new
+    version. `ticket_versions` (ticket_id -> ticket_version) are merged into the
+    per-ticket versions, or replace them after a full rebuild.
+    """
+    versions = load_data_version(path)
+
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    versions[component] = version
+    if ticket_versions is not None:
+        versions['tickets'] = {**({} if replace_tickets else versions.get('tickets', {})), **ticket_versions}
+
+    _write_data_version(versions, path)
+    logger.info(f"Data version for '{component}' bumped to {version}")
+    return version
+
+
+def ticket_version(ticket_data: Dict[str, Any]) -> str:
+    """Content hash of a parsed ticket: unchanged tickets keep their version across rebuilds"""
+    payload = json.dumps(ticket_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def data_version_stamp(path: Optional[str] = None) -> str:
+    """
+    Combined stamp over all components. The file is only re-read when its
+    mtime changes, so this is cheap enough to call on every request.
+    """
+    version_file = data_version_path(path)
+    key = str(version_file)
+    try:
+        mtime_ns = version_file.stat().st_mtime_ns
+    except OSError:
+        _stamp_cache.pop(key, None)
+        return ''
+
+    cached = _stamp_cache.get(key)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    versions = load_data_version(path)
+    stamp = "|".join(f"{k}={versions[k]}" for k in sorted(versions) if isinstance(versions[k], str))
+    _stamp_cache[key] = (mtime_ns, stamp, versions.get('tickets', {}))
+    return stamp
+
+
+def ticket_versions(path: Optional[str] = None) -> Dict[str, str]:
+    """Per-ticket versions written by the graph build (re-read only when the file changes)"""
+    data_version_stamp(path)
+    cached = _stamp_cache.get(str(data_version_path(path)))
+    return cached[2] if cached else {}
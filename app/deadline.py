@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Request Deadlines for RAG-KG Customer Service QA System
+
+A Deadline carries the remaining time budget of one request through query
+processing, retrieval and answer generation. Each stage checks whether its
+full strategy (plus the later stages) still fits and otherwise falls back to
+a cheaper one, recording the degradation for the response metadata.
+"""
+
+import os
+import time
+import logging
+from typing import Dict, List, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Budget (ms) each stage's full strategy needs, in pipeline order
+STAGE_BUDGETS_MS: Dict[str, float] = {
+    'parsing': float(os.getenv("DEADLINE_PARSING_MS", 1500)),        # LLM entity/intent parsing
+    'subgraphs': float(os.getenv("DEADLINE_SUBGRAPHS_MS", 500)),     # subgraph extraction
+    'generation': float(os.getenv("DEADLINE_GENERATION_MS", 1000)),  # answer prompt evaluation
+}
+
+
+class Deadline:
+    """Remaining time budget of one request; unbounded when budget_ms is None"""
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.budget_ms = budget_ms
+        self._expires_at = None if budget_ms is None else time.monotonic() + budget_ms / 1000
+        self.degradations: List[Dict[str, Any]] = []
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "Deadline":
+        budget_ms = (options or {}).get('deadline_ms')
+        return cls(float(budget_ms) if budget_ms is not None else None)
+
+    @property
+    def bounded(self) -> bool:
+        return self._expires_at is not None
+
+    def remaining_ms(self) -> Optional[float]:
+        if self._expires_at is None:
+            return None
+        return max(0.0, (self._expires_at - time.monotonic()) * 1000)
+
+    def _needed_ms(self, stage: str) -> float:
+        """Budget for stage and every stage after it"""
+        stages = list(STAGE_BUDGETS_MS)
+        return sum(STAGE_BUDGETS_MS[s] for s in stages[stages.index(stage):])
+
+    def affords(self, stage: str) -> bool:
+        """Whether the full strategy of stage still fits, leaving room for the later stages"""
+        remaining = self.remaining_ms()
+        return remaining is None or remaining >= self._needed_ms(stage)
+
+    def timeout(self, stage: str) -> Optional[float]:
+        """Seconds stage may take before eating into the later stages' budget"""
+        remaining = self.remaining_ms()
+        if remaining is None:
+            return None
+        reserved = self._needed_ms(stage) - STAGE_BUDGETS_MS[stage]
+        return max(0.0, remaining - reserved) / 1000
+
+    def degrade(self, stage: str, strategy: str):
+        """Record that stage fell back to a cheaper strategy"""
+        remaining = self.remaining_ms()
+        self.degradations.append({
+            'stage': stage,
+            'strategy': strategy,
+            'remaining_ms': round(remaining, 1) if remaining is not None else None
+        })
+        logger.info(f"Deadline: {stage} degraded to {strategy} ({remaining or 0:.0f}ms left)")
+
+    def summary(self) -> Dict[str, Any]:
+        remaining = self.remaining_ms()
+        return {
+            'budget_ms': self.budget_ms,
+            'remaining_ms': round(remaining, 1) if remaining is not None else None,
+            'degradations': self.degradations
+        }
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Embedding Store for RAG-KG Customer Service QA System
+
+Node embeddings on disk as one contiguous float16 matrix (embeddings.npy)
+plus an id table (ids.npy): the vector of ids[row] starts at byte
+header + row * dim * 2. Both files are opened with mmap, so opening costs
+nothing up front and uvicorn workers share the same page cache instead of
+each holding a float32 copy. Searches read the mapped matrix in blocks; only
+the block being scored is converted to float32.
+"""
+
+import os
+import logging
+from pathlib import Path
+from typing import List, Any, Callable, Optional, Tuple
+from app.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per block: bounds the float32 working copy (8192 x 768 = 24MB)
+SEARCH_BLOCK_ROWS = 8192
+
+
+def exact_top_k(matrix, queries, limit: int, rows=None, block_rows: int = SEARCH_BLOCK_ROWS,
+                score: Optional[Callable[[Any, Any], Any]] = None) -> Tuple[Any, Any]:
+    """
+    Exact inner-product top-k of each query over `matrix` (or only `rows` of
+    it), reading the matrix a block at a time. `score(queries, block)` replaces
+    the inner product (e.g. for quantized codes). Returns (row labels, scores),
+    each (queries, k), best first.
+    """
+    total = matrix.shape[0] if rows is None else len(rows)
+    k = min(limit, total)
+    best_labels = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+
+    for start in range(0, total, block_rows):
+        end = min(start + block_rows, total)
+        block_rows_ids = np.arange(start, end) if rows is None else rows[start:end]
+        block = matrix[start:end] if rows is None else matrix[block_rows_ids]
+        if score is None:
+            scores = queries @ np.asarray(block, dtype=np.float32).T
+        else:
+            scores = score(queries, block)
+
+        # Merge the block into the running top-k
+        scores = np.concatenate([best_scores, scores], axis=1)
+        labels = np.concatenate([best_labels, np.broadcast_to(block_rows_ids, (len(queries), end - start))], axis=1)
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            labels = np.take_along_axis(labels, keep, axis=1)
+        best_scores, best_labels = scores, labels
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_labels, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class EmbeddingStore:
+    """Memory-mapped float16 embedding matrix with its id table"""
+
+    MATRIX_FILE = 'embeddings.npy'
+    IDS_FILE = 'ids.npy'
+
+    def __init__(self, matrix, ids):
+        self.matrix = matrix  # (n, dim) float16, memory-mapped read-only
+        self.ids = ids  # (n,) point ids in row order, memory-mapped
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return (Path(path) / cls.MATRIX_FILE).exists() and (Path(path) / cls.IDS_FILE).exists()
+
+    @classmethod
+    def open(cls, path: str) -> 'EmbeddingStore':
+        """Map a store written by `write`; nothing is read until it is used"""
+        path = Path(path)
+        matrix = np.load(path / cls.MATRIX_FILE, mmap_mode='r')
+        ids = np.load(path / cls.IDS_FILE, mmap_mode='r')
+        if matrix.shape[0] != ids.shape[0]:
+            raise ValueError(f"Embedding store at {path} has {matrix.shape[0]} vectors but {ids.shape[0]} ids")
+        return cls(matrix, ids)
+
+    @classmethod
+    def write(cls, path: str, ids: List[Any], vectors, block_rows: int = SEARCH_BLOCK_ROWS):
+        """Write ids and vectors (any float dtype) as float16; replaces an existing store atomically"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        count, dim = len(ids), (vectors.shape[1] if len(ids) else 0)
+
+        matrix_tmp = path / f"tmp-{cls.MATRIX_FILE}"
+        matrix = np.lib.format.open_memmap(matrix_tmp, mode='w+', dtype=np.float16, shape=(count, dim))
+        for start in range(0, count, block_rows):
+            matrix[start:start + block_rows] = vectors[start:start + block_rows]
+        matrix.flush()
+        del matrix
+
+        ids_tmp = path / f"tmp-{cls.IDS_FILE}"
+        with open(ids_tmp, 'wb') as f:
+            np.save(f, np.asarray(ids))
+
+        # Workers that still map the old files keep reading them until they reopen
+        os.replace(matrix_tmp, path / cls.MATRIX_FILE)
+        os.replace(ids_tmp, path / cls.IDS_FILE)
+        logger.info(f"Wrote float16 embedding store ({count} x {dim}, {count * dim * 2 / 2**20:.1f}MB) to {path}")
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
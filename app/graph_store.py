@@ -0,0 +1,794 @@
+#!/usr/bin/env python3
+"""
+Graph Stores for RAG-KG Customer Service QA System
+
+The graph builder, the retrieval system and the data validator go through a
+GraphStore instead of talking to Neo4j directly. Two backends are available
+(GRAPH_BACKEND):
+
+- neo4j: the Neo4j server (default)
+- embedded: an in-process graph for single-node deployments. Nodes and
+  relationships are kept in compact arrays with CSR adjacency (offsets into
+  one target array, outgoing and incoming), persisted to a single .npz file
+  (GRAPH_FILE) and loaded at startup. Ticket trees are tiny, so a subtree
+  lookup is a slice of the arrays instead of a Bolt round-trip. It needs no
+  server, so tests can run without Neo4j.
+
+Only Neo4j runs free-form Cypher (SUBGRAPH_STRATEGY=llm).
+"""
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Set, Tuple
+from app.cypher_templates import TICKET_SUBTREES, TREE_RELATIONSHIPS, issue_filter_clause
+from app.lazy import lazy_import
+from app.query_filters import matches_filters
+
+np = lazy_import('numpy')
+neo4j = lazy_import('neo4j')
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GRAPH_FILE = "data/graph.npz"
+
+NODE_LABELS = ['Issue', 'Description', 'Comment', 'Resolution', 'Entity', 'Tag']
+ISSUE_RELATIONSHIPS = ['SIMILAR_TO', 'REFERENCES', 'DEPENDS_ON']
+RELATIONSHIP_TYPES = TREE_RELATIONSHIPS + ISSUE_RELATIONSHIPS
+
+
+def tree_node_id(ticket_id: str, label: str, props: Dict[str, Any]) -> Optional[str]:
+    """Node id a tree node's embedding is stored under (as in TICKET_SUBTREES)"""
+    if label == 'Issue':
+        return f"{ticket_id}_issue"
+    if label == 'Description':
+        return f"{ticket_id}_desc"
+    if label == 'Resolution':
+        return f"{ticket_id}_res"
+    if label == 'Comment':
+        return props.get('id')
+    if label == 'Entity':
+        return f"{ticket_id}_entity_{props['type']}_{props['value']}".replace(' ', '_').lower()
+    if label == 'Tag':
+        return f"{ticket_id}_tag_{props['name']}".replace(' ', '_').lower()
+    return None
+
+
+def issue_summary(issue: Dict[str, Any]) -> str:
+    """Issue node text used when a subtree includes its root"""
+    return (f"Title: {issue.get('title') or ''}. Status: {issue.get('status') or ''}. "
+            f"Priority: {issue.get('priority') or ''}")
+
+
+class GraphStore:
+    """Interface shared by the graph backends"""
+
+    backend = 'base'
+    supports_cypher = False
+
+    def connect(self):
+        """Open connections or load the graph"""
+
+    def close(self):
+        """Release connections"""
+
+    async def aclose(self):
+        self.close()
+
+    def check(self) -> bool:
+        raise NotImplementedError
+
+    async def awarm(self):
+        """Open the first connection before the first query"""
+
+    def flush(self):
+        """Make written nodes and relationships durable (no-op for servers)"""
+
+    # Writes (GraphBuilder)
+
+    def clear(self):
+        raise NotImplementedError
+
+    def add_ticket_tree(self, ticket_data: Dict[str, Any]):
+        """Issue node with its Description/Comment/Resolution/Entity/Tag children"""
+        raise NotImplementedError
+
+    def has_issue(self, ticket_id: str) -> bool:
+        raise NotImplementedError
+
+    def add_issue_link(self, source_id: str, target_id: str, rel_type: str,
+                       properties: Optional[Dict[str, Any]] = None):
+        """SIMILAR_TO (merged, undirected), REFERENCES or DEPENDS_ON between two issues"""
+        raise NotImplementedError
+
+    # Reads
+
+    def ticket_subtrees(self, ticket_ids: List[str], rel_types: List[str], include_issue: bool,
+                        per_ticket: int) -> List[Dict[str, Any]]:
+        """
+        TICKET_SUBTREES semantics: one {'ticket_id', 'nodes': [{'text', 'type', 'node_id'}]}
+        record per existing ticket, children ordered by their relationship's
+        position in `rel_types` and capped at `per_ticket`.
+        """
+        raise NotImplementedError
+
+    async def aticket_subtrees(self, ticket_ids: List[str], rel_types: List[str], include_issue: bool,
+                               per_ticket: int) -> List[Dict[str, Any]]:
+        # In-process lookups take microseconds, not worth a thread hop
+        return self.ticket_subtrees(ticket_ids, rel_types, include_issue, per_ticket)
+
+    def neighbors(self, ticket_id: str, rel_types: Optional[List[str]] = None,
+                  limit: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Issues linked to a ticket in either direction: [{'ticket_id', 'rel_type', 'properties'}],
+        restricted to linked issues matching the product/status/priority `filters` (app/query_filters.py)
+        """
+        raise NotImplementedError
+
+    def find_issues(self, products: Optional[List[str]] = None, tags: Optional[List[str]] = None,
+                    limit: int = 10, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Issue properties of tickets for any of `products`, with any of `tags` and matching `filters`"""
+        raise NotImplementedError
+
+    def issue_ids(self) -> List[str]:
+        raise NotImplementedError
+
+    def issue_degrees(self, rel_type: Optional[str] = None, direction: str = 'both') -> Dict[str, int]:
+        """Relationship count per issue, of one type ('out') or of any type in any direction ('both')"""
+        raise NotImplementedError
+
+    def label_counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def relationship_counts(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        labels = self.label_counts()
+        return {
+            'nodes': sum(labels.values()),
+            'relationships': sum(self.relationship_counts().values()),
+            'tickets': labels.get('Issue', 0)
+        }
+
+    def run_cypher(self, cypher: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError(f"The {self.backend} graph store does not run Cypher")
+
+    async def arun_cypher(self, cypher: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError(f"The {self.backend} graph store does not run Cypher")
+
+
+class Neo4jGraphStore(GraphStore):
+    """Graph store backed by a Neo4j server"""
+
+    backend = 'neo4j'
+    supports_cypher = True
+
+    def __init__(self, uri: str, user: str, password: str, max_pool_size: int = 50):
+        self.uri = uri
+        self.auth = (user, password)
+        # Connection pool shared by the API's concurrent requests
+        self.max_pool_size = max_pool_size
+        self.driver = None
+        self.async_driver = None
+
+    def connect(self):
+        self.driver = neo4j.GraphDatabase.driver(self.uri, auth=self.auth)
+        self.async_driver = neo4j.AsyncGraphDatabase.driver(
+            self.uri, auth=self.auth, max_connection_pool_size=self.max_pool_size
+        )
+
+    def close(self):
+        if self.driver:
+            self.driver.close()
+
+    async def aclose(self):
+        if self.async_driver:
+            await self.async_driver.close()
+
+    def check(self) -> bool:
+        try:
+            with self.driver.session() as session:
+                result = session.run("RETURN 'Neo4j OK' as status")
+                return result.single()['status'] == 'Neo4j OK'
+        except Exception:
+            return False
+
+    async def awarm(self):
+        await self.async_driver.verify_connectivity()
+
+    def run_cypher(self, cypher: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        with self.driver.session() as session:
+            return [dict(record) for record in session.run(cypher, params or {})]
+
+    async def arun_cypher(self, cypher: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        async with self.async_driver.session() as session:
+            result = await session.run(cypher, params or {})
+            return [dict(record) async for record in result]
+
+    def clear(self):
+        self.run_cypher("MATCH (n) DETACH DELETE n")
+
+    def add_ticket_tree(self, ticket_data: Dict[str, Any]):
+        ticket_id = ticket_data['ticket_id']
+
+        with self.driver.session() as session:
+            # Create the root issue node, or update it and drop the tree of a ticket built before
+            # (its links to other issues are kept)
+            session.run("""
+                MERGE (i:Issue {id: $id})
+                SET i.title = $title,
+                    i.description = $description,
+                    i.status = $status,
+                    i.priority = $priority,
+                    i.created_date = $created_date,
+                    i.product = $product
+                WITH i
+                OPTIONAL MATCH (i)-[r:MENTIONS_ENTITY|HAS_TAG]->()
+                DELETE r
+                WITH DISTINCT i
+                OPTIONAL MATCH (i)-[:HAS_DESCRIPTION|HAS_COMMENT|HAS_RESOLUTION]->(child)
+                DETACH DELETE child
+                """,
+                id=ticket_id,
+                title=ticket_data.get('title', ''),
+                description=ticket_data.get('description', ''),
+                status=ticket_data.get('status', ''),
+                priority=ticket_data.get('priority', ''),
+                created_date=ticket_data.get('created_date', ''),
+                product=ticket_data.get('product', '')
+            )
+
+            # Create description node
+            if ticket_data.get('description'):
+                session.run("""
+                    MATCH (i:Issue {id: $ticket_id})
+                    CREATE (i)-[:HAS_DESCRIPTION]->(d:Description {
+                        text: $text,
+                        type: 'description'
+                    })
+                    """,
+                    ticket_id=ticket_id,
+                    text=ticket_data['description']
+                )
+
+            # Create comment nodes
+            for idx, comment in enumerate(ticket_data.get('comments', [])):
+                session.run("""
+                    MATCH (i:Issue {id: $ticket_id})
+                    CREATE (i)-[:HAS_COMMENT]->(c:Comment {
+                        id: $comment_id,
+                        author: $author,
+                        text: $text,
+                        timestamp: $timestamp
+                    })
+                    """,
+                    ticket_id=ticket_id,
+                    comment_id=f"{ticket_id}_comment_{idx}",
+                    author=comment.get('author', ''),
+                    text=comment.get('text', ''),
+                    timestamp=comment.get('timestamp', '')
+                )
+
+            # Create resolution node
+            if ticket_data.get('resolution'):
+                session.run("""
+                    MATCH (i:Issue {id: $ticket_id})
+                    CREATE (i)-[:HAS_RESOLUTION]->(r:Resolution {
+                        text: $text,
+                        type: 'resolution'
+                    })
+                    """,
+                    ticket_id=ticket_id,
+                    text=ticket_data['resolution']
+                )
+
+            # Create entity nodes
+            entities = ticket_data.get('entities', {})
+            for entity_type, entity_list in entities.items():
+                for entity in entity_list:
+                    session.run("""
+                        MATCH (i:Issue {id: $ticket_id})
+                        MERGE (e:Entity {
+                            type: $entity_type,
+                            value: $value
+                        })
+                        CREATE (i)-[:MENTIONS_ENTITY]->(e)
+                        """,
+                        ticket_id=ticket_id,
+                        entity_type=entity_type,
+                        value=entity.lower()
+                    )
+
+            # Create tag nodes
+            for tag in ticket_data.get('tags', []):
+                session.run("""
+                    MATCH (i:Issue {id: $ticket_id})
+                    MERGE (t:Tag {name: $tag})
+                    CREATE (i)-[:HAS_TAG]->(t)
+                    """,
+                    ticket_id=ticket_id,
+                    tag=tag
+                )
+
+    def has_issue(self, ticket_id: str) -> bool:
+        records = self.run_cypher("MATCH (i:Issue {id: $id}) RETURN count(i) as exists", {'id': ticket_id})
+        return bool(records and records[0]['exists'] > 0)
+
+    def add_issue_link(self, source_id: str, target_id: str, rel_type: str,
+                       properties: Optional[Dict[str, Any]] = None):
+        if rel_type not in ISSUE_RELATIONSHIPS:
+            raise ValueError(f"Unknown issue relationship '{rel_type}'")
+        # SIMILAR_TO is symmetric, so it is merged without a direction
+        pattern = "MERGE (i1)-[r:SIMILAR_TO]-(i2)" if rel_type == 'SIMILAR_TO' else f"CREATE (i1)-[r:{rel_type}]->(i2)"
+        self.run_cypher(f"""
+            MATCH (i1:Issue {{id: $source_id}}), (i2:Issue {{id: $target_id}})
+            {pattern}
+            SET r += $properties
+            """,
+            {'source_id': source_id, 'target_id': target_id, 'properties': properties or {}}
+        )
+
+    def ticket_subtrees(self, ticket_ids, rel_types, include_issue, per_ticket):
+        return self.run_cypher(TICKET_SUBTREES, {
+            'ticket_ids': ticket_ids, 'rel_types': rel_types,
+            'include_issue': include_issue, 'per_ticket': per_ticket
+        })
+
+    async def aticket_subtrees(self, ticket_ids, rel_types, include_issue, per_ticket):
+        return await self.arun_cypher(TICKET_SUBTREES, {
+            'ticket_ids': ticket_ids, 'rel_types': rel_types,
+            'include_issue': include_issue, 'per_ticket': per_ticket
+        })
+
+    def neighbors(self, ticket_id, rel_types=None, limit=None, filters=None):
+        scope, scope_params = issue_filter_clause(filters, 'i2')
+        records = self.run_cypher(f"""
+            MATCH (i1:Issue {{id: $ticket_id}})-[r]-(i2:Issue)
+            WHERE type(r) IN $rel_types AND i1 <> i2{f' AND {scope}' if scope else ''}
+            RETURN i2.id as ticket_id, type(r) as rel_type, properties(r) as properties
+            {'LIMIT $limit' if limit else ''}
+            """,
+            {'ticket_id': ticket_id, 'rel_types': rel_types or ISSUE_RELATIONSHIPS, 'limit': limit, **scope_params}
+        )
+        return records
+
+    def find_issues(self, products=None, tags=None, limit=10, filters=None):
+        scope, scope_params = issue_filter_clause(filters, 'i')
+        records = self.run_cypher(f"""
+            MATCH (i:Issue)
+            WHERE ($products IS NULL OR toLower(i.product) IN $products)
+              AND ($tags IS NULL OR EXISTS {{ MATCH (i)-[:HAS_TAG]->(t:Tag) WHERE t.name IN $tags }})
+              {f'AND {scope}' if scope else ''}
+            RETURN properties(i) as issue
+            LIMIT $limit
+            """,
+            {
+                'products': [p.lower() for p in products] if products else None,
+                'tags': list(tags) if tags else None,
+                'limit': limit,
+                **scope_params
+            }
+        )
+        return [record['issue'] for record in records]
+
+    def issue_ids(self):
+        return [record['ticket_id'] for record in self.run_cypher("MATCH (i:Issue) RETURN i.id as ticket_id")]
+
+    def issue_degrees(self, rel_type=None, direction='both'):
+        if rel_type is not None and rel_type not in RELATIONSHIP_TYPES:
+            raise ValueError(f"Unknown relationship type '{rel_type}'")
+        rel = f"r:{rel_type}" if rel_type else "r"
+        pattern = f"(i)-[{rel}]->()" if direction == 'out' else f"(i)-[{rel}]-()"
+        records = self.run_cypher(f"""
+            MATCH (i:Issue)
+            OPTIONAL MATCH {pattern}
+            RETURN i.id as ticket_id, count(r) as degree
+            """)
+        return {record['ticket_id']: record['degree'] for record in records}
+
+    def label_counts(self):
+        records = self.run_cypher("MATCH (n) UNWIND labels(n) AS label RETURN label, count(*) as count")
+        return {record['label']: record['count'] for record in records}
+
+    def relationship_counts(self):
+        records = self.run_cypher("MATCH ()-[r]->() RETURN type(r) as rel_type, count(r) as count")
+        return {record['rel_type']: record['count'] for record in records}
+
+
+class EmbeddedGraphStore(GraphStore):
+    """In-process graph with CSR adjacency, persisted to one .npz file"""
+
+    backend = 'embedded'
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # Nodes: label code and properties per node id
+        self._node_labels: List[int] = []
+        self._node_props: List[Dict[str, Any]] = []
+        # Relationships in creation order (edge id = position), properties only where set
+        self._edge_src: List[int] = []
+        self._edge_dst: List[int] = []
+        self._edge_type: List[int] = []
+        self._edge_props: Dict[int, Dict[str, Any]] = {}
+        # MERGE keys
+        self._issues: Dict[str, int] = {}
+        self._entities: Dict[Tuple[str, str], int] = {}
+        self._tags: Dict[str, int] = {}
+        self._similar: Set[Tuple[int, int]] = set()
+        # Rebuilt tickets: Issue node -> first edge id of its new tree; older tree
+        # edges and their Description/Comment/Resolution nodes are purged on compaction
+        self._stale: Dict[int, int] = {}
+        # CSR adjacency: neighbours of node n are at [offsets[n], offsets[n + 1])
+        self._csr: Optional[Dict[str, Any]] = None
+        self._dirty = True
+
+    # Persistence
+
+    def connect(self):
+        self.load()
+
+    def check(self) -> bool:
+        return bool(self._node_labels is not None and len(self._node_labels))
+
+    def flush(self):
+        self.save()
+
+    def save(self):
+        """Write the node/edge arrays, CSR adjacency and properties to the graph file"""
+        with self._lock:
+            csr = self._compact()
+            meta = {
+                'labels': NODE_LABELS,
+                'rel_types': RELATIONSHIP_TYPES,
+                'node_props': self._node_props,
+                'edge_props': {str(edge): props for edge, props in self._edge_props.items()}
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f"tmp-{self.path.name}")
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f, node_labels=np.asarray(self._node_labels, dtype=np.uint8),
+                    meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8), **csr
+                )
+            os.replace(tmp_path, self.path)
+        logger.info(f"Saved embedded graph ({len(self._node_labels)} nodes, "
+                    f"{len(csr['out_targets'])} relationships) to {self.path}")
+
+    def load(self):
+        """Load the graph file; a missing file leaves the graph empty"""
+        if not self.path.exists():
+            logger.info(f"No embedded graph at {self.path}, starting empty")
+            return
+
+        with np.load(self.path) as data:
+            arrays = {name: data[name] for name in data.files}
+        meta = json.loads(arrays.pop('meta').tobytes().decode('utf-8'))
+        if meta['labels'] != NODE_LABELS or meta['rel_types'] != RELATIONSHIP_TYPES:
+            raise ValueError(f"Embedded graph at {self.path} was written with a different schema")
+
+        with self._lock:
+            self.clear()
+            self._node_labels = arrays.pop('node_labels')
+            self._node_props = meta['node_props']
+            self._edge_props = {int(edge): props for edge, props in meta['edge_props'].items()}
+            self._csr = arrays
+            self._dirty = False
+            self._edge_src = None  # edge lists are rebuilt from the CSR only if the graph is written to
+
+            issue, entity, tag = (NODE_LABELS.index(name) for name in ('Issue', 'Entity', 'Tag'))
+            for node, (label, props) in enumerate(zip(self._node_labels.tolist(), self._node_props)):
+                if label == issue:
+                    self._issues[props['id']] = node
+                elif label == entity:
+                    self._entities[(props['type'], props['value'])] = node
+                elif label == tag:
+                    self._tags[props['name']] = node
+
+        logger.info(f"Loaded embedded graph ({len(self._node_labels)} nodes, "
+                    f"{len(self._csr['out_targets'])} relationships) from {self.path}")
+
+    # Writes
+
+    def _thaw(self):
+        """Turn a loaded (array) graph back into appendable lists (caller holds the lock)"""
+        if self._edge_src is not None:
+            return
+        csr = self._csr
+        order = np.argsort(csr['out_edges'], kind='stable')
+        sources = np.repeat(np.arange(len(self._node_labels)), np.diff(csr['out_offsets']))
+        self._node_labels = self._node_labels.tolist()
+        self._edge_src = sources[order].tolist()
+        self._edge_dst = csr['out_targets'][order].tolist()
+        self._edge_type = csr['out_types'][order].tolist()
+        similar = RELATIONSHIP_TYPES.index('SIMILAR_TO')
+        self._similar = {
+            (min(src, dst), max(src, dst))
+            for src, dst, rel in zip(self._edge_src, self._edge_dst, self._edge_type) if rel == similar
+        }
+
+    def _add_node(self, label: str, props: Dict[str, Any]) -> int:
+        self._node_labels.append(NODE_LABELS.index(label))
+        self._node_props.append(props)
+        return len(self._node_labels) - 1
+
+    def _add_edge(self, src: int, dst: int, rel_type: str, props: Optional[Dict[str, Any]] = None):
+        if props:
+            self._edge_props[len(self._edge_src)] = props
+        self._edge_src.append(src)
+        self._edge_dst.append(dst)
+        self._edge_type.append(RELATIONSHIP_TYPES.index(rel_type))
+        self._dirty = True
+
+    def add_ticket_tree(self, ticket_data: Dict[str, Any]):
+        ticket_id = ticket_data['ticket_id']
+        props = {
+            'id': ticket_id,
+            'title': ticket_data.get('title', ''),
+            'description': ticket_data.get('description', ''),
+            'status': ticket_data.get('status', ''),
+            'priority': ticket_data.get('priority', ''),
+            'created_date': ticket_data.get('created_date', ''),
+            'product': ticket_data.get('product', '')
+        }
+        with self._lock:
+            self._thaw()
+            issue = self._issues.get(ticket_id)
+            if issue is None:
+                issue = self._add_node('Issue', props)
+                self._issues[ticket_id] = issue
+            else:
+                # Rebuilt ticket: keep the Issue node and its issue links, replace the tree
+                self._node_props[issue] = props
+                self._stale[issue] = len(self._edge_src)
+                self._dirty = True
+
+            if ticket_data.get('description'):
+                node = self._add_node('Description', {'text': ticket_data['description'], 'type': 'description'})
+                self._add_edge(issue, node, 'HAS_DESCRIPTION')
+
+            for idx, comment in enumerate(ticket_data.get('comments', [])):
+                node = self._add_node('Comment', {
+                    'id': f"{ticket_id}_comment_{idx}",
+                    'author': comment.get('author', ''),
+                    'text': comment.get('text', ''),
+                    'timestamp': comment.get('timestamp', '')
+                })
+                self._add_edge(issue, node, 'HAS_COMMENT')
+
+            if ticket_data.get('resolution'):
+                node = self._add_node('Resolution', {'text': ticket_data['resolution'], 'type': 'resolution'})
+                self._add_edge(issue, node, 'HAS_RESOLUTION')
+
+            for entity_type, entity_list in ticket_data.get('entities', {}).items():
+                for entity in entity_list:
+                    key = (entity_type, entity.lower())
+                    if key not in self._entities:
+                        self._entities[key] = self._add_node('Entity', {'type': key[0], 'value': key[1]})
+                    self._add_edge(issue, self._entities[key], 'MENTIONS_ENTITY')
+
+            for tag in ticket_data.get('tags', []):
+                if tag not in self._tags:
+                    self._tags[tag] = self._add_node('Tag', {'name': tag})
+                self._add_edge(issue, self._tags[tag], 'HAS_TAG')
+
+    def has_issue(self, ticket_id: str) -> bool:
+        return ticket_id in self._issues
+
+    def add_issue_link(self, source_id: str, target_id: str, rel_type: str,
+                       properties: Optional[Dict[str, Any]] = None):
+        if rel_type not in ISSUE_RELATIONSHIPS:
+            raise ValueError(f"Unknown issue relationship '{rel_type}'")
+        with self._lock:
+            self._thaw()
+            src, dst = self._issues.get(source_id), self._issues.get(target_id)
+            if src is None or dst is None:
+                return
+            if rel_type == 'SIMILAR_TO':
+                key = (min(src, dst), max(src, dst))
+                if key in self._similar:
+                    return
+                self._similar.add(key)
+            self._add_edge(src, dst, rel_type, properties)
+
+    # Reads
+
+    def _purge_stale(self):
+        """Drop the replaced trees of rebuilt tickets, renumbering nodes and edges (caller holds the lock)"""
+        labels = np.asarray(self._node_labels, dtype=np.int64)
+        src = np.asarray(self._edge_src, dtype=np.int64)
+        dst = np.asarray(self._edge_dst, dtype=np.int64)
+        types = np.asarray(self._edge_type, dtype=np.int64)
+
+        cutoff = np.full(len(labels), -1, dtype=np.int64)
+        cutoff[list(self._stale)] = list(self._stale.values())
+        tree_types = [RELATIONSHIP_TYPES.index(rel) for rel in TREE_RELATIONSHIPS]
+        dropped = np.isin(types, tree_types) & (np.arange(len(src)) < cutoff[src])
+
+        # Description/Comment/Resolution nodes belong to one ticket; Entity and Tag nodes are shared
+        owned = [NODE_LABELS.index(label) for label in ('Description', 'Comment', 'Resolution')]
+        keep_node = np.ones(len(labels), dtype=bool)
+        removed = dst[dropped]
+        keep_node[removed[np.isin(labels[removed], owned)]] = False
+        keep_edge = ~dropped & keep_node[src] & keep_node[dst]
+        renumber = np.cumsum(keep_node) - 1
+
+        kept_edges = np.flatnonzero(keep_edge)
+        new_edge = {int(old): new for new, old in enumerate(kept_edges.tolist())}
+        self._edge_props = {new_edge[edge]: props for edge, props in self._edge_props.items() if edge in new_edge}
+        self._edge_src = renumber[src[kept_edges]].tolist()
+        self._edge_dst = renumber[dst[kept_edges]].tolist()
+        self._edge_type = types[kept_edges].tolist()
+
+        self._node_labels = labels[keep_node].tolist()
+        self._node_props = [props for props, keep in zip(self._node_props, keep_node.tolist()) if keep]
+        self._issues = {key: int(renumber[node]) for key, node in self._issues.items()}
+        self._entities = {key: int(renumber[node]) for key, node in self._entities.items()}
+        self._tags = {key: int(renumber[node]) for key, node in self._tags.items()}
+        self._similar = {(int(renumber[a]), int(renumber[b])) for a, b in self._similar}
+        logger.info(f"Replaced the trees of {len(self._stale)} rebuilt tickets "
+                    f"({int((~keep_node).sum())} nodes, {int(len(src) - len(kept_edges))} relationships removed)")
+        self._stale = {}
+
+    def _compact(self) -> Dict[str, Any]:
+        """Build the CSR arrays from the edge lists if they changed (caller holds the lock)"""
+        if not self._dirty:
+            return self._csr
+        if self._stale:
+            self._purge_stale()
+        count = len(self._node_labels)
+        src = np.asarray(self._edge_src, dtype=np.int64)
+        dst = np.asarray(self._edge_dst, dtype=np.int64)
+        types = np.asarray(self._edge_type, dtype=np.uint8)
+        edges = np.arange(len(src), dtype=np.int64)
+
+        csr = {}
+        for direction, others, origin, other in (('out', 'targets', src, dst), ('in', 'sources', dst, src)):
+            order = np.argsort(origin, kind='stable')  # keeps creation order within a node
+            csr[f'{direction}_offsets'] = np.concatenate([[0], np.cumsum(np.bincount(origin, minlength=count))])
+            csr[f'{direction}_{others}'] = other[order].astype(np.int32)
+            csr[f'{direction}_types'] = types[order]
+            csr[f'{direction}_edges'] = edges[order]
+        self._csr = csr
+        self._dirty = False
+        return csr
+
+    def _adjacency(self):
+        with self._lock:
+            return self._compact()
+
+    def _node_text(self, node: int) -> Optional[str]:
+        label = NODE_LABELS[self._node_labels[node]]
+        props = self._node_props[node]
+        if label == 'Entity':
+            return f"{props['type']}: {props['value']}"
+        if label == 'Tag':
+            return f"Tag: {props['name']}"
+        return props.get('text')
+
+    def ticket_subtrees(self, ticket_ids, rel_types, include_issue, per_ticket):
+        csr = self._adjacency()
+        rank = {RELATIONSHIP_TYPES.index(rel): position
+                for position, rel in enumerate(rel_types) if rel in TREE_RELATIONSHIPS}
+
+        records = []
+        for ticket_id in ticket_ids:
+            issue = self._issues.get(ticket_id)
+            if issue is None:
+                continue
+            start, end = csr['out_offsets'][issue], csr['out_offsets'][issue + 1]
+            children = sorted(
+                (rank[rel], position, target)
+                for position, (target, rel) in enumerate(zip(csr['out_targets'][start:end].tolist(),
+                                                             csr['out_types'][start:end].tolist()))
+                if rel in rank
+            )
+            nodes = []
+            for _, _, target in children:
+                text = self._node_text(target)
+                if text is not None:
+                    label = NODE_LABELS[self._node_labels[target]]
+                    nodes.append({'text': text, 'type': label,
+                                  'node_id': tree_node_id(ticket_id, label, self._node_props[target])})
+
+            head = [{'text': issue_summary(self._node_props[issue]), 'type': 'Issue',
+                     'node_id': tree_node_id(ticket_id, 'Issue', {})}] if include_issue else []
+            records.append({'ticket_id': ticket_id, 'nodes': head + nodes[:per_ticket]})
+        return records
+
+    def neighbors(self, ticket_id, rel_types=None, limit=None, filters=None):
+        issue = self._issues.get(ticket_id)
+        if issue is None:
+            return []
+        csr = self._adjacency()
+        wanted = {RELATIONSHIP_TYPES.index(rel) for rel in (rel_types or ISSUE_RELATIONSHIPS)}
+        issue_label = NODE_LABELS.index('Issue')
+
+        results = []
+        for targets, kind in (('out_targets', 'out'), ('in_sources', 'in')):
+            start, end = csr[f'{kind}_offsets'][issue], csr[f'{kind}_offsets'][issue + 1]
+            for other, rel, edge in zip(csr[targets][start:end].tolist(), csr[f'{kind}_types'][start:end].tolist(),
+                                        csr[f'{kind}_edges'][start:end].tolist()):
+                if (rel in wanted and other != issue and self._node_labels[other] == issue_label
+                        and matches_filters(self._node_props[other], filters)):
+                    results.append({
+                        'ticket_id': self._node_props[other]['id'],
+                        'rel_type': RELATIONSHIP_TYPES[rel],
+                        'properties': self._edge_props.get(edge, {})
+                    })
+                    if limit and len(results) >= limit:
+                        return results
+        return results
+
+    def find_issues(self, products=None, tags=None, limit=10, filters=None):
+        csr = self._adjacency()
+        products = {p.lower() for p in products} if products else None
+        tag_nodes = {self._tags[t] for t in tags if t in self._tags} if tags else None
+        has_tag = RELATIONSHIP_TYPES.index('HAS_TAG')
+
+        results = []
+        for issue in self._issues.values():
+            props = self._node_props[issue]
+            if products is not None and (props.get('product') or '').lower() not in products:
+                continue
+            if not matches_filters(props, filters):
+                continue
+            if tag_nodes is not None:
+                start, end = csr['out_offsets'][issue], csr['out_offsets'][issue + 1]
+                linked = {target for target, rel in zip(csr['out_targets'][start:end].tolist(),
+                                                        csr['out_types'][start:end].tolist()) if rel == has_tag}
+                if not linked & tag_nodes:
+                    continue
+            results.append(props)
+            if len(results) >= limit:
+                break
+        return results
+
+    def issue_ids(self):
+        return list(self._issues)
+
+    def issue_degrees(self, rel_type=None, direction='both'):
+        csr = self._adjacency()
+        if rel_type is None:
+            out_degree = np.diff(csr['out_offsets'])
+            degree = out_degree + np.diff(csr['in_offsets']) if direction == 'both' else out_degree
+        else:
+            code = RELATIONSHIP_TYPES.index(rel_type)
+            sources = np.repeat(np.arange(len(self._node_labels)), np.diff(csr['out_offsets']))
+            degree = np.bincount(sources[csr['out_types'] == code], minlength=len(self._node_labels))
+            if direction == 'both':
+                targets = np.repeat(np.arange(len(self._node_labels)), np.diff(csr['in_offsets']))
+                degree = degree + np.bincount(targets[csr['in_types'] == code], minlength=len(self._node_labels))
+        return {ticket_id: int(degree[node]) for ticket_id, node in self._issues.items()}
+
+    def label_counts(self):
+        counts = np.bincount(np.asarray(self._node_labels, dtype=np.int64), minlength=len(NODE_LABELS))
+        return {label: int(count) for label, count in zip(NODE_LABELS, counts) if count}
+
+    def relationship_counts(self):
+        csr = self._adjacency()
+        counts = np.bincount(csr['out_types'].astype(np.int64), minlength=len(RELATIONSHIP_TYPES))
+        return {rel: int(count) for rel, count in zip(RELATIONSHIP_TYPES, counts) if count}
+
+
+def create_graph_store(backend: Optional[str] = None, uri: Optional[str] = None, user: Optional[str] = None,
+                       password: Optional[str] = None, path: Optional[str] = None) -> GraphStore:
+    """Graph store for GRAPH_BACKEND ('neo4j' or 'embedded'); not connected yet"""
+    backend = (backend or os.getenv("GRAPH_BACKEND", "neo4j")).lower()
+
+    if backend == 'neo4j':
+        return Neo4jGraphStore(
+            uri or os.getenv("NEO4J_URI", "bolt://localhost:7687"),
+            user or os.getenv("NEO4J_USER", "neo4j"),
+            password or os.getenv("NEO4J_PASSWORD", "password"),
+            max_pool_size=int(os.getenv("NEO4J_MAX_POOL_SIZE", 50))
+        )
+    if backend == 'embedded':
+        return EmbeddedGraphStore(path or os.getenv("GRAPH_FILE", DEFAULT_GRAPH_FILE))
+    raise ValueError(f"Unknown graph backend '{backend}' (expected 'neo4j' or 'embedded')")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Lazy Imports for RAG-KG Customer Service QA System
+
+The client libraries (ollama, neo4j, qdrant_client, numpy) are slow to import
+and not needed until a backend is actually used. `lazy_import` returns a
+stand-in that imports the module on first attribute access, so importing the
+app or running a script with --help stays fast.
+"""
+
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule:
+    """Module stand-in that imports the real module on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Defer importing a module until one of its attributes is used"""
+    return LazyModule(name)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Lexical Index for RAG-KG Customer Service QA System
+
+BM25 over the node texts written by generate_embeddings.py, keyed by the same
+point ids as the vector store. Dense embeddings match error codes ("502"),
+ticket keys and product names poorly; retrieval runs this index next to the
+vector search and fuses both rankings with reciprocal-rank fusion.
+
+Postings are kept CSR-style (per-term offsets into flat doc and term-frequency
+arrays) and persisted to one .npz file per collection under LEXICAL_INDEX_DIR.
+"""
+
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+from app.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEXICAL_INDEX_DIR = "data/lexical_index"
+
+# Words plus joined codes like "http-502", "v2.3" or "tkt_1042"
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+(?:[._\-/][0-9a-z]+)*")
+TOKEN_SEPARATORS = re.compile(r"[._\-/]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Casefolded tokens; joined codes are also indexed by their parts ("http-502" -> "http", "502")"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(str(text).casefold()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in TOKEN_SEPARATORS.split(token) if part)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], limit: int, k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Fuse ranked hit lists by the sum of 1 / (k + rank). Each fused hit is a copy
+    of its first occurrence with an added 'rrf_score'; best first.
+    """
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            entry = fused.get(hit['id'])
+            if entry is None:
+                entry = fused[hit['id']] = {**hit, 'rrf_score': 0.0}
+            entry['rrf_score'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit['rrf_score'], reverse=True)[:limit]
+
+
+class LexicalIndex:
+    """BM25 index over point payload texts"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # Build state: point id -> payload, in insertion order
+        self._docs: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        # Search state (built by _compact or loaded)
+        self.ids: List[Any] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self._terms: Dict[str, int] = {}
+        self._arrays: Optional[Dict[str, Any]] = None
+        # Payload field -> value -> doc indices, built on the first filtered search
+        self._postings: Dict[str, Dict[Any, List[int]]] = {}
+        self._dirty = False
+
+    @classmethod
+    def open(cls, path: str) -> 'LexicalIndex':
+        """Load an index written by `save`"""
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        meta = json.loads(arrays.pop('meta').tobytes().decode('utf-8'))
+
+        index = cls(meta['k1'], meta['b'])
+        index.ids = meta['ids']
+        index.payloads = meta['payloads']
+        index._terms = {term: position for position, term in enumerate(meta['terms'])}
+        index._arrays = arrays
+        logger.info(f"Loaded lexical index ({len(index.ids)} documents, {len(index._terms)} terms) from {path}")
+        return index
+
+    def __len__(self) -> int:
+        return len(self._docs) if self._dirty else len(self.ids)
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        """Index points {'id', 'payload'} by payload['text']; an existing id is replaced"""
+        if not points:
+            return
+        if not self._dirty:
+            # Thaw a loaded index back into its documents
+            self._docs = OrderedDict(zip(self.ids, self.payloads))
+            self._dirty = True
+        for point in points:
+            self._docs[point['id']] = point.get('payload') or {}
+
+    def _compact(self):
+        """Build the CSR postings from the documents"""
+        if not self._dirty:
+            return
+        self.ids = list(self._docs)
+        self.payloads = list(self._docs.values())
+        self._terms = {}
+        self._postings = {}
+
+        doc_lengths = np.zeros(len(self.ids), dtype=np.float32)
+        term_column, doc_column, tf_column = [], [], []
+        for doc, payload in enumerate(self.payloads):
+            counts = Counter(tokenize(payload.get('text', '')))
+            doc_lengths[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                term_column.append(self._terms.setdefault(term, len(self._terms)))
+                doc_column.append(doc)
+                tf_column.append(tf)
+
+        terms = np.asarray(term_column, dtype=np.int64)
+        order = np.argsort(terms, kind='stable')
+        self._arrays = {
+            'offsets': np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self._terms)))]),
+            'docs': np.asarray(doc_column, dtype=np.int32)[order],
+            'tfs': np.asarray(tf_column, dtype=np.float32)[order],
+            'doc_lengths': doc_lengths
+        }
+        self._dirty = False
+
+    def save(self, path: str):
+        """Write postings, ids and payloads to one .npz file (replaced atomically)"""
+        self._compact()
+        meta = {
+            'k1': self.k1,
+            'b': self.b,
+            'terms': list(self._terms),
+            'ids': self.ids,
+            'payloads': self.payloads
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"tmp-{path.name}")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8), **self._arrays)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved lexical index ({len(self.ids)} documents, {len(self._terms)} terms) to {path}")
+
+    def _allowed_docs(self, filters: Dict[str, Any]):
+        """Mask of the documents whose payload matches every filter (as in the vector stores)"""
+        allowed = np.ones(len(self.ids), dtype=bool)
+        for key, value in filters.items():
+            if key not in self._postings:
+                postings: Dict[Any, List[int]] = {}
+                for doc, payload in enumerate(self.payloads):
+                    if key in payload:
+                        postings.setdefault(payload[key], []).append(doc)
+                self._postings[key] = postings
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            matched = np.zeros(len(self.ids), dtype=bool)
+            for item in accepted:
+                matched[self._postings[key].get(item, [])] = True
+            allowed &= matched
+        return allowed
+
+    def search(self, text: str, limit: int, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Top-`limit` BM25 hits {'id', 'score', 'payload'} matching the payload filters, best first"""
+        self._compact()
+        if not self.ids or limit <= 0:
+            return []
+
+        arrays = self._arrays
+        doc_lengths = arrays['doc_lengths']
+        count = len(self.ids)
+        average_length = max(float(doc_lengths.mean()), 1e-6)
+        scores = np.zeros(count, dtype=np.float32)
+
+        for term in set(tokenize(text)):
+            position = self._terms.get(term)
+            if position is None:
+                continue
+            start, end = arrays['offsets'][position], arrays['offsets'][position + 1]
+            docs, tfs = arrays['docs'][start:end], arrays['tfs'][start:end]
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / average_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norms)
+
+        if filters:
+            scores[~self._allowed_docs(filters)] = 0.0
+        matched = np.flatnonzero(scores)
+        if matched.size > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [
+            {'id': self.ids[doc], 'score': float(scores[doc]), 'payload': self.payloads[doc]}
+            for doc in matched.tolist()
+        ]
+
+    def search_batch(self, texts: List[str], limit: int,
+                     filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        return [self.search(text, limit, filters) for text in texts]
+
+
+def lexical_index_path(collection_name: Optional[str] = None, index_dir: Optional[str] = None) -> Path:
+    """Index file of a collection: LEXICAL_INDEX_DIR/<collection>.npz"""
+    collection_name = collection_name or os.getenv("COLLECTION_NAME", "tickets")
+    index_dir = index_dir or os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR)
+    return Path(index_dir) / f"{collection_name}.npz"
+
+
+def load_lexical_index(collection_name: Optional[str] = None, index_dir: Optional[str] = None) -> Optional[LexicalIndex]:
+    """The collection's lexical index, or None if none was built"""
+    path = lexical_index_path(collection_name, index_dir)
+    if not path.exists():
+        logger.info(f"No lexical index at {path}, retrieval uses vector search only")
+        return None
+    return LexicalIndex.open(str(path))
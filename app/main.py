@@ -7,10 +7,15 @@ Provides REST API endpoints for querying the knowledge graph and vector database
 
 import os
 import sys
+import json
+import time
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from typing import Dict, List, Any, Optional
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import uvicorn
 from dotenv import load_dotenv
@@ -20,10 +25,17 @@ if sys.platform == 'win32':
     import asyncio
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-# Import our custom modules (commented out for testing)
+# Import our custom modules
 from app.query_processor import QueryProcessor
 from app.retrieval_system import RetrievalSystem
 from app.answer_generator import AnswerGenerator
+from app.cache import AnswerCache, SemanticCache, make_cache_key
+from app.deadline import Deadline
+from app.profiler import SamplingProfiler, profiling_allowed
+from app.warmup import Readiness, warm_up
+from app.metrics import (
+    begin_request_timings, errors_total, register_gauges, render_metrics, request_duration
+)
 
 # Load environment variables
 load_dotenv()
@@ -35,11 +47,63 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Components, built by the lifespan handler on startup
+query_processor = None
+retrieval_system = None
+answer_generator = None
+
+# Startup progress reported by /ready and /health
+readiness = Readiness()
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the components and open connections, warm up in the background, clean up on shutdown"""
+    global query_processor, retrieval_system, answer_generator, readiness
+    logger.info("Starting RAG-KG API server...")
+    readiness = Readiness()
+    try:
+        logger.info("Initializing query processor...")
+        query_processor = QueryProcessor()
+
+        logger.info("Initializing retrieval system...")
+        retrieval_system = RetrievalSystem()
+        retrieval_system.initialize()
+
+        logger.info("Initializing answer generator...")
+        answer_generator = AnswerGenerator()
+
+        logger.info("All components initialized successfully")
+    except Exception as e:
+        logger.error(f"Startup failed: {str(e)}", exc_info=True)
+        raise
+
+    # Warm up in the background so /health and /ready can report progress
+    warmup_task = None
+    if WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(
+            warm_up(query_processor, retrieval_system, answer_generator, readiness)
+        )
+    else:
+        readiness.finish()
+
+    yield
+
+    logger.info("Shutting down RAG-KG API server...")
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    try:
+        retrieval_system.close()
+        await retrieval_system.aclose()
+    except Exception as e:
+        logger.error(f"Shutdown error: {str(e)}")
+
 # Initialize FastAPI app
 app = FastAPI(
     title="RAG-KG Customer Service QA API",
     description="Retrieval-Augmented Generation with Knowledge Graphs for customer service",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware (temporarily disabled for debugging)
@@ -51,10 +115,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components (lazy initialization)
-query_processor = None
-retrieval_system = None
-answer_generator = None
+# Exact-match answer cache (ANSWER_CACHE_SIZE=0 disables it)
+answer_cache = AnswerCache(
+    max_size=int(os.getenv("ANSWER_CACHE_SIZE", 1024)),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", 3600))
+)
+
+# Batch endpoint: questions retrieved together per chunk, LLM calls bounded
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 64))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+# Paraphrase cache on question embeddings (SEMANTIC_CACHE_SIZE=0 disables it)
+semantic_cache = SemanticCache(
+    max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", 512)),
+    max_distance=float(os.getenv("SEMANTIC_CACHE_DISTANCE", 0.08)),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", 3600))
+)
+
+def cache_gauges():
+    """Cache hit ratios exported on /metrics"""
+    ratios = {
+        'exact': answer_cache.stats()['hit_ratio'],
+        'semantic': semantic_cache.stats()['hit_ratio']
+    }
+    if retrieval_system:
+        ratios['subgraph'] = retrieval_system.subgraph_cache.stats()['hit_ratio']
+    return ('rag_cache_hit_ratio', 'Hit ratio of the answer and subgraph caches', 'cache', ratios)
+
+def cache_memory_gauges():
+    """Memory held by the byte-bounded caches"""
+    sizes = {'subgraph': retrieval_system.subgraph_cache.stats()['bytes']} if retrieval_system else {}
+    return ('rag_cache_bytes', 'Approximate memory held by the subgraph cache', 'cache', sizes)
+
+register_gauges(cache_gauges)
+register_gauges(cache_memory_gauges)
+
+def cache_metadata(hit: Optional[str] = None, distance: Optional[float] = None) -> Dict[str, Any]:
+    """Cache counters reported in every query response"""
+    metadata = {
+        'hit': hit is not None,
+        'source': hit,
+        **answer_cache.stats(),
+        'semantic': semantic_cache.stats()
+    }
+    if distance is not None:
+        metadata['distance'] = round(distance, 4)
+    return metadata
 
 # Pydantic models for request/response
 class QueryRequest(BaseModel):
@@ -68,8 +174,7 @@ class QueryRequest(BaseModel):
                 "question": "How do I reset my password on the mobile app?",
                 "context": {
                     "user_id": "user123",
-                    "product": "mobile_app",
-                    "priority": "normal"
+                    "product": "mobile_app"
                 },
                 "options": {
                     "max_sources": 5,
@@ -104,73 +209,402 @@ async def test_endpoint():
     return {"status": "ok", "message": "Test endpoint working"}
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint: 'starting' until warm-up finishes, 'degraded' if a step failed"""
     return HealthResponse(
-        status="healthy",
+        status=readiness.status,
         version="1.0.0",
-        services={"test": "ok"}
+        services={step['name']: step['status'] for step in readiness.steps}
     )
 
+@app.get("/ready")
+async def ready_check():
+    """Readiness endpoint with cold-start time and warm-up steps (503 until ready)"""
+    return JSONResponse(readiness.summary(), status_code=200 if readiness.ready else 503)
+
+def format_sources(sources: List[Dict[str, Any]]) -> List[SourceInfo]:
+    """Convert retrieval results into response models"""
+    return [
+        SourceInfo(
+            ticket_id=source.get('ticket_id', ''),
+            node_type=source.get('node_type', ''),
+            text=source.get('text', ''),
+            score=source.get('score', 0.0),
+            metadata=source.get('metadata')
+        )
+        for source in sources
+    ]
+
+def build_response(answer: str, confidence: float, sources: List[Dict[str, Any]],
+                   processed_query: Dict[str, Any], processing_time: float,
+                   deadline: Optional[Deadline] = None) -> QueryResponse:
+    """Assemble the QueryResponse for a freshly processed question"""
+    response = QueryResponse(
+        answer=answer,
+        sources=format_sources(sources),
+        confidence=confidence,
+        processing_time=processing_time,
+        metadata={
+            "query_entities": processed_query.get('entities', []),
+            "intent": processed_query.get('intent'),
+            "sources_count": len(sources),
+            "processing_method": processed_query.get('processing_method'),
+            "parsing_mode": processed_query.get('parsing_mode'),
+            "llm_timings": processed_query.get('llm_timings', {}),
+            "rule_confidence": processed_query.get('rule_confidence'),
+            "llm_bypassed": processed_query.get('llm_bypassed', False),
+            "time_saved_ms": processed_query.get('time_saved_ms')
+        }
+    )
+    if deadline is not None and deadline.bounded:
+        response.metadata['deadline'] = deadline.summary()
+    return response
+
+async def lookup_caches(request: QueryRequest, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Check the exact-match cache, then the semantic cache. Returns the lookup
+    state; 'response' is set on a hit, the rest is reused by store_in_caches.
+    """
+    use_cache = options.get('use_cache', True)
+    lookup = {
+        'use_cache': use_cache,
+        'key': make_cache_key(request.question, request.context, options),
+        'scope': SemanticCache.scope_id(request.context, options),
+        'embedding': None,
+        'response': None,
+        'source': None,
+        'distance': None
+    }
+    if not use_cache:
+        return lookup
+
+    cached = answer_cache.get(lookup['key'])
+    if cached is not None:
+        lookup.update(response=cached, source='exact')
+        return lookup
+
+    if options.get('use_semantic_cache', True) and semantic_cache.enabled:
+        try:
+            lookup['embedding'] = await retrieval_system.aembed_query(request.question)
+        except Exception as e:
+            logger.warning(f"Question embedding failed, skipping semantic cache: {str(e)}")
+        match = semantic_cache.get(lookup['embedding'], lookup['scope']) if lookup['embedding'] else None
+        if match is not None:
+            cached, distance = match
+            lookup.update(response=cached, source='semantic', distance=distance)
+
+    return lookup
+
+def cached_response(lookup: Dict[str, Any], processing_time: float) -> QueryResponse:
+    """Copy of a cached response with this request's timing and cache metadata"""
+    cached = lookup['response']
+    logger.info(f"{lookup['source'].capitalize()} cache hit, served in {processing_time:.3f}s")
+    # The stage breakdown belongs to the request that generated the answer
+    metadata = {k: v for k, v in (cached.metadata or {}).items() if k != 'timings'}
+    return cached.model_copy(update={
+        'processing_time': processing_time,
+        'metadata': {**metadata, 'cache': cache_metadata(lookup['source'], lookup['distance'])}
+    })
+
+def cacheable(response: QueryResponse) -> bool:
+    """The error fallback answer (confidence 0) and answers degraded by a deadline are not cached"""
+    degraded = (response.metadata or {}).get('deadline', {}).get('degradations')
+    return response.confidence > 0 and not degraded
+
+def store_in_caches(lookup: Dict[str, Any], response: QueryResponse):
+    """Remember a generated response if it is cacheable"""
+    if lookup['use_cache'] and cacheable(response):
+        answer_cache.put(lookup['key'], response)
+        if lookup['embedding']:
+            semantic_cache.put(lookup['embedding'], lookup['scope'], response)
+
+def stage_timings(timings: Dict[str, float], processing_time: float) -> Dict[str, float]:
+    """Per-request stage breakdown (ms) reported when options.include_timings is set"""
+    return {**timings, 'total_ms': round(processing_time * 1000, 2)}
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
 @app.post("/api/v1/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
-    """Process a customer service question"""
-    import time
+async def process_query(request: QueryRequest,
+                        x_profile: Optional[str] = Header(default=None),
+                        x_admin_key: Optional[str] = Header(default=None)):
+    """
+    Process a customer service question. With 'X-Profile: true' and a valid
+    'X-Admin-Key' the request runs under the sampling profiler, bypassing the
+    caches, and metadata.profile references the saved profile.
+    """
     start_time = time.time()
+    timings = begin_request_timings()
+    profiler = None
+    if profiling_allowed(x_profile, x_admin_key):
+        profiler = SamplingProfiler()
+        profiler.start()
 
     try:
         logger.info(f"Processing query: {request.question[:100]}...")
 
+        options = request.options or {}
+        if profiler:
+            options = {**options, 'use_cache': False}
+        deadline = Deadline.from_options(options)
+
+        # Step 0: Serve repeated questions and paraphrases from the caches
+        lookup = await lookup_caches(request, options)
+        if lookup['response'] is not None:
+            request_duration.observe(time.time() - start_time, endpoint='query')
+            return cached_response(lookup, time.time() - start_time)
+
         # Step 1: Process query (entity extraction, intent detection)
-        processed_query = query_processor.process(request.question, request.context)
+        processed_query = await query_processor.aprocess(
+            request.question,
+            request.context,
+            mode=options.get('parsing_mode'),
+            bypass_threshold=options.get('rule_bypass_threshold'),
+            deadline=deadline
+        )
 
         # Step 2: Retrieve relevant information
-        sources = retrieval_system.retrieve(
+        sources = await retrieval_system.aretrieve(
             processed_query,
-            options=request.options or {}
+            options=options,
+            deadline=deadline
         )
 
         # Step 3: Generate answer
-        answer, confidence = answer_generator.generate(
+        answer, confidence = await answer_generator.agenerate(
             request.question,
             sources,
-            processed_query
+            processed_query,
+            deadline=deadline
         )
 
         processing_time = time.time() - start_time
-
-        # Format sources for response
-        formatted_sources = [
-            SourceInfo(
-                ticket_id=source.get('ticket_id', ''),
-                node_type=source.get('node_type', ''),
-                text=source.get('text', ''),
-                score=source.get('score', 0.0),
-                metadata=source.get('metadata')
-            )
-            for source in sources
-        ]
-
         logger.info(f"Query processed in {processing_time:.2f}s")
 
-        return QueryResponse(
-            answer=answer,
-            sources=formatted_sources,
-            confidence=confidence,
-            processing_time=processing_time,
-            metadata={
-                "query_entities": processed_query.get('entities', []),
-                "intent": processed_query.get('intent'),
-                "sources_count": len(sources)
-            }
-        )
+        response = build_response(answer, confidence, sources, processed_query, processing_time, deadline)
+        store_in_caches(lookup, response)
+
+        response.metadata['cache'] = cache_metadata()
+        if options.get('include_timings'):
+            response.metadata['timings'] = stage_timings(timings, processing_time)
+        if profiler:
+            await profiler.astop()
+            response.metadata['profile'] = await profiler.asave()
+        request_duration.observe(processing_time, endpoint='query')
+        return response
 
     except Exception as e:
         logger.error(f"Query processing failed: {str(e)}")
+        errors_total.inc(stage='request')
         raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
 
+    finally:
+        if profiler:
+            await profiler.astop()
+
+@app.post("/api/v1/query/stream")
+async def stream_query(request: QueryRequest):
+    """
+    Process a question and stream the result as Server-Sent Events:
+    'sources' as soon as retrieval finishes, one 'token' per generated chunk,
+    then 'done' with confidence and timing ('error' if processing fails).
+    """
+    start_time = time.time()
+    options = request.options or {}
+    deadline = Deadline.from_options(options)
+
+    async def event_stream():
+        timings = begin_request_timings()
+        try:
+            logger.info(f"Streaming query: {request.question[:100]}...")
+
+            lookup = await lookup_caches(request, options)
+            if lookup['response'] is not None:
+                response = cached_response(lookup, time.time() - start_time)
+                yield sse_event('sources', {'sources': [s.model_dump() for s in response.sources]})
+                yield sse_event('token', {'content': response.answer})
+                yield sse_event('done', {
+                    'confidence': response.confidence,
+                    'processing_time': response.processing_time,
+                    'time_to_first_token': response.processing_time,
+                    'metadata': response.metadata
+                })
+                request_duration.observe(response.processing_time, endpoint='stream')
+                return
+
+            processed_query = await query_processor.aprocess(
+                request.question,
+                request.context,
+                mode=options.get('parsing_mode'),
+                bypass_threshold=options.get('rule_bypass_threshold'),
+                deadline=deadline
+            )
+            sources = await retrieval_system.aretrieve(processed_query, options=options, deadline=deadline)
+
+            yield sse_event('sources', {
+                'sources': [s.model_dump() for s in format_sources(sources)],
+                'retrieval_time': time.time() - start_time
+            })
+
+            time_to_first_token = None
+            answer, confidence, tokens = '', 0.0, 0
+            async for event in answer_generator.astream(request.question, sources, processed_query,
+                                                        deadline=deadline):
+                if event['type'] == 'token':
+                    if time_to_first_token is None:
+                        time_to_first_token = time.time() - start_time
+                    yield sse_event('token', {'content': event['content']})
+                else:
+                    answer, confidence, tokens = event['answer'], event['confidence'], event['tokens']
+
+            processing_time = time.time() - start_time
+            logger.info(f"Query streamed in {processing_time:.2f}s (first token after {time_to_first_token or 0:.2f}s)")
+
+            response = build_response(answer, confidence, sources, processed_query, processing_time, deadline)
+            store_in_caches(lookup, response)
+            response.metadata['cache'] = cache_metadata()
+            if options.get('include_timings'):
+                response.metadata['timings'] = stage_timings(timings, processing_time)
+            request_duration.observe(processing_time, endpoint='stream')
+
+            yield sse_event('done', {
+                'confidence': confidence,
+                'processing_time': processing_time,
+                'time_to_first_token': time_to_first_token,
+                'tokens': tokens,
+                'metadata': response.metadata
+            })
+
+        except Exception as e:
+            logger.error(f"Streaming query failed: {str(e)}")
+            errors_total.inc(stage='request')
+            yield sse_event('error', {'detail': f"Query processing failed: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def answer_batch_chunk(requests: List[QueryRequest], semaphore: asyncio.Semaphore):
+    """
+    Answer distinct questions of one batch chunk, yielding (request position,
+    response or error) as they complete. Retrieval is shared across the chunk.
+    """
+    # Processing times include parsing and the shared retrieval, as for /api/v1/query
+    start_time = time.time()
+    options_list = [request.options or {} for request in requests]
+    deadlines = [Deadline.from_options(options) for options in options_list]
+
+    async def parse(request: QueryRequest, options: Dict[str, Any], deadline: Deadline):
+        async with semaphore:
+            return await query_processor.aprocess(
+                request.question, request.context,
+                mode=options.get('parsing_mode'),
+                bypass_threshold=options.get('rule_bypass_threshold'),
+                deadline=deadline
+            )
+
+    processed_queries = await asyncio.gather(
+        *(parse(request, options, deadline)
+          for request, options, deadline in zip(requests, options_list, deadlines)),
+        return_exceptions=True
+    )
+    parsed = [i for i, pq in enumerate(processed_queries) if not isinstance(pq, Exception)]
+    for i, pq in enumerate(processed_queries):
+        if isinstance(pq, Exception):
+            yield i, pq
+
+    sources_list = await retrieval_system.aretrieve_many(
+        [processed_queries[i] for i in parsed],
+        [options_list[i] for i in parsed],
+        [deadlines[i] for i in parsed]
+    )
+
+    async def answer(i: int, sources: List[Dict[str, Any]]):
+        try:
+            async with semaphore:
+                answer_text, confidence = await answer_generator.agenerate(
+                    requests[i].question, sources, processed_queries[i], deadline=deadlines[i]
+                )
+            return i, build_response(answer_text, confidence, sources, processed_queries[i],
+                                     time.time() - start_time, deadlines[i])
+        except Exception as e:
+            return i, e
+
+    for next_done in asyncio.as_completed([answer(i, sources) for i, sources in zip(parsed, sources_list)]):
+        yield await next_done
+
+@app.post("/api/v1/query/batch")
+async def process_query_batch(requests: List[QueryRequest]):
+    """
+    Process a list of questions and stream one JSON line per question
+    (application/x-ndjson) as answers complete, in completion order.
+    Identical questions are answered once; embeddings, vector searches and
+    subgraph lookups are shared per chunk of BATCH_CHUNK_SIZE questions.
+    """
+    def result_line(index: int, result) -> str:
+        if isinstance(result, Exception):
+            return json.dumps({'index': index, 'error': f"Query processing failed: {str(result)}"}) + "\n"
+        return json.dumps({'index': index, 'response': result.model_dump()}, default=str) + "\n"
+
+    async def result_stream():
+        start_time = time.time()
+        # Deduplicate: cache key -> positions of the identical questions
+        positions: Dict[str, List[int]] = {}
+        unique: List[QueryRequest] = []
+        for index, request in enumerate(requests):
+            key = make_cache_key(request.question, request.context, request.options)
+            if key not in positions:
+                positions[key] = []
+                unique.append(request)
+            positions[key].append(index)
+        keys = list(positions)
+        logger.info(f"Batch of {len(requests)} questions, {len(unique)} distinct")
+
+        # Serve what the answer cache already has
+        pending = []
+        for key, request in zip(keys, unique):
+            use_cache = (request.options or {}).get('use_cache', True)
+            cached = answer_cache.get(key) if use_cache else None
+            if cached is not None:
+                for index in positions[key]:
+                    yield result_line(index, cached)
+            else:
+                pending.append((key, request))
+
+        semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+        chunk_size = max(1, BATCH_CHUNK_SIZE)
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            # Chunk positions already answered: a failing chunk only reports the rest
+            emitted = set()
+            try:
+                async for position, result in answer_batch_chunk([r for _, r in chunk], semaphore):
+                    key, request = chunk[position]
+                    if not isinstance(result, Exception):
+                        if (request.options or {}).get('use_cache', True) and cacheable(result):
+                            answer_cache.put(key, result)
+                    emitted.add(position)
+                    for index in positions[key]:
+                        yield result_line(index, result)
+            except Exception as e:
+                logger.error(f"Batch chunk failed: {str(e)}")
+                errors_total.inc(stage='request')
+                for position, (key, _) in enumerate(chunk):
+                    if position in emitted:
+                        continue
+                    for index in positions[key]:
+                        yield result_line(index, e)
+
+        request_duration.observe(time.time() - start_time, endpoint='batch')
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
 @app.get("/api/v1/stats")
-async def get_stats():
-    """Get system statistics"""
+def get_stats():
+    """Get system statistics (sync handler, runs in the threadpool)"""
     try:
         stats = retrieval_system.get_stats()
         return {
@@ -183,40 +617,10 @@ async def get_stats():
         logger.error(f"Stats retrieval failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Stats retrieval failed")
 
-# @app.on_event("startup")
-# async def startup_event():
-#     """Initialize components on startup"""
-#     global query_processor, retrieval_system, answer_generator
-#     logger.info("Starting RAG-KG API server...")
-#     try:
-#         # Initialize components
-#         logger.info("Initializing query processor...")
-#         query_processor = QueryProcessor()
-#         logger.info("Query processor initialized")
-
-#         logger.info("Initializing retrieval system...")
-#         retrieval_system = RetrievalSystem()
-#         retrieval_system.initialize()
-#         logger.info("Retrieval system initialized")
-
-#         logger.info("Initializing answer generator...")
-#         answer_generator = AnswerGenerator()
-#         logger.info("Answer generator initialized")
-
-#         logger.info("All components initialized successfully")
-#     except Exception as e:
-#         logger.error(f"Startup failed: {str(e)}", exc_info=True)
-#         raise
-
-# @app.on_event("shutdown")
-# async def shutdown_event():
-#     """Cleanup on shutdown"""
-#     logger.info("Shutting down RAG-KG API server...")
-#     try:
-#         retrieval_system.close()
-#         logger.info("Connections closed")
-#     except Exception as e:
-#         logger.error(f"Shutdown error: {str(e)}")
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus metrics in the text exposition format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     uvicorn.run(
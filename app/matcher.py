@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Rule-based Matcher for RAG-KG Customer Service QA System
+
+Compiles the entity and intent vocabularies into a single regex alternation
+so every entity hit and intent vote is found in one pass over the text.
+Shared by the query processor (API) and the ticket parser (ingestion).
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional
+
+PRODUCT_TERMS = [
+    'mobile app', 'web portal', 'api', 'desktop client', 'mobile website',
+    'ios', 'android', 'windows', 'mac', 'linux',
+    'browser', 'chrome', 'firefox', 'safari', 'edge'
+]
+
+ERROR_TERMS = [
+    'error', 'exception', 'failed', 'crash', 'bug',
+    '404', '500', '403', '401', '502',
+    'null', 'undefined', 'timeout', 'connection'
+]
+
+# Query entity vocabularies (QueryProcessor)
+QUERY_ENTITY_TERMS: Dict[str, List[str]] = {
+    'product': PRODUCT_TERMS,
+    'error': ERROR_TERMS,
+    'action': [
+        'login', 'logout', 'click', 'submit', 'upload', 'download',
+        'reset', 'change', 'update', 'create', 'delete'
+    ]
+}
+
+# Intent vocabularies; each hit is one vote for the intent
+INTENT_TERMS: Dict[str, List[str]] = {
+    'troubleshooting': [
+        'problem', 'issue', 'error', 'not working', 'broken', 'stuck',
+        'help', 'fix', 'solve', 'resolve'
+    ],
+    'feature_request': [
+        'add', 'implement', 'feature', 'enhancement', 'improvement',
+        'would like', 'need', 'want', 'missing'
+    ],
+    'bug_report': [
+        'bug', 'defect', 'crash', 'freeze', 'hang',
+        'report', 'found', 'discovered', 'experienced'
+    ],
+    'general_inquiry': [
+        'how', 'what', 'when', 'where', 'why', 'can i', 'do you',
+        'information', 'details', 'explain', 'tell me'
+    ]
+}
+
+# Ticket entity vocabularies (TicketParser)
+TICKET_ENTITY_TERMS: Dict[str, List[str]] = {
+    'products': PRODUCT_TERMS,
+    'errors': ERROR_TERMS,
+    'actions': [
+        'login', 'logout', 'click', 'submit', 'upload', 'download', 'search', 'refresh',
+        'clear cache', 'restart', 'update', 'install', 'uninstall'
+    ]
+}
+
+# Explicit ticket references such as CS-123 (case-sensitive)
+TICKET_ENTITY_PATTERNS: Dict[str, List[str]] = {
+    'references': [r'(?-i:[A-Z]+-\d+)']
+}
+
+# Issue types are detected by word prefix ('auth' matches 'authentication')
+ISSUE_TYPE_STEMS: Dict[str, List[str]] = {
+    'authentication': ['login', 'password', 'auth'],
+    'payment': ['payment', 'billing', 'charge'],
+    'performance': ['slow', 'performance', 'hang'],
+    'bug': ['crash', 'error', 'bug']
+}
+
+INTENT_PREFIX = 'intent:'
+
+
+class Matcher:
+    """
+    All vocabularies compiled into one regex shaped like a trie, so the regex
+    engine branches on each character instead of trying every term in turn.
+    Each distinct term ends in its own (empty) named group that maps to every
+    category containing the term, so overlapping vocabularies still need a
+    single scan. At a given position patterns win over terms, longer terms
+    over shorter ones, and exact terms over stems.
+    """
+
+    def __init__(self, terms: Dict[str, List[str]],
+                 stems: Optional[Dict[str, List[str]]] = None,
+                 patterns: Optional[Dict[str, List[str]]] = None):
+        term_categories: Dict[str, List[str]] = {}
+        stem_categories: Dict[str, List[str]] = {}
+        for category, words in terms.items():
+            for word in words:
+                term_categories.setdefault(" ".join(word.lower().split()), []).append(category)
+        for category, words in (stems or {}).items():
+            for word in words:
+                stem_categories.setdefault(word.lower(), []).append(category)
+
+        # A term that starts with a stem hides the stem at that position,
+        # so the term also counts for the stem's categories
+        for term, categories in term_categories.items():
+            for stem, stem_cats in stem_categories.items():
+                if ' ' not in term and term.startswith(stem):
+                    categories.extend(c for c in stem_cats if c not in categories)
+
+        # group name -> (canonical value or None for the matched text, categories, lowercase?)
+        self._groups: Dict[str, tuple] = {}
+
+        alternatives = []
+        for category, regexes in (patterns or {}).items():
+            for regex in regexes:
+                alternatives.append(f"{regex}{self._group(None, [category], lowercase=False)}")
+
+        trie: Dict[str, Any] = {}
+        for word in set(term_categories) | set(stem_categories):
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = word
+        if trie:
+            alternatives.append(self._emit(trie, term_categories, stem_categories))
+
+        self.regex = re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+    def _group(self, canonical: Optional[str], categories: List[str], lowercase: bool = True) -> str:
+        name = f"g{len(self._groups)}"
+        self._groups[name] = (canonical, categories, lowercase)
+        return f"(?P<{name}>)"
+
+    def _emit(self, node: Dict[str, Any], term_categories: Dict[str, List[str]],
+              stem_categories: Dict[str, List[str]]) -> str:
+        """Regex for a trie node: longer continuations first, then the word ending here"""
+        alternatives = []
+        for char in sorted(k for k in node if k):
+            edge = r'\s+' if char == ' ' else re.escape(char)
+            alternatives.append(edge + self._emit(node[char], term_categories, stem_categories))
+
+        word = node.get('')
+        if word is not None:
+            if word in term_categories:
+                alternatives.append(self._group(word, term_categories[word]))
+            if word in stem_categories:
+                # The exact word is already covered by the term group
+                suffix = r'\w+' if word in term_categories else r'\w*'
+                alternatives.append(suffix + self._group(None, stem_categories[word]))
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    def scan(self, text: str) -> Dict[str, List[str]]:
+        """Return category -> matched values (with repeats) in one pass over text"""
+        hits: Dict[str, List[str]] = {}
+        for match in self.regex.finditer(text):
+            canonical, categories, lowercase = self._groups[match.lastgroup]
+            value = canonical or (match.group(0).lower() if lowercase else match.group(0))
+            for category in categories:
+                hits.setdefault(category, []).append(value)
+        return hits
+
+
+def unique(values: List[str]) -> List[str]:
+    """Deduplicate matched values, keeping first-seen order"""
+    return list(dict.fromkeys(values))
+
+
+def pick_intent(hits: Dict[str, List[str]], default: str = 'general_inquiry') -> str:
+    """Intent with the most votes; ties go to the earlier intent in INTENT_TERMS"""
+    best, best_votes = default, 0
+    for intent in INTENT_TERMS:
+        votes = len(hits.get(INTENT_PREFIX + intent, []))
+        if votes > best_votes:
+            best, best_votes = intent, votes
+    return best
+
+
+@lru_cache(maxsize=None)
+def query_matcher() -> Matcher:
+    """Matcher for query entities and intent votes, compiled on first use"""
+    intents = {INTENT_PREFIX + intent: words for intent, words in INTENT_TERMS.items()}
+    return Matcher({**QUERY_ENTITY_TERMS, **intents})
+
+
+@lru_cache(maxsize=None)
+def ticket_matcher() -> Matcher:
+    """Matcher for ticket entities, references and issue types, compiled on first use"""
+    return Matcher(TICKET_ENTITY_TERMS, stems=ISSUE_TYPE_STEMS, patterns=TICKET_ENTITY_PATTERNS)
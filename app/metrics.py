@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Metrics for RAG-KG Customer Service QA System
+
+In-process counters and histograms rendered in the Prometheus text format by
+the /metrics endpoint. Every dependency call (Ollama, vector store, graph) is timed
+with `track(stage)`; the same timings are summed per request so a response can
+report its own stage breakdown.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Callable, Iterator, Optional, Tuple
+
+# Dependency behind each tracked stage
+STAGE_DEPENDENCIES: Dict[str, str] = {
+    'llm_parsing': 'ollama',
+    'embedding': 'ollama',
+    'vector_search': 'qdrant',
+    'cypher_generation': 'ollama',
+    'graph_query': 'neo4j',
+    'answer_generation': 'ollama',
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage breakdown (stage -> ms) of the request running in the current task
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_timings', default=None)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # key -> bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+request_duration = Histogram(
+    'rag_request_duration_seconds', 'End-to-end request latency', ('endpoint',)
+)
+stage_duration = Histogram(
+    'rag_stage_duration_seconds', 'Latency of each dependency call by pipeline stage',
+    ('stage', 'dependency')
+)
+errors_total = Counter(
+    'rag_errors_total', 'Failed requests and dependency calls', ('stage',)
+)
+tokens_generated_total = Counter(
+    'rag_tokens_generated_total', 'Tokens generated by the LLM', ('stage',)
+)
+
+# Callables returning (name, help, label name, {label value: value}) at scrape time
+_gauge_collectors: List[Callable[[], Tuple[str, str, str, Dict[str, float]]]] = []
+
+
+def register_gauges(collector: Callable[[], Tuple[str, str, str, Dict[str, float]]]):
+    """Register a callable returning (metric name, help, label name, {label value: value})"""
+    _gauge_collectors.append(collector)
+
+
+def set_stage_dependency(stage: str, dependency: str):
+    """Label a stage with the backend actually serving it (e.g. the configured vector store)"""
+    STAGE_DEPENDENCIES[stage] = dependency
+
+
+def record_stage(stage: str, seconds: float):
+    """Record one dependency call in the histogram and the current request's breakdown"""
+    stage_duration.observe(seconds, stage=stage, dependency=STAGE_DEPENDENCIES.get(stage, 'internal'))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+
+@contextmanager
+def track(stage: str) -> Iterator[None]:
+    """Time one dependency call; failures are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def count_tokens(stage: str, response: Any):
+    """Add the eval_count of an Ollama response to the generated token counter"""
+    try:
+        tokens = response.get('eval_count') or 0
+    except AttributeError:
+        return
+    if tokens:
+        tokens_generated_total.inc(tokens, stage=stage)
+
+
+def begin_request_timings() -> Dict[str, float]:
+    """Start collecting the stage breakdown of the current request"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in (request_duration, stage_duration, errors_total, tokens_generated_total):
+        lines.extend(metric.render())
+
+    for collector in _gauge_collectors:
+        name, help_text, label, values = collector()
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for label_value, value in sorted(values.items()):
+            lines.append(f'{name}{{{label}="{label_value}"}} {value}')
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Request Profiler for RAG-KG Customer Service QA System
+
+A small sampling profiler for profiling a single API request in production:
+a background thread samples the stack of the thread serving the request at
+a fixed interval. The result is saved as collapsed stacks (flamegraph.pl /
+speedscope input) and a top-N table of functions by cumulative time.
+
+The API serves requests on one event loop thread, so samples taken while
+other requests are running include their work too; time spent waiting on
+Ollama, Neo4j or Qdrant shows up as the event loop's selector.
+"""
+
+import os
+import sys
+import asyncio
+import time
+import uuid
+import hmac
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_DIR = "data/profiles"
+
+
+def profiling_allowed(requested: Optional[str], admin_key: Optional[str]) -> bool:
+    """Profiling needs the X-Profile header and a matching ADMIN_API_KEY (unset disables it)"""
+    if not requested or requested.lower() not in ('1', 'true', 'yes'):
+        return False
+
+    expected = os.getenv("ADMIN_API_KEY", "")
+    if not expected or not admin_key or not hmac.compare_digest(expected, admin_key):
+        logger.warning("Profiling requested without a valid admin key, ignoring")
+        return False
+    return True
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread from a background thread"""
+
+    def __init__(self, thread_id: Optional[int] = None, interval_ms: Optional[float] = None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = float(interval_ms or os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+        self.samples: Counter = Counter()  # root-first stack tuple -> sample count
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self._started_at
+
+    async def astop(self):
+        """Stop sampling without blocking the event loop on the thread join"""
+        await asyncio.to_thread(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """One 'root;...;leaf count' line per distinct stack"""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+    def top(self, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Functions by cumulative time (samples with the function anywhere on the stack)"""
+        n = n or int(os.getenv("PROFILE_TOP_N", 25))
+        cumulative: Counter = Counter()
+        own: Counter = Counter()
+        for stack, count in self.samples.items():
+            for label in set(stack):
+                cumulative[label] += count
+            own[stack[-1]] += count
+
+        total = sum(self.samples.values()) or 1
+        # Samples can arrive later than the interval (the GIL), so spread the
+        # measured duration over the samples taken
+        sample_ms = self.duration * 1000 / total if self.duration else self.interval * 1000
+        return [
+            {
+                'function': label,
+                'cumulative_ms': round(count * sample_ms, 1),
+                'self_ms': round(own[label] * sample_ms, 1),
+                'cumulative_pct': round(100 * count / total, 1)
+            }
+            for label, count in cumulative.most_common(n)
+        ]
+
+    def save(self, directory: Optional[str] = None) -> Dict[str, Any]:
+        """Write the collapsed stacks and the top-N table; returns the reference for metadata"""
+        profile_dir = Path(directory or os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR))
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+        collapsed_path = profile_dir / f"{profile_id}.collapsed"
+        collapsed_path.write_text(self.collapsed(), encoding='utf-8')
+
+        top = self.top()
+        rows = [f"{'cumulative_ms':>14} {'self_ms':>10} {'cum_%':>6}  function"]
+        rows += [
+            f"{row['cumulative_ms']:>14} {row['self_ms']:>10} {row['cumulative_pct']:>6}  {row['function']}"
+            for row in top
+        ]
+        top_path = profile_dir / f"{profile_id}.top.txt"
+        top_path.write_text("\n".join(rows) + "\n", encoding='utf-8')
+
+        logger.info(f"Saved request profile {profile_id} ({sum(self.samples.values())} samples)")
+        return {
+            'id': profile_id,
+            'collapsed_path': str(collapsed_path),
+            'top_path': str(top_path),
+            'samples': sum(self.samples.values()),
+            'interval_ms': self.interval * 1000,
+            'duration_ms': round(self.duration * 1000, 1),
+            'top': top[:5]
+        }
+
+    async def asave(self, directory: Optional[str] = None) -> Dict[str, Any]:
+        """Async version of `save`: the profile files are written in a worker thread"""
+        return await asyncio.to_thread(self.save, directory)
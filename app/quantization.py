@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Vector Quantization for RAG-KG Customer Service QA System
+
+Compressed codes for the local vector index (VECTOR_QUANTIZATION):
+
+- int8: one byte per dimension, scaled per dimension (4x smaller than float32)
+- binary: one bit per dimension, the sign (32x smaller); coarse, meant for
+  pre-filtering candidates
+
+Search scans the codes for `limit * QUANTIZATION_OVERSAMPLING` candidates and
+rescores them with the original vectors from the float16 embedding store.
+"""
+
+import math
+from typing import Any, List, Optional
+from app.embedding_store import SEARCH_BLOCK_ROWS, exact_top_k
+from app.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+QUANTIZATION_KINDS = ('none', 'int8', 'binary')
+
+
+class ScalarQuantizer:
+    """Symmetric int8 codes with one scale per dimension"""
+
+    kind = 'int8'
+    code_dtype = 'int8'
+
+    def __init__(self, scales: Optional[List[float]] = None):
+        self.scales = np.asarray(scales, dtype=np.float32) if scales is not None else None
+
+    def fit(self, matrix, block_rows: int = SEARCH_BLOCK_ROWS):
+        """Scale each dimension so its largest absolute value maps to 127"""
+        peak = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, matrix.shape[0], block_rows):
+            block = np.abs(np.asarray(matrix[start:start + block_rows], dtype=np.float32))
+            peak = np.maximum(peak, block.max(axis=0))
+        self.scales = np.maximum(peak, 1e-12) / 127
+        return self
+
+    def code_width(self, dim: int) -> int:
+        return dim
+
+    def encode(self, block):
+        return np.clip(np.rint(np.asarray(block, dtype=np.float32) / self.scales), -127, 127).astype(np.int8)
+
+    def prepare(self, queries):
+        # Folding the scales into the query makes a code dot product approximate the real one
+        return queries * self.scales
+
+    @staticmethod
+    def score_block(queries, codes):
+        return queries @ np.asarray(codes, dtype=np.float32).T
+
+    def state(self) -> dict:
+        return {'kind': self.kind, 'scales': self.scales.tolist()}
+
+
+class BinaryQuantizer:
+    """Sign bits packed eight dimensions per byte; queries stay full precision"""
+
+    kind = 'binary'
+    code_dtype = 'uint8'
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+
+    def fit(self, matrix, block_rows: int = SEARCH_BLOCK_ROWS):
+        self.dim = matrix.shape[1]
+        return self
+
+    def code_width(self, dim: int) -> int:
+        return (dim + 7) // 8
+
+    def encode(self, block):
+        return np.packbits(np.asarray(block) > 0, axis=1)
+
+    def prepare(self, queries):
+        return queries
+
+    def score_block(self, queries, codes):
+        # Unpack to +-1 so the scan is one matrix product (asymmetric: the query is not binarized)
+        signs = np.unpackbits(np.asarray(codes), axis=1, count=self.dim).astype(np.float32) * 2 - 1
+        return queries @ signs.T
+
+    def state(self) -> dict:
+        return {'kind': self.kind, 'dim': self.dim}
+
+
+def create_quantizer(kind: Optional[str]):
+    """Quantizer for a kind in QUANTIZATION_KINDS ('none' -> None)"""
+    kind = (kind or 'none').lower()
+    if kind == 'none':
+        return None
+    if kind == 'int8':
+        return ScalarQuantizer()
+    if kind == 'binary':
+        return BinaryQuantizer()
+    raise ValueError(f"Unknown quantization '{kind}' (expected one of {', '.join(QUANTIZATION_KINDS)})")
+
+
+def load_quantizer(state: Optional[dict]):
+    """Quantizer from a saved `state()`"""
+    if not state:
+        return None
+    if state['kind'] == 'int8':
+        return ScalarQuantizer(state['scales'])
+    if state['kind'] == 'binary':
+        return BinaryQuantizer(state['dim'])
+    raise ValueError(f"Unknown saved quantization '{state['kind']}'")
+
+
+def quantized_top_k(quantizer, codes, matrix, queries, limit: int, oversampling: float, rows=None):
+    """
+    Scan the codes for `limit * oversampling` candidates per query, then
+    rescore them with the original vectors. Returns (row labels, scores),
+    best first, like exact_top_k.
+    """
+    candidates = max(limit, math.ceil(limit * oversampling))
+    labels, _ = exact_top_k(codes, quantizer.prepare(queries), candidates, rows, score=quantizer.score_block)
+    return rescore(matrix, queries, labels, limit)
+
+
+def rescore(matrix, queries, labels, limit: int):
+    """Exact scores of each query's candidate rows; keeps the best `limit`"""
+    gathered = np.asarray(matrix[labels.ravel()], dtype=np.float32).reshape(labels.shape + (matrix.shape[1],))
+    scores = np.einsum('bd,bcd->bc', queries, gathered)
+    order = np.argsort(-scores, axis=1)[:, :limit]
+    return np.take_along_axis(labels, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def encode_blocks(quantizer, matrix, out, block_rows: int = SEARCH_BLOCK_ROWS) -> Any:
+    """Encode `matrix` into the preallocated `out` codes array a block at a time"""
+    for start in range(0, matrix.shape[0], block_rows):
+        out[start:start + block_rows] = quantizer.encode(matrix[start:start + block_rows])
+    return out
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Query Filters for RAG-KG Customer Service QA System
+
+Turns the scope a client sends in QueryRequest.context (product, status,
+priority, section) into payload filters. They are applied in the searches
+themselves: Qdrant payload filters over indexed fields, the local index and
+BM25 postings, and WHERE clauses in the graph store's Issue lookups.
+
+Ticket fields are written to the vector payloads as normalized keys
+("Mobile App" -> "mobile_app", "Work-in-Progress" -> "work_in_progress"), so
+context values match whatever casing the ticket source used.
+"""
+
+import logging
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ticket fields copied into every node payload and filterable from the context
+ISSUE_FILTER_FIELDS = ['product', 'status', 'priority']
+
+# Payload fields indexed by generate_embeddings.py
+PAYLOAD_INDEX_FIELDS = ['ticket_id', 'node_type'] + ISSUE_FILTER_FIELDS
+
+# Context sections -> node types searched
+SECTION_NODE_TYPES: Dict[str, List[str]] = {
+    'issue': ['Issue'],
+    'issue_summary': ['Issue'],
+    'summary': ['Issue'],
+    'description': ['Description'],
+    'issue_description': ['Description'],
+    'steps_to_reproduce': ['Description'],
+    'comment': ['Comment'],
+    'comments': ['Comment'],
+    'resolution': ['Resolution'],
+    'root_cause': ['Resolution'],
+    'solution': ['Resolution'],
+    'entity': ['Entity'],
+    'tag': ['Tag'],
+}
+
+
+def filter_value(value: Any) -> str:
+    """Normalized key of a ticket field value: casefolded, words joined by '_'"""
+    text = "_".join(str(value).split()).casefold()
+    return text.replace('-', '_').replace('/', '_')
+
+
+def ticket_filter_payload(ticket_data: Dict[str, Any]) -> Dict[str, str]:
+    """Normalized product/status/priority of a ticket, for its node payloads"""
+    return {
+        field: filter_value(ticket_data[field])
+        for field in ISSUE_FILTER_FIELDS
+        if ticket_data.get(field)
+    }
+
+
+def _values(value: Any) -> List[Any]:
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [v for v in values if v not in (None, '')]
+
+
+def query_filters(context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Payload filters from a query context: 'product' (or 'products'), 'status',
+    'priority' and 'section' (or 'node_type'). A field maps to one value or a
+    list of accepted values; unknown sections are ignored.
+    """
+    if not isinstance(context, dict):
+        return {}
+
+    filters: Dict[str, Any] = {}
+    for field in ISSUE_FILTER_FIELDS:
+        values = _values(context.get(field) or context.get(f"{field}s"))
+        if values:
+            keys = list(dict.fromkeys(filter_value(v) for v in values))
+            filters[field] = keys[0] if len(keys) == 1 else keys
+
+    node_types = []
+    for section in _values(context.get('section') or context.get('node_type')):
+        types = SECTION_NODE_TYPES.get(filter_value(section))
+        if types is None and str(section) in {t for types in SECTION_NODE_TYPES.values() for t in types}:
+            types = [str(section)]
+        if types is None:
+            logger.warning(f"Ignoring unknown section filter '{section}'")
+            continue
+        node_types.extend(t for t in types if t not in node_types)
+    if node_types:
+        filters['node_type'] = node_types[0] if len(node_types) == 1 else node_types
+
+    return filters
+
+
+def matches_filters(properties: Dict[str, Any], filters: Optional[Dict[str, Any]],
+                    fields: Optional[List[str]] = None) -> bool:
+    """Whether raw ticket properties satisfy the filters on `fields` (default: the issue fields)"""
+    if not filters:
+        return True
+    for field in fields or ISSUE_FILTER_FIELDS:
+        if field in filters and filter_value(properties.get(field) or '') not in _values(filters[field]):
+            return False
+    return True
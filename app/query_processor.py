@@ -5,90 +5,121 @@ Query Processor for RAG-KG Customer Service QA System
 Handles entity extraction, intent detection, and query preprocessing.
 """
 
-import re
+import json
+import time
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
-import ollama
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Tuple
 from dotenv import load_dotenv
 import os
 
+from app.deadline import Deadline
+from app.lazy import lazy_import
+from app.metrics import count_tokens, track
+from app.matcher import (
+    INTENT_PREFIX, INTENT_TERMS, QUERY_ENTITY_TERMS, query_matcher, pick_intent, unique
+)
+
+ollama = lazy_import('ollama')
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class QueryProcessor:
-    """Processes customer queries for entity extraction and intent detection"""
+VALID_INTENTS = ['troubleshooting', 'feature_request', 'bug_report', 'general_inquiry']
 
-    def __init__(self):
-        self.model_name = os.getenv("PARSING_MODEL", "mistral:7b-instruct-q4_0")
+# How the entity and intent LLM calls are issued:
+#   sequential - two calls, one after the other
+#   concurrent - the same two calls issued in parallel
+#   fused      - a single structured call returning both
+PARSING_MODES = ['sequential', 'concurrent', 'fused']
 
-        # Entity extraction patterns
-        self.entity_patterns = {
-            'product': [
-                r'\b(mobile app|web portal|api|desktop client|mobile website)\b',
-                r'\b(ios|android|windows|mac|linux)\b',
-                r'\b(browser|chrome|firefox|safari|edge)\b'
-            ],
-            'error': [
-                r'\b(error|exception|failed|crash|bug)\b',
-                r'\b(404|500|403|401|502)\b',
-                r'\b(null|undefined|timeout|connection)\b'
-            ],
-            'action': [
-                r'\b(login|logout|click|submit|upload|download)\b',
-                r'\b(reset|change|update|create|delete)\b'
-            ]
-        }
 
-        # Intent patterns
-        self.intent_patterns = {
-            'troubleshooting': [
-                r'\b(problem|issue|error|not working|broken|stuck)\b',
-                r'\b(help|fix|solve|resolve)\b'
-            ],
-            'feature_request': [
-                r'\b(add|implement|feature|enhancement|improvement)\b',
-                r'\b(would like|need|want|missing)\b'
-            ],
-            'bug_report': [
-                r'\b(bug|defect|crash|freeze|hang)\b',
-                r'\b(report|found|discovered|experienced)\b'
-            ],
-            'general_inquiry': [
-                r'\b(how|what|when|where|why|can i|do you)\b',
-                r'\b(information|details|explain|tell me)\b'
-            ]
-        }
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
 
-    def extract_entities_rule_based(self, text: str) -> Dict[str, List[str]]:
-        """Extract entities using regex patterns"""
-        entities = {}
 
-        for entity_type, patterns in self.entity_patterns.items():
-            matches = []
-            for pattern in patterns:
-                found = re.findall(pattern, text, re.IGNORECASE)
-                matches.extend(found)
+def _timed(func, *args):
+    """Call func and return (result, elapsed ms)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, _elapsed_ms(start)
 
-            if matches:
-                entities[entity_type] = list(set(matches))  # Remove duplicates
 
-        return entities
+async def _atimed(coro):
+    """Await coro and return (result, elapsed ms)"""
+    start = time.perf_counter()
+    result = await coro
+    return result, _elapsed_ms(start)
 
-    def detect_intent_rule_based(self, text: str) -> str:
-        """Detect user intent using pattern matching"""
-        text_lower = text.lower()
 
-        for intent, patterns in self.intent_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text_lower):
-                    return intent
+class QueryProcessor:
+    """Processes customer queries for entity extraction and intent detection"""
 
-        return 'general_inquiry'  # Default intent
+    def __init__(self):
+        self.model_name = os.getenv("PARSING_MODEL", "mistral:7b-instruct-q4_0")
+        self.async_client = ollama.AsyncClient(host=os.getenv("OLLAMA_BASE_URL"))
+        # How long Ollama keeps the model loaded after warm-up
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.parsing_mode = os.getenv("PARSING_MODE", "sequential")
+
+        # Skip the LLM calls when the rule-based extraction scores at least this
+        # (see _rule_confidence); a value above 1 always calls the LLM
+        self.rule_bypass_threshold = float(os.getenv("RULE_BYPASS_THRESHOLD", 0.8))
+        # Running average of the LLM parsing step per mode, used to report time saved
+        self._llm_latency_ms: Dict[str, float] = {}
+
+        # Entity and intent vocabularies, compiled once into a single matcher
+        self.matcher = query_matcher()
+
+    async def awarm(self):
+        """Load the parsing model into Ollama and keep it resident"""
+        await self.async_client.generate(model=self.model_name, prompt='', keep_alive=self.keep_alive)
+
+    def match_rule_based(self, text: str) -> Tuple[Dict[str, List[str]], str, float]:
+        """
+        Extract entities and detect intent with one pass of the rule-based
+        matcher. Also returns how complete the extraction is (0-1).
+        """
+        hits = self.matcher.scan(text)
+        entities = {
+            entity_type: unique(hits[entity_type])
+            for entity_type in QUERY_ENTITY_TERMS
+            if entity_type in hits
+        }
+        return entities, pick_intent(hits), self._rule_confidence(entities, hits)
+
+    @staticmethod
+    def _rule_confidence(entities: Dict[str, List[str]], hits: Dict[str, List[str]]) -> float:
+        """
+        Score the rule-based result: a product (0.3), an error term (0.3), an
+        action (0.1), and up to 0.3 for how clearly the intent won its vote.
+        """
+        score = 0.0
+        if entities.get('product'):
+            score += 0.3
+        if entities.get('error'):
+            score += 0.3
+        if entities.get('action'):
+            score += 0.1
+
+        votes = sorted((len(hits.get(INTENT_PREFIX + intent, [])) for intent in INTENT_TERMS), reverse=True)
+        if votes[0] > 0:
+            score += 0.3 * (votes[0] - votes[1]) / votes[0]
+
+        return round(score, 3)
 
-    def extract_entities_llm(self, text: str) -> Dict[str, str]:
-        """Extract entities using LLM as a mapping of Section -> Value (SIGIR '24)"""
-        try:
-            prompt = f"""
+    def extract_entities_rule_based(self, text: str) -> Dict[str, List[str]]:
+        """Extract entities using the compiled vocabulary matcher"""
+        return self.match_rule_based(text)[0]
+
+    def detect_intent_rule_based(self, text: str) -> str:
+        """Detect user intent by vocabulary votes, defaulting to general_inquiry"""
+        return self.match_rule_based(text)[1]
+
+    def _build_entity_prompt(self, text: str) -> str:
+        """Prompt for section -> value entity extraction"""
+        return f"""
 Analyze this customer service query and extract key entities as a mapping of section to value. 
 Sections should align with common graph fields: 'issue summary', 'issue description', 'product', 'priority', 'root cause', 'steps to reproduce'.
 
@@ -100,35 +131,42 @@ Format: {{"section_name": "extracted_value"}}
 Example: {{"issue summary": "csv upload error", "priority": "high"}}
 """
 
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[{'role': 'user', 'content': prompt}],
-                options={'temperature': 0.1, 'num_predict': 200}
-            )
-
-            result_text = response['message']['content']
-
-            # Parse JSON response
-            try:
-                # Clean up response
-                json_start = result_text.find('{')
-                json_end = result_text.rfind('}') + 1
-                if json_start != -1 and json_end != -1:
-                    json_str = result_text[json_start:json_end]
-                    entities = eval(json_str)  # Using eval for simple dict parsing
-                    return entities
-            except:
-                logger.warning(f"Failed to parse LLM entity extraction response: {result_text}")
-
-        except Exception as e:
-            logger.error(f"LLM entity extraction failed: {str(e)}")
-
+    @staticmethod
+    def _normalize_entities(entities: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Keep LLM section values that are scalars (as str) or lists of scalars;
+        nested objects are dropped so the values can be merged as a set.
+        """
+        def scalar(value: Any) -> bool:
+            return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+        normalized = {}
+        for section, value in entities.items():
+            if scalar(value):
+                normalized[str(section)] = str(value)
+            elif isinstance(value, list):
+                values = [str(item) for item in value if scalar(item)]
+                if values:
+                    normalized[str(section)] = values
+        return normalized
+
+    def _parse_entity_response(self, result_text: str) -> Dict[str, Any]:
+        """Parse the section -> value mapping out of an LLM response"""
+        try:
+            # Clean up response
+            json_start = result_text.find('{')
+            json_end = result_text.rfind('}') + 1
+            if json_start != -1 and json_end != -1:
+                entities = json.loads(result_text[json_start:json_end])
+                if isinstance(entities, dict):
+                    return self._normalize_entities(entities)
+        except json.JSONDecodeError:
+            logger.warning(f"Failed to parse LLM entity extraction response: {result_text}")
         return {}
 
-    def detect_intent_llm(self, text: str) -> str:
-        """Detect intent using LLM"""
-        try:
-            prompt = f"""
+    def _build_intent_prompt(self, text: str) -> str:
+        """Prompt for intent classification"""
+        return f"""
 Classify this customer service query into one of these categories:
 - troubleshooting: Technical problems, errors, fixes needed
 - feature_request: New features, enhancements, additions wanted
@@ -140,47 +178,242 @@ Query: {text}
 Return only the category name.
 """
 
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[{'role': 'user', 'content': prompt}],
-                options={'temperature': 0.0, 'num_predict': 50}
-            )
+    def _parse_intent_response(self, result_text: str) -> str:
+        """Validate the intent returned by the LLM"""
+        intent = result_text.strip().lower()
+        if intent in VALID_INTENTS:
+            return intent
+        return 'general_inquiry'  # Default
 
-            intent = response['message']['content'].strip().lower()
+    def extract_entities_llm(self, text: str) -> Dict[str, str]:
+        """Extract entities using LLM as a mapping of Section -> Value (SIGIR '24)"""
+        try:
+            with track('llm_parsing'):
+                response = ollama.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_entity_prompt(text)}],
+                    options={'temperature': 0.1, 'num_predict': 200}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_entity_response(response['message']['content'])
 
-            # Validate intent
-            valid_intents = ['troubleshooting', 'feature_request', 'bug_report', 'general_inquiry']
-            if intent in valid_intents:
-                return intent
+        except Exception as e:
+            logger.error(f"LLM entity extraction failed: {str(e)}")
+
+        return {}
+
+    async def aextract_entities_llm(self, text: str) -> Dict[str, str]:
+        """Async variant of extract_entities_llm"""
+        try:
+            with track('llm_parsing'):
+                response = await self.async_client.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_entity_prompt(text)}],
+                    options={'temperature': 0.1, 'num_predict': 200}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_entity_response(response['message']['content'])
+
+        except Exception as e:
+            logger.error(f"LLM entity extraction failed: {str(e)}")
+
+        return {}
+
+    def detect_intent_llm(self, text: str) -> str:
+        """Detect intent using LLM"""
+        try:
+            with track('llm_parsing'):
+                response = ollama.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_intent_prompt(text)}],
+                    options={'temperature': 0.0, 'num_predict': 50}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_intent_response(response['message']['content'])
 
         except Exception as e:
             logger.error(f"LLM intent detection failed: {str(e)}")
 
         return 'general_inquiry'  # Default
 
-    def process(self, query: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Process a query with hybrid entity extraction and intent detection"""
-        logger.info(f"Processing query: {query[:100]}...")
+    async def adetect_intent_llm(self, text: str) -> str:
+        """Async variant of detect_intent_llm"""
+        try:
+            with track('llm_parsing'):
+                response = await self.async_client.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_intent_prompt(text)}],
+                    options={'temperature': 0.0, 'num_predict': 50}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_intent_response(response['message']['content'])
 
-        # Rule-based extraction (fast, reliable)
-        rule_entities = self.extract_entities_rule_based(query)
-        rule_intent = self.detect_intent_rule_based(query)
+        except Exception as e:
+            logger.error(f"LLM intent detection failed: {str(e)}")
 
-        # LLM-based extraction (more accurate, slower)
-        llm_entities = {}
-        llm_intent = rule_intent
+        return 'general_inquiry'  # Default
+
+    def _build_fused_prompt(self, text: str) -> str:
+        """Prompt returning section -> value entities and the intent in one JSON object"""
+        return f"""
+Analyze this customer service query. Extract key entities as a mapping of section to value
+and classify the query intent.
+Sections should align with common graph fields: 'issue summary', 'issue description', 'product', 'priority', 'root cause', 'steps to reproduce'.
+Intent must be one of: {', '.join(VALID_INTENTS)}.
 
+Query: {text}
+
+Return JSON only, in this format:
+{{"entities": {{"section_name": "extracted_value"}}, "intent": "category_name"}}
+"""
+
+    def _parse_fused_response(self, result_text: str) -> Tuple[Dict[str, Any], str]:
+        """Parse entities and intent out of a fused LLM response"""
+        try:
+            json_start = result_text.find('{')
+            json_end = result_text.rfind('}') + 1
+            if json_start != -1 and json_end != -1:
+                data = json.loads(result_text[json_start:json_end])
+                entities = data.get('entities') or {}
+                if not isinstance(entities, dict):
+                    entities = {}
+                return self._normalize_entities(entities), self._parse_intent_response(str(data.get('intent', '')))
+        except (json.JSONDecodeError, AttributeError):
+            logger.warning(f"Failed to parse fused LLM response: {result_text}")
+        return {}, 'general_inquiry'
+
+    def extract_llm_fused(self, text: str) -> Tuple[Dict[str, str], str]:
+        """Extract entities and intent with a single structured LLM call"""
         try:
-            llm_entities = self.extract_entities_llm(query)
-            llm_intent = self.detect_intent_llm(query)
+            with track('llm_parsing'):
+                response = ollama.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_fused_prompt(text)}],
+                    format='json',
+                    options={'temperature': 0.0, 'num_predict': 250}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_fused_response(response['message']['content'])
+
         except Exception as e:
-            logger.warning(f"LLM processing failed, using rule-based only: {str(e)}")
+            logger.error(f"Fused LLM extraction failed: {str(e)}")
+
+        return {}, 'general_inquiry'
+
+    async def aextract_llm_fused(self, text: str) -> Tuple[Dict[str, str], str]:
+        """Async variant of extract_llm_fused"""
+        try:
+            with track('llm_parsing'):
+                response = await self.async_client.chat(
+                    model=self.model_name,
+                    messages=[{'role': 'user', 'content': self._build_fused_prompt(text)}],
+                    format='json',
+                    options={'temperature': 0.0, 'num_predict': 250}
+                )
+            count_tokens('llm_parsing', response)
+            return self._parse_fused_response(response['message']['content'])
 
+        except Exception as e:
+            logger.error(f"Fused LLM extraction failed: {str(e)}")
+
+        return {}, 'general_inquiry'
+
+    def _resolve_mode(self, mode: Optional[str]) -> str:
+        mode = mode or self.parsing_mode
+        if mode not in PARSING_MODES:
+            logger.warning(f"Unknown parsing mode '{mode}', using sequential")
+            return 'sequential'
+        return mode
+
+    def _run_llm(self, query: str, mode: str) -> Tuple[Dict[str, str], str, Dict[str, float]]:
+        """Run the LLM parsing step in the given mode, timing each call in ms"""
+        timings = {}
+        start = time.perf_counter()
+
+        if mode == 'fused':
+            llm_entities, llm_intent = self.extract_llm_fused(query)
+            timings['fused_ms'] = _elapsed_ms(start)
+
+        elif mode == 'concurrent':
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                entities_future = executor.submit(_timed, self.extract_entities_llm, query)
+                intent_future = executor.submit(_timed, self.detect_intent_llm, query)
+                llm_entities, timings['entities_ms'] = entities_future.result()
+                llm_intent, timings['intent_ms'] = intent_future.result()
+
+        else:
+            llm_entities, timings['entities_ms'] = _timed(self.extract_entities_llm, query)
+            llm_intent, timings['intent_ms'] = _timed(self.detect_intent_llm, query)
+
+        timings['total_ms'] = _elapsed_ms(start)
+        return llm_entities, llm_intent, timings
+
+    async def _arun_llm(self, query: str, mode: str) -> Tuple[Dict[str, str], str, Dict[str, float]]:
+        """Async variant of _run_llm"""
+        timings = {}
+        start = time.perf_counter()
+
+        if mode == 'fused':
+            llm_entities, llm_intent = await self.aextract_llm_fused(query)
+            timings['fused_ms'] = _elapsed_ms(start)
+
+        elif mode == 'concurrent':
+            (llm_entities, timings['entities_ms']), (llm_intent, timings['intent_ms']) = await asyncio.gather(
+                _atimed(self.aextract_entities_llm(query)),
+                _atimed(self.adetect_intent_llm(query))
+            )
+
+        else:
+            llm_entities, timings['entities_ms'] = await _atimed(self.aextract_entities_llm(query))
+            llm_intent, timings['intent_ms'] = await _atimed(self.adetect_intent_llm(query))
+
+        timings['total_ms'] = _elapsed_ms(start)
+        return llm_entities, llm_intent, timings
+
+    def _record_llm_latency(self, mode: str, llm_timings: Dict[str, float]):
+        """Update the running average of the LLM parsing step for this mode"""
+        total = llm_timings.get('total_ms')
+        if total is None:
+            return
+        previous = self._llm_latency_ms.get(mode)
+        self._llm_latency_ms[mode] = total if previous is None else round(0.8 * previous + 0.2 * total, 1)
+
+    def _should_bypass(self, rule_confidence: float, threshold: Optional[float]) -> bool:
+        threshold = self.rule_bypass_threshold if threshold is None else threshold
+        return rule_confidence >= threshold
+
+    @staticmethod
+    def _llm_fits(deadline: Optional[Deadline]) -> bool:
+        """Whether LLM parsing fits the request's remaining budget"""
+        if deadline is None or deadline.affords('parsing'):
+            return True
+        deadline.degrade('parsing', 'rule_based')
+        return False
+
+    def _add_routing(self, result: Dict[str, Any], rule_confidence: float,
+                     bypassed: bool, mode: str) -> Dict[str, Any]:
+        """Record which path was taken and, when the LLM was skipped, the time saved"""
+        result['rule_confidence'] = rule_confidence
+        result['llm_bypassed'] = bypassed
+        result['time_saved_ms'] = self._llm_latency_ms.get(mode) if bypassed else 0.0
+        if bypassed:
+            result['processing_method'] = 'rule_based_bypass'
+            result['confidence'] = rule_confidence
+        return result
+
+    def _combine(self, query: str, context: Optional[Dict[str, Any]],
+                 rule_entities: Dict[str, List[str]], rule_intent: str,
+                 llm_entities: Dict[str, Any], llm_intent: str,
+                 parsing_mode: str, llm_timings: Dict[str, float]) -> Dict[str, Any]:
+        """Merge rule-based and LLM results into the processed query"""
         # Combine results (prefer LLM when available, fallback to rules)
         final_entities = {}
         for key in set(list(rule_entities.keys()) + list(llm_entities.keys())):
             rule_vals = rule_entities.get(key, [])
             llm_vals = llm_entities.get(key, [])
+            # LLM sections map to a single value, rule-based ones to lists
+            if not isinstance(llm_vals, list):
+                llm_vals = [llm_vals]
             final_entities[key] = list(set(rule_vals + llm_vals))
 
         # Use LLM intent if available, otherwise rule-based
@@ -195,8 +428,77 @@ Return only the category name.
             'entities': final_entities,
             'intent': final_intent,
             'confidence': 0.8 if llm_entities else 0.6,  # Higher confidence with LLM
-            'processing_method': 'hybrid' if llm_entities else 'rule_based'
+            'processing_method': 'hybrid' if llm_entities else 'rule_based',
+            'parsing_mode': parsing_mode,
+            'llm_timings': llm_timings
         }
 
         logger.info(f"Query processed - Intent: {final_intent}, Entities: {len(final_entities)}")
-        return result
\ No newline at end of file
+        return result
+
+    def process(self, query: str, context: Optional[Dict[str, Any]] = None,
+                mode: Optional[str] = None, bypass_threshold: Optional[float] = None,
+                deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Process a query with hybrid entity extraction and intent detection.
+        The LLM step is skipped when the deadline leaves no room for it.
+        """
+        logger.info(f"Processing query: {query[:100]}...")
+
+        # Rule-based extraction (fast, reliable)
+        rule_entities, rule_intent, rule_confidence = self.match_rule_based(query)
+
+        # LLM-based extraction (more accurate, slower), skipped when the rules are confident
+        llm_entities = {}
+        llm_intent = rule_intent
+        llm_timings = {}
+        mode = self._resolve_mode(mode)
+        bypassed = self._should_bypass(rule_confidence, bypass_threshold)
+
+        if not bypassed and self._llm_fits(deadline):
+            try:
+                llm_entities, llm_intent, llm_timings = self._run_llm(query, mode)
+                self._record_llm_latency(mode, llm_timings)
+            except Exception as e:
+                logger.warning(f"LLM processing failed, using rule-based only: {str(e)}")
+
+        result = self._combine(query, context, rule_entities, rule_intent, llm_entities, llm_intent,
+                               mode, llm_timings)
+        return self._add_routing(result, rule_confidence, bypassed, mode)
+
+    async def aprocess(self, query: str, context: Optional[Dict[str, Any]] = None,
+                       mode: Optional[str] = None,
+                       bypass_threshold: Optional[float] = None,
+                       deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+        """
+        Async variant of process, awaiting the LLM calls instead of blocking the
+        event loop. LLM parsing that overruns the deadline's share is abandoned.
+        """
+        logger.info(f"Processing query: {query[:100]}...")
+
+        rule_entities, rule_intent, rule_confidence = self.match_rule_based(query)
+
+        llm_entities = {}
+        llm_intent = rule_intent
+        llm_timings = {}
+        mode = self._resolve_mode(mode)
+        bypassed = self._should_bypass(rule_confidence, bypass_threshold)
+
+        if not bypassed and self._llm_fits(deadline):
+            try:
+                llm_entities, llm_intent, llm_timings = await asyncio.wait_for(
+                    self._arun_llm(query, mode),
+                    timeout=deadline.timeout('parsing') if deadline else None
+                )
+                self._record_llm_latency(mode, llm_timings)
+            except asyncio.TimeoutError:
+                # Without a deadline this is a client timeout from inside the LLM calls
+                logger.warning("LLM processing ran out of time, using rule-based only")
+                if deadline:
+                    deadline.degrade('parsing', 'rule_based')
+            except Exception as e:
+                logger.warning(f"LLM processing failed, using rule-based only: {str(e)}")
+
+        result = self._combine(query, context, rule_entities, rule_intent, llm_entities, llm_intent,
+                               mode, llm_timings)
+        return self._add_routing(result, rule_confidence, bypassed, mode)
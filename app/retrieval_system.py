@@ -5,231 +5,451 @@ Retrieval System for RAG-KG Customer Service QA System
 Handles graph traversal and vector similarity search for retrieving relevant information.
 """
 
+import asyncio
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, List, Any, Optional, Tuple
-from neo4j import GraphDatabase
-from qdrant_client import QdrantClient
-import ollama
+from app.cache import SubgraphCache
+from app.cypher_templates import FULL_TREE_NODES, TREE_RELATIONSHIPS, select_subtree, select_template
+from app.deadline import Deadline
+from app.graph_store import GraphStore, create_graph_store
+from app.lazy import lazy_import
+from app.lexical_index import LexicalIndex, load_lexical_index, reciprocal_rank_fusion
+from app.metrics import count_tokens, set_stage_dependency, track
+from app.query_filters import query_filters
+from app.vector_store import VectorStore, create_vector_store, point_id
 from dotenv import load_dotenv
 import os
 
+# Client libraries are imported when the retrieval system is initialized
+np = lazy_import('numpy')
+ollama = lazy_import('ollama')
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 class RetrievalSystem:
-    """Handles retrieval from Neo4j graph and Qdrant vector database"""
+    """Handles retrieval from the graph store and the vector store"""
 
     def __init__(self):
-        self.neo4j_uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
-        self.neo4j_user = os.getenv("NEO4J_USER", "neo4j")
-        self.neo4j_password = os.getenv("NEO4J_PASSWORD", "password")
-        self.qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
+        # 'neo4j' (server) or 'embedded' (in-process graph, see app/graph_store.py)
+        self.graph_backend = os.getenv("GRAPH_BACKEND", "neo4j")
         self.collection_name = os.getenv("COLLECTION_NAME", "tickets")
+        # 'qdrant' (server) or 'local' (in-process index, see app/vector_store.py)
+        self.vector_backend = os.getenv("VECTOR_BACKEND", "qdrant")
+
+        self.embedding_model = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+        self.llm_model = os.getenv("LLM_MODEL", "llama2:7b-chat-q4_0")
+
+        # Per-ticket subgraph extraction runs concurrently, bounded and with a deadline
+        self.subgraph_concurrency = int(os.getenv("SUBGRAPH_CONCURRENCY", 3))
+        self.subgraph_timeout = float(os.getenv("SUBGRAPH_TIMEOUT", 10))
+        # 'template' runs precompiled Cypher for all candidates at once; 'llm' asks the LLM per ticket;
+        # 'embedding' ranks each ticket's tree nodes by their stored vectors against the query
+        self.subgraph_strategy = os.getenv("SUBGRAPH_STRATEGY", "template")
+        self.subgraph_max_nodes = int(os.getenv("SUBGRAPH_MAX_NODES", 6))
+        # Full ticket trees reused across requests (SUBGRAPH_CACHE_BYTES=0 disables it)
+        self.subgraph_cache = SubgraphCache(max_bytes=int(os.getenv("SUBGRAPH_CACHE_BYTES", 64 * 2**20)))
+
+        # BM25 over the node texts, fused with the vector ranking (used when the index was built)
+        self.hybrid_retrieval = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+        self.rrf_k = int(os.getenv("RRF_K", 60))
 
-        self.neo4j_driver = None
-        self.qdrant_client = None
+        # How long Ollama keeps the embedding model loaded after warm-up
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+        self.graph_store: Optional[GraphStore] = None
+        self.vector_store: Optional[VectorStore] = None
+        self.lexical_index: Optional[LexicalIndex] = None
+
+        # Async client used by the non-blocking API path (aretrieve)
+        self.async_ollama = None
 
     def initialize(self):
         """Initialize database connections"""
         try:
-            self.neo4j_driver = GraphDatabase.driver(
-                self.neo4j_uri,
-                auth=(self.neo4j_user, self.neo4j_password)
-            )
-            logger.info("Neo4j connection initialized")
+            self.graph_store = create_graph_store(self.graph_backend)
+            self.graph_store.connect()
+            set_stage_dependency('graph_query', self.graph_store.backend)
+            logger.info(f"Graph store initialized ({self.graph_store.backend})")
         except Exception as e:
-            logger.error(f"Neo4j connection failed: {str(e)}")
+            logger.error(f"Graph store initialization failed: {str(e)}")
             raise
 
         try:
-            self.qdrant_client = QdrantClient(url=self.qdrant_url)
-            logger.info("Qdrant connection initialized")
+            self.vector_store = create_vector_store(self.vector_backend, self.collection_name)
+            self.vector_store.connect()
+            set_stage_dependency('vector_search', self.vector_store.backend)
+            logger.info(f"Vector store initialized ({self.vector_store.backend})")
         except Exception as e:
-            logger.error(f"Qdrant connection failed: {str(e)}")
+            logger.error(f"Vector store initialization failed: {str(e)}")
             raise
 
+        if self.hybrid_retrieval:
+            try:
+                self.lexical_index = load_lexical_index(self.collection_name)
+            except Exception as e:
+                logger.error(f"Lexical index loading failed, using vector search only: {str(e)}")
+
+        self.async_ollama = ollama.AsyncClient(host=os.getenv("OLLAMA_BASE_URL"))
+
     def close(self):
         """Close database connections"""
-        if self.neo4j_driver:
-            self.neo4j_driver.close()
+        if self.graph_store:
+            self.graph_store.close()
+        if self.vector_store:
+            self.vector_store.close()
         logger.info("Connections closed")
 
-    def check_neo4j(self) -> bool:
-        """Check Neo4j connection"""
-        if not self.neo4j_driver:
-            return False
-        try:
-            with self.neo4j_driver.session() as session:
-                result = session.run("RETURN 'Neo4j OK' as status")
-                return result.single()['status'] == 'Neo4j OK'
-        except Exception:
-            return False
+    async def aclose(self):
+        """Close the async database connections"""
+        if self.graph_store:
+            await self.graph_store.aclose()
+        if self.vector_store:
+            await self.vector_store.aclose()
+        logger.info("Async connections closed")
 
-    def check_qdrant(self) -> bool:
-        """Check Qdrant connection"""
-        if not self.qdrant_client:
+    async def awarm_graph_store(self):
+        """Open the first pooled graph connection (the embedded graph is loaded at initialize)"""
+        await self.graph_store.awarm()
+
+    async def awarm_vector_store(self):
+        """Open the vector store connection (or load the local index) and check the collection"""
+        await self.vector_store.awarm()
+
+    async def awarm_embedding_model(self):
+        """Load the embedding model into Ollama and keep it resident"""
+        await self.async_ollama.embed(model=self.embedding_model, input=['warm-up'], keep_alive=self.keep_alive)
+
+    def check_graph_store(self) -> bool:
+        """Check the graph store connection"""
+        if not self.graph_store:
             return False
-        try:
-            response = self.qdrant_client.get_collections()
-            return bool(response.collections)
-        except Exception:
+        return self.graph_store.check()
+
+    def check_vector_store(self) -> bool:
+        """Check the vector store connection"""
+        if not self.vector_store:
             return False
+        return self.vector_store.check()
 
     def retrieve_from_graph(self, entities: Dict[str, List[str]], intent: str,
                           max_hops: int = 2) -> List[Dict[str, Any]]:
-        """Retrieve relevant information from knowledge graph"""
-        if not self.neo4j_driver:
+        """Retrieve issues matching the extracted products/errors with their trees and linked issues"""
+        if not self.graph_store:
             return []
 
         results = []
 
         try:
-            with self.neo4j_driver.session() as session:
-                # Build Cypher query based on entities and intent
-                query_parts = []
-                params = {}
-
-                # Search for issues with matching entities
-                if entities.get('product'):
-                    products = entities['product']
-                    query_parts.append("ANY(product IN $products WHERE product IN i.product)")
-                    params['products'] = products
-
-                if entities.get('error'):
-                    errors = entities['error']
-                    query_parts.append("ANY(error IN $errors WHERE error IN i.tags)")
-                    params['errors'] = errors
-
-                # Base query
-                where_clause = " AND ".join(query_parts) if query_parts else "true"
-
-                cypher = f"""
-                MATCH (i:Issue)
-                WHERE {where_clause}
-                OPTIONAL MATCH (i)-[r*1..{max_hops}]-(related)
-                RETURN i, collect(DISTINCT related) as related_nodes,
-                       collect(DISTINCT type(head(r))) as relationship_types
-                LIMIT 10
-                """
-
-                result = session.run(cypher, params)
-
-                for record in result:
-                    issue = record['i']
-                    related_nodes = record['related_nodes']
-
-                    # Format issue data
-                    issue_data = {
+            filters = query_filters(entities.get('context'))
+            issues = self.graph_store.find_issues(
+                products=entities.get('product'), tags=entities.get('error'), limit=10, filters=filters
+            )
+            subtrees = {
+                ticket_id: select_subtree(tree, TREE_RELATIONSHIPS, False, 5)
+                for ticket_id, tree in self._ticket_trees([issue['id'] for issue in issues]).items()
+            }
+
+            for issue in issues:
+                # Format issue data
+                results.append({
+                    'ticket_id': issue.get('id', ''),
+                    'title': issue.get('title', ''),
+                    'description': issue.get('description', ''),
+                    'status': issue.get('status', ''),
+                    'priority': issue.get('priority', ''),
+                    'node_type': 'Issue',
+                    'score': 0.9,  # High confidence for direct matches
+                    'source': 'graph'
+                })
+
+                # Add related nodes
+                related = [{'text': node['text'], 'node_type': node['type']} for node in subtrees.get(issue['id'], [])]
+                if max_hops > 1:
+                    related += [
+                        {'text': f"{link['rel_type']} {link['ticket_id']}", 'node_type': 'Issue'}
+                        for link in self.graph_store.neighbors(issue['id'], limit=5, filters=filters)
+                    ]
+                for node in related[:5]:  # Limit related nodes
+                    results.append({
                         'ticket_id': issue.get('id', ''),
-                        'title': issue.get('title', ''),
-                        'description': issue.get('description', ''),
-                        'status': issue.get('status', ''),
-                        'priority': issue.get('priority', ''),
-                        'node_type': 'Issue',
-                        'score': 0.9,  # High confidence for direct matches
-                        'source': 'graph'
-                    }
-                    results.append(issue_data)
-
-                    # Add related nodes
-                    for node in related_nodes[:5]:  # Limit related nodes
-                        if hasattr(node, 'labels') and node.labels:
-                            node_type = list(node.labels)[0]
-                            node_data = {
-                                'ticket_id': issue.get('id', ''),
-                                'node_type': node_type,
-                                'text': str(dict(node)) if hasattr(node, 'items') else str(node),
-                                'score': 0.7,
-                                'source': 'graph_related'
-                            }
-                            results.append(node_data)
+                        'node_type': node['node_type'],
+                        'text': node['text'],
+                        'score': 0.7,
+                        'source': 'graph_related'
+                    })
 
         except Exception as e:
             logger.error(f"Graph retrieval failed: {str(e)}")
 
         return results
 
+    def _format_vector_hits(self, search_result) -> List[Dict[str, Any]]:
+        """Convert vector store hits into retrieval result dicts"""
+        results = []
+        for hit in search_result:
+            payload = hit['payload']
+            result = {
+                'ticket_id': payload.get('ticket_id', ''),
+                'node_type': payload.get('node_type', ''),
+                'text': payload.get('text', ''),
+                'score': hit['score'],
+                'source': hit.get('source', 'vector'),
+                'metadata': {
+                    'vector_id': hit['id'],
+                    'node_id': payload.get('node_id', '')
+                }
+            }
+            results.append(result)
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a text with the configured embedding model"""
+        with track('embedding'):
+            return ollama.embeddings(model=self.embedding_model, prompt=text)['embedding']
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async variant of embed_query"""
+        with track('embedding'):
+            response = await self.async_ollama.embeddings(model=self.embedding_model, prompt=text)
+        return response['embedding']
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts with a single batched embedding request"""
+        if not texts:
+            return []
+        with track('embedding'):
+            return ollama.embed(model=self.embedding_model, input=texts)['embeddings']
+
+    async def aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Async variant of embed_texts"""
+        if not texts:
+            return []
+        with track('embedding'):
+            response = await self.async_ollama.embed(model=self.embedding_model, input=texts)
+        return response['embeddings']
+
+    @staticmethod
+    def _normalize_value(value: str) -> str:
+        """Normalize a section value before embedding so duplicates collapse"""
+        return " ".join(str(value).split()).casefold()
+
+    # Minimum cosine similarity for a vector hit
+    VECTOR_SCORE_THRESHOLD = 0.3
+
+    def _lexical_search(self, values: List[str], limit: int,
+                        filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """BM25 hits per value (none on failure, so vector results still count)"""
+        try:
+            with track('lexical_search'):
+                return self.lexical_index.search_batch(values, limit, filters)
+        except Exception as e:
+            logger.error(f"Lexical search failed: {str(e)}")
+            return [[] for _ in values]
+
+    async def _alexical_search(self, values: List[str], limit: int,
+                               filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Async variant of _lexical_search (scored in a worker thread)"""
+        try:
+            with track('lexical_search'):
+                return await asyncio.to_thread(self.lexical_index.search_batch, values, limit, filters)
+        except Exception as e:
+            logger.error(f"Lexical search failed: {str(e)}")
+            return [[] for _ in values]
+
+    def _fuse_rankings(self, vector_batch: List[List[Dict[str, Any]]], lexical_batch: List[List[Dict[str, Any]]],
+                       limit: int) -> Tuple[List[List[Dict[str, Any]]], List[int]]:
+        """
+        Fuse each value's vector and lexical rankings with RRF. Hits only found
+        lexically carry a BM25 score; their ids are returned so one vector fetch
+        can replace it with a cosine similarity.
+        """
+        fused_batch, lexical_only = [], {}
+        for vector_hits, lexical_hits in zip(vector_batch, lexical_batch):
+            vector_ids = {hit['id'] for hit in vector_hits}
+            fused = reciprocal_rank_fusion([vector_hits, lexical_hits], limit, self.rrf_k)
+            for hit in fused:
+                if hit['id'] not in vector_ids:
+                    hit['source'] = 'lexical'
+                    lexical_only[hit['id']] = None
+            fused_batch.append(fused)
+        return fused_batch, list(lexical_only)
+
+    def _score_lexical_hits(self, fused_batch: List[List[Dict[str, Any]]], embeddings: List[List[float]],
+                            points: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        The fused hits per value, with each lexical-only hit scored by the cosine
+        similarity of its stored vector (the score STi ranking sums). Lexical-only
+        hits below VECTOR_SCORE_THRESHOLD, or without a stored vector, are dropped
+        like vector hits are.
+        """
+        vectors = {point['id']: np.asarray(point['vector'], dtype=np.float32) for point in points}
+        scored_batch = []
+        for hits, embedding in zip(fused_batch, embeddings):
+            query = np.asarray(embedding, dtype=np.float32)
+            query = query / max(float(np.linalg.norm(query)), 1e-12)
+            scored = []
+            for hit in hits:
+                if hit.get('source') == 'lexical':
+                    vector = vectors.get(hit['id'])
+                    if vector is None:
+                        continue
+                    hit['score'] = float(vector @ query) / max(float(np.linalg.norm(vector)), 1e-12)
+                    if hit['score'] < self.VECTOR_SCORE_THRESHOLD:
+                        continue
+                scored.append(hit)
+            scored_batch.append(scored)
+        return scored_batch
+
+    def retrieve_from_vectors_batch(self, values: List[str], limit: int = 5,
+                                    filters: Optional[Dict[str, Any]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Retrieve vector candidates for several values with one embedding request
+        and one vector store batch search, restricted to nodes matching the
+        payload `filters`. With a lexical index, BM25 hits are fused in by
+        reciprocal rank. Returns normalized value -> results.
+        """
+        unique_values = list(dict.fromkeys(self._normalize_value(v) for v in values if v))
+        if not self.vector_store or not unique_values:
+            return {}
+
+        try:
+            embeddings = self.embed_texts(unique_values)
+            with track('vector_search'):
+                batch_result = self.vector_store.search_batch(
+                    embeddings, limit, score_threshold=self.VECTOR_SCORE_THRESHOLD, filters=filters
+                )
+            if self.lexical_index:
+                lexical_batch = self._lexical_search(unique_values, limit, filters)
+                batch_result, lexical_only = self._fuse_rankings(batch_result, lexical_batch, limit)
+                if lexical_only:
+                    with track('vector_search'):
+                        points = self.vector_store.retrieve(lexical_only)
+                    batch_result = self._score_lexical_hits(batch_result, embeddings, points)
+            return {
+                value: self._format_vector_hits(hits)
+                for value, hits in zip(unique_values, batch_result)
+            }
+
+        except Exception as e:
+            logger.error(f"Batch vector retrieval failed: {str(e)}")
+            return {}
+
+    async def aretrieve_from_vectors_batch(self, values: List[str], limit: int = 5,
+                                           filters: Optional[Dict[str, Any]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Async variant of retrieve_from_vectors_batch"""
+        unique_values = list(dict.fromkeys(self._normalize_value(v) for v in values if v))
+        if not self.vector_store or not unique_values:
+            return {}
+
+        try:
+            if self.lexical_index:
+                # BM25 needs no embedding, so it runs while the values are embedded
+                embeddings, lexical_batch = await asyncio.gather(
+                    self.aembed_texts(unique_values), self._alexical_search(unique_values, limit, filters)
+                )
+            else:
+                embeddings = await self.aembed_texts(unique_values)
+            with track('vector_search'):
+                batch_result = await self.vector_store.asearch_batch(
+                    embeddings, limit, score_threshold=self.VECTOR_SCORE_THRESHOLD, filters=filters
+                )
+            if self.lexical_index:
+                batch_result, lexical_only = self._fuse_rankings(batch_result, lexical_batch, limit)
+                if lexical_only:
+                    with track('vector_search'):
+                        points = await self.vector_store.aretrieve(lexical_only)
+                    batch_result = self._score_lexical_hits(batch_result, embeddings, points)
+            return {
+                value: self._format_vector_hits(hits)
+                for value, hits in zip(unique_values, batch_result)
+            }
+
+        except Exception as e:
+            logger.error(f"Batch vector retrieval failed: {str(e)}")
+            return {}
+
     def retrieve_from_vectors(self, query: str, entities: Dict[str, List[str]],
                             limit: int = 10) -> List[Dict[str, Any]]:
-        """Retrieve relevant information using vector similarity"""
-        if not self.qdrant_client:
+        """Retrieve relevant information using vector similarity, scoped by entities['context']"""
+        if not self.vector_store:
             return []
 
         try:
             # Generate embedding for the query
-            embedding = ollama.embeddings(
-                model=os.getenv("EMBEDDING_MODEL", "nomic-embed-text"),
-                prompt=query
-            )['embedding']
+            embedding = self.embed_query(query)
 
             # Search for similar vectors
-            search_result = self.qdrant_client.search(
-                collection_name=self.collection_name,
-                query_vector=embedding,
-                limit=limit,
-                score_threshold=0.3  # Minimum similarity
-            )
+            with track('vector_search'):
+                search_result = self.vector_store.search(
+                    embedding, limit, score_threshold=self.VECTOR_SCORE_THRESHOLD,
+                    filters=query_filters(entities.get('context'))
+                )
 
-            results = []
-            for hit in search_result:
-                result = {
-                    'ticket_id': hit.payload.get('ticket_id', ''),
-                    'node_type': hit.payload.get('node_type', ''),
-                    'text': hit.payload.get('text', ''),
-                    'score': hit.score,
-                    'source': 'vector',
-                    'metadata': {
-                        'vector_id': hit.id,
-                        'node_id': hit.payload.get('node_id', '')
-                    }
-                }
-                results.append(result)
+            return self._format_vector_hits(search_result)
+
+        except Exception as e:
+            logger.error(f"Vector retrieval failed: {str(e)}")
+            return []
+
+    async def aretrieve_from_vectors(self, query: str, entities: Dict[str, List[str]],
+                                     limit: int = 10) -> List[Dict[str, Any]]:
+        """Async variant of retrieve_from_vectors"""
+        if not self.vector_store:
+            return []
+
+        try:
+            embedding = await self.aembed_query(query)
 
-            return results
+            with track('vector_search'):
+                search_result = await self.vector_store.asearch(
+                    embedding, limit, score_threshold=self.VECTOR_SCORE_THRESHOLD,
+                    filters=query_filters(entities.get('context'))
+                )
+
+            return self._format_vector_hits(search_result)
 
         except Exception as e:
             logger.error(f"Vector retrieval failed: {str(e)}")
             return []
 
-    def retrieve(self, processed_query: Dict[str, Any],
-                options: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _section_values(section_value_map: Dict[str, Any]) -> List[Tuple[str, str]]:
+        """Flatten the section -> value(s) map into (section, value) pairs"""
+        pairs = []
+        for section, value in section_value_map.items():
+            if section == 'context':
+                continue
+            values = value if isinstance(value, list) else [value]
+            for v in values:
+                if v:
+                    pairs.append((section, str(v)))
+        return pairs
+
+    @staticmethod
+    def _rank_tickets(candidates_per_section: List[List[Dict[str, Any]]],
+                      confidence_threshold: float, k: int) -> List[Dict[str, Any]]:
         """
-        Main retrieval method combining graph and vector search.
-        Implements SIGIR '24 Scoring (STi): Sum contributions from nodes matching query categories.
+        SIGIR '24 Scoring (STi): sum the similarities of each ticket's nodes
+        to the query entities and keep the top-k tickets.
         """
-        options = options or {}
-        max_sources = options.get('max_sources', 10)
-        confidence_threshold = options.get('confidence_threshold', 0.5)
-
-        section_value_map = processed_query.get('entities', {})
-        original_query = processed_query.get('original_query', '')
-        
-        # Determine number of sources from options
-        k = options.get('max_sources', 5)
-
-        # 1. EBR-based Ticket Identification (SIGIR '24 Method)
-        # Calculate score STi for each ticket by summing similarities of its nodes to query entities
-        ticket_scores = {} # Map ticket_id -> score
+        ticket_scores = {}  # Map ticket_id -> score
         # Store all contributing nodes for each ticket
-        ticket_contributions = {} # Map ticket_id -> List[node]
+        ticket_contributions = {}  # Map ticket_id -> List[node]
 
-        for section, value in section_value_map.items():
-            if section == 'context': continue
-            
-            # Retrieve vector candidates for this specific section-value pair
-            node_candidates = self.retrieve_from_vectors(value, {section: [value]}, limit=5)
-            
+        for node_candidates in candidates_per_section:
             for node in node_candidates:
                 tid = node['ticket_id']
                 score = node['score']
-                
+
                 # SIGIR '24: STi = sum over (k,v) in P [ sum over n in Ti [ I(n.sec=k) * cos(v,n) ] ]
                 ticket_scores[tid] = ticket_scores.get(tid, 0) + score
                 if tid not in ticket_contributions:
                     ticket_contributions[tid] = []
                 ticket_contributions[tid].append(node)
 
-        # 2. Convert to list and sort by STi score
         ranked_tickets = []
         for tid, score in ticket_scores.items():
             if score >= confidence_threshold:
@@ -241,17 +461,32 @@ class RetrievalSystem:
                 })
 
         ranked_tickets.sort(key=lambda x: x['score'], reverse=True)
-        top_k_candidates = ranked_tickets[:k]
+        return ranked_tickets[:k]
 
-        # 3. LLM-driven Subgraph Extraction (SIGIR '24 Step 2.1)
-        # For each top candidate, extract most relevant subgraph
+    def _select_candidates(self, pairs: List[Tuple[str, str]],
+                           hits_by_value: Dict[str, List[Dict[str, Any]]],
+                           options: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Rank the tickets hit by a query's section values and keep the top-k"""
+        candidates_per_section = [
+            hits_by_value.get(self._normalize_value(value), [])
+            for _, value in pairs
+        ]
+        return self._rank_tickets(
+            candidates_per_section,
+            options.get('confidence_threshold', 0.5),
+            options.get('max_sources', 5)  # Determine number of sources from options
+        )
+
+    @staticmethod
+    def _merge_subgraphs(top_k_candidates: List[Dict[str, Any]],
+                         subgraphs: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Combine extracted subgraphs with their candidates, falling back to contributions"""
         final_results = []
-        for candidate in top_k_candidates:
-            subgraph = self._extract_subgraph(candidate['ticket_id'], original_query)
+        for candidate, subgraph in zip(top_k_candidates, subgraphs):
             if subgraph:
                 # Combine subgraph nodes into results
                 for node in subgraph:
-                    node['score'] = candidate['score'] # Inherit ticket score
+                    node['score'] = candidate['score']  # Inherit ticket score
                     node['source'] = 'sigir24_subgraph'
                     final_results.append(node)
             else:
@@ -259,21 +494,461 @@ class RetrievalSystem:
                 for node in candidate['contributions']:
                     node['source'] = 'sti_contribution_fallback'
                     final_results.append(node)
+        return final_results
+
+    def _uses_llm_cypher(self, options: Optional[Dict[str, Any]]) -> bool:
+        """Whether subgraphs come from LLM-written Cypher (only graph stores that run Cypher can)"""
+        if (options or {}).get('subgraph_strategy', self.subgraph_strategy) != 'llm':
+            return False
+        if self.graph_store and not self.graph_store.supports_cypher:
+            logger.warning(f"The {self.graph_store.backend} graph store cannot run Cypher, using templated subgraphs")
+            return False
+        return True
+
+    def _uses_embedding_selection(self, options: Optional[Dict[str, Any]]) -> bool:
+        """Whether tree nodes are picked by similarity to the query embedding"""
+        return (options or {}).get('subgraph_strategy', self.subgraph_strategy) == 'embedding'
+
+    @staticmethod
+    def _subgraphs_fit(deadline: Optional[Deadline]) -> bool:
+        """Whether subgraph extraction fits the request's remaining budget"""
+        if deadline is None or deadline.affords('subgraphs'):
+            return True
+        deadline.degrade('subgraphs', 'contributions')
+        return False
+
+    def retrieve(self, processed_query: Dict[str, Any],
+                options: Optional[Dict[str, Any]] = None,
+                deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+        """
+        Main retrieval method combining graph and vector search.
+        Implements SIGIR '24 Scoring (STi): Sum contributions from nodes matching query categories.
+        When the deadline is tight the STi contributions are returned without subgraph extraction.
+        """
+        options = options or {}
+
+        section_value_map = processed_query.get('entities', {})
+        original_query = processed_query.get('original_query', '')
+
+        # 1. EBR-based Ticket Identification (SIGIR '24 Method)
+        # Retrieve vector candidates for all section-value pairs in one batch
+        pairs = self._section_values(section_value_map)
+        hits_by_value = self.retrieve_from_vectors_batch(
+            [value for _, value in pairs], limit=5, filters=query_filters(section_value_map.get('context'))
+        )
+
+        # 2. Rank tickets by STi score
+        top_k_candidates = self._select_candidates(pairs, hits_by_value, options)
+
+        # 3. Subgraph Extraction (SIGIR '24 Step 2.1)
+        # For each top candidate, extract most relevant subgraph
+        if not self._subgraphs_fit(deadline):
+            subgraphs = [[] for _ in top_k_candidates]
+        elif self._uses_llm_cypher(options):
+            subgraphs = self._extract_subgraphs(
+                top_k_candidates, original_query,
+                timeout=deadline.timeout('subgraphs') if deadline else None
+            )
+        elif self._uses_embedding_selection(options):
+            subgraphs = self._extract_subgraphs_by_embedding(top_k_candidates, original_query)
+        else:
+            subgraphs = self._extract_subgraphs_templated(top_k_candidates, processed_query)
+        final_results = self._merge_subgraphs(top_k_candidates, subgraphs)
 
         logger.info(f"Retrieved {len(final_results)} nodes from {len(top_k_candidates)} tickets using SIGIR '24 pipeline.")
         return final_results
 
-    def _extract_subgraph(self, ticket_id: str, query: str) -> List[Dict[str, Any]]:
+    async def aretrieve(self, processed_query: Dict[str, Any],
+                        options: Optional[Dict[str, Any]] = None,
+                        deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
         """
-        Use LLM to generate a Cypher query to extract a relevant subgraph from an intra-issue tree.
-        SIGIR '24 Step 2.1 implementation.
+        Async variant of retrieve used by the API. Tickets whose subgraph is not
+        extracted within the deadline's share fall back to their contributions.
         """
-        if not self.neo4j_driver:
+        options = options or {}
+
+        section_value_map = processed_query.get('entities', {})
+        original_query = processed_query.get('original_query', '')
+
+        pairs = self._section_values(section_value_map)
+        hits_by_value = await self.aretrieve_from_vectors_batch(
+            [value for _, value in pairs], limit=5, filters=query_filters(section_value_map.get('context'))
+        )
+        top_k_candidates = self._select_candidates(pairs, hits_by_value, options)
+
+        if not self._subgraphs_fit(deadline):
+            subgraphs = [[] for _ in top_k_candidates]
+        elif self._uses_llm_cypher(options):
+            subgraphs = await self._aextract_subgraphs(top_k_candidates, original_query, deadline)
+        elif self._uses_embedding_selection(options):
+            subgraphs = await self._aextract_subgraphs_by_embedding(top_k_candidates, original_query, deadline)
+        else:
+            subgraphs = await self._aextract_subgraphs_templated(top_k_candidates, processed_query, deadline)
+        final_results = self._merge_subgraphs(top_k_candidates, subgraphs)
+
+        logger.info(f"Retrieved {len(final_results)} nodes from {len(top_k_candidates)} tickets using SIGIR '24 pipeline.")
+        return final_results
+
+    async def aretrieve_many(self, processed_queries: List[Dict[str, Any]],
+                             options_list: List[Dict[str, Any]],
+                             deadlines: Optional[List[Optional[Deadline]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve for several queries at once: one embedding request and one
+        vector store batch search for all their section values, and one templated
+        subtree query per template over the union of their candidate tickets
+        (or one node-vector fetch for all queries selecting by embedding).
+        Queries whose deadline is too tight keep their contributions.
+        """
+        deadlines = deadlines or [None] * len(processed_queries)
+        pairs_list = [self._section_values(pq.get('entities', {})) for pq in processed_queries]
+
+        # Queries with the same context scope share one filtered batch search
+        filters_list = [query_filters(pq.get('entities', {}).get('context')) for pq in processed_queries]
+        scopes: Dict[str, List[int]] = {}
+        for i, filters in enumerate(filters_list):
+            scopes.setdefault(json.dumps(filters, sort_keys=True), []).append(i)
+        scope_hits = await asyncio.gather(*(
+            self.aretrieve_from_vectors_batch(
+                [value for i in indices for _, value in pairs_list[i]], limit=5, filters=filters_list[indices[0]]
+            )
+            for indices in scopes.values()
+        ))
+        hits_by_query = {i: hits for indices, hits in zip(scopes.values(), scope_hits) for i in indices}
+        candidates_list = [
+            self._select_candidates(pairs, hits_by_query[i], options or {})
+            for i, (pairs, options) in enumerate(zip(pairs_list, options_list))
+        ]
+
+        subgraphs_list: List[List[List[Dict[str, Any]]]] = [[] for _ in processed_queries]
+        template_groups: Dict[Tuple, List[int]] = {}
+        llm_jobs, embedding_jobs = [], []
+        for i, (processed_query, options) in enumerate(zip(processed_queries, options_list)):
+            if not self._subgraphs_fit(deadlines[i]):
+                subgraphs_list[i] = [[] for _ in candidates_list[i]]
+            elif self._uses_llm_cypher(options):
+                llm_jobs.append(i)
+            elif self._uses_embedding_selection(options):
+                embedding_jobs.append(i)
+            else:
+                params = self._template_params([], processed_query)
+                key = (tuple(params['rel_types']), params['include_issue'])
+                template_groups.setdefault(key, []).append(i)
+
+        for indices in template_groups.values():
+            ticket_ids = list(dict.fromkeys(
+                c['ticket_id'] for i in indices for c in candidates_list[i]
+            ))
+            union = [{'ticket_id': tid} for tid in ticket_ids]
+            subtrees = await self._aextract_subgraphs_templated(union, processed_queries[indices[0]])
+            by_ticket = dict(zip(ticket_ids, subtrees))
+            for i in indices:
+                # Copy the nodes: _merge_subgraphs sets a per-query score on them
+                subgraphs_list[i] = [
+                    [dict(node) for node in by_ticket.get(c['ticket_id'], [])]
+                    for c in candidates_list[i]
+                ]
+
+        if embedding_jobs:
+            selected = await self._aselect_subgraphs_by_embedding(
+                [candidates_list[i] for i in embedding_jobs],
+                [processed_queries[i].get('original_query', '') for i in embedding_jobs]
+            )
+            for i, subgraphs in zip(embedding_jobs, selected):
+                subgraphs_list[i] = subgraphs
+
+        if llm_jobs:
+            llm_subgraphs = await asyncio.gather(*(
+                self._aextract_subgraphs(
+                    candidates_list[i], processed_queries[i].get('original_query', ''), deadlines[i]
+                )
+                for i in llm_jobs
+            ))
+            for i, subgraphs in zip(llm_jobs, llm_subgraphs):
+                subgraphs_list[i] = subgraphs
+
+        results = [
+            self._merge_subgraphs(candidates, subgraphs)
+            for candidates, subgraphs in zip(candidates_list, subgraphs_list)
+        ]
+        logger.info(f"Retrieved sources for {len(processed_queries)} queries in one batch")
+        return results
+
+    def _template_params(self, candidates: List[Dict[str, Any]],
+                         processed_query: Dict[str, Any]) -> Dict[str, Any]:
+        """Parameters for TICKET_SUBTREES chosen by intent and extracted sections"""
+        sections = [s for s in processed_query.get('entities', {}) if s != 'context']
+        rel_types, include_issue = select_template(processed_query.get('intent', 'general_inquiry'), sections)
+        return {
+            'ticket_ids': [c['ticket_id'] for c in candidates],
+            'rel_types': rel_types,
+            'include_issue': include_issue,
+            'per_ticket': self.subgraph_max_nodes
+        }
+
+    @staticmethod
+    def _group_subtrees(candidates: List[Dict[str, Any]],
+                        records: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """Align TICKET_SUBTREES records with the candidate order"""
+        nodes_by_ticket = {
+            record['ticket_id']: [
+                {'ticket_id': record['ticket_id'], 'text': node['text'], 'node_type': node['type']}
+                for node in record['nodes']
+            ]
+            for record in records
+        }
+        return [nodes_by_ticket.get(c['ticket_id'], []) for c in candidates]
+
+    def _ticket_trees(self, ticket_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Full trees of the tickets from the subgraph cache; misses are fetched with one graph query"""
+        trees, missing = self.subgraph_cache.lookup(ticket_ids)
+        if missing:
+            with track('graph_query'):
+                records = self.graph_store.ticket_subtrees(list(missing), TREE_RELATIONSHIPS, True, FULL_TREE_NODES)
+            for record in records:
+                trees[record['ticket_id']] = record['nodes']
+                self.subgraph_cache.put(record['ticket_id'], missing[record['ticket_id']], record['nodes'])
+        return trees
+
+    @staticmethod
+    def _drop_tickets(ticket_ids, deadline: Optional[Deadline]):
+        """Record the tickets left without a subgraph when the deadline's share ran out"""
+        for ticket_id in ticket_ids:
+            logger.warning(f"Subgraph extraction timed out for {ticket_id}")
+            if deadline:
+                deadline.degrade('subgraphs', f'contributions ({ticket_id})')
+
+    async def _aticket_trees(self, ticket_ids: List[str],
+                             deadline: Optional[Deadline] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Async variant of _ticket_trees. When the graph query overruns the
+        deadline's share only the cached trees are returned.
+        """
+        trees, missing = self.subgraph_cache.lookup(ticket_ids)
+        if missing:
+            try:
+                with track('graph_query'):
+                    records = await asyncio.wait_for(
+                        self.graph_store.aticket_subtrees(list(missing), TREE_RELATIONSHIPS, True, FULL_TREE_NODES),
+                        timeout=deadline.timeout('subgraphs') if deadline else None
+                    )
+            except asyncio.TimeoutError:
+                self._drop_tickets(missing, deadline)
+                return trees
+            for record in records:
+                trees[record['ticket_id']] = record['nodes']
+                self.subgraph_cache.put(record['ticket_id'], missing[record['ticket_id']], record['nodes'])
+        return trees
+
+    @staticmethod
+    def _select_subtrees(trees: Dict[str, List[Dict[str, Any]]], params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """TICKET_SUBTREES records cut from the full trees"""
+        return [
+            {'ticket_id': ticket_id, 'nodes': select_subtree(
+                trees[ticket_id], params['rel_types'], params['include_issue'], params['per_ticket']
+            )}
+            for ticket_id in params['ticket_ids'] if ticket_id in trees
+        ]
+
+    def _extract_subgraphs_templated(self, candidates: List[Dict[str, Any]],
+                                     processed_query: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
+        """Fetch the subtrees of all candidates with one templated graph query (cached per ticket)"""
+        if not candidates or not self.graph_store:
+            return [[] for _ in candidates]
+
+        try:
+            params = self._template_params(candidates, processed_query)
+            trees = self._ticket_trees(params['ticket_ids'])
+            return self._group_subtrees(candidates, self._select_subtrees(trees, params))
+
+        except Exception as e:
+            logger.error(f"Templated subgraph extraction failed: {str(e)}")
+            return [[] for _ in candidates]
+
+    async def _aextract_subgraphs_templated(self, candidates: List[Dict[str, Any]],
+                                            processed_query: Dict[str, Any],
+                                            deadline: Optional[Deadline] = None) -> List[List[Dict[str, Any]]]:
+        """Async variant of _extract_subgraphs_templated; cached tickets are kept when the deadline runs out"""
+        if not candidates or not self.graph_store:
+            return [[] for _ in candidates]
+
+        try:
+            params = self._template_params(candidates, processed_query)
+            trees = await self._aticket_trees(params['ticket_ids'], deadline)
+            return self._group_subtrees(candidates, self._select_subtrees(trees, params))
+
+        except Exception as e:
+            logger.error(f"Templated subgraph extraction failed: {str(e)}")
+            return [[] for _ in candidates]
+
+    @staticmethod
+    def _tree_point_ids(trees: Dict[str, List[Dict[str, Any]]]) -> List[int]:
+        """Vector store ids of all nodes of the trees"""
+        return list(dict.fromkeys(
+            point_id(node['node_id']) for tree in trees.values() for node in tree if node.get('node_id')
+        ))
+
+    def _select_by_embedding(self, candidates: List[Dict[str, Any]], trees: Dict[str, List[Dict[str, Any]]],
+                             points: List[Dict[str, Any]], query_vector: List[float]) -> List[List[Dict[str, Any]]]:
+        """Keep the SUBGRAPH_MAX_NODES tree nodes of each candidate most similar to the query"""
+        vectors = {point['id']: point['vector'] for point in points}
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        subgraphs = []
+        for candidate in candidates:
+            tree = trees.get(candidate['ticket_id'], [])
+            ids = [point_id(node['node_id']) if node.get('node_id') else None for node in tree]
+            embedded = [i for i, node_point in enumerate(ids) if node_point in vectors]
+            ranked = []
+            if embedded:
+                matrix = np.asarray([vectors[ids[i]] for i in embedded], dtype=np.float32)
+                scores = (matrix @ query) / np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+                ranked = [embedded[j] for j in np.argsort(-scores, kind='stable').tolist()]
+            # Nodes without a stored vector keep their tree order after the ranked ones
+            ranked += [i for i, node_point in enumerate(ids) if node_point not in vectors]
+            subgraphs.append([
+                {'ticket_id': candidate['ticket_id'], 'text': tree[i]['text'], 'node_type': tree[i]['type']}
+                for i in ranked[:self.subgraph_max_nodes]
+            ])
+        return subgraphs
+
+    def _extract_subgraphs_by_embedding(self, candidates: List[Dict[str, Any]],
+                                        query: str) -> List[List[Dict[str, Any]]]:
+        """
+        Load the candidates' full trees (one graph query, cached per ticket), fetch
+        their node vectors by id and keep the nodes closest to the query embedding.
+        Replaces per-ticket LLM-written Cypher with one vector operation.
+        """
+        if not candidates or not self.graph_store:
+            return [[] for _ in candidates]
+
+        try:
+            trees = self._ticket_trees([c['ticket_id'] for c in candidates])
+            query_vector = self.embed_texts([query])[0]
+            with track('vector_search'):
+                points = self.vector_store.retrieve(self._tree_point_ids(trees))
+            return self._select_by_embedding(candidates, trees, points, query_vector)
+
+        except Exception as e:
+            logger.error(f"Embedding subgraph selection failed: {str(e)}")
+            return [[] for _ in candidates]
+
+    async def _aselect_subgraphs_by_embedding(self, candidates_list: List[List[Dict[str, Any]]],
+                                              queries: List[str],
+                                              deadline: Optional[Deadline] = None) -> List[List[List[Dict[str, Any]]]]:
+        """
+        Async embedding selection for several queries: one tree lookup, embedding
+        request and vector fetch. When the embedding or the vector fetch overruns
+        the deadline's share the loaded trees are kept in tree order.
+        """
+        if not self.graph_store:
+            return [[[] for _ in candidates] for candidates in candidates_list]
+
+        try:
+            ticket_ids = [c['ticket_id'] for candidates in candidates_list for c in candidates]
+
+            async def rank_inputs(trees_task):
+                query_vectors = await self.aembed_texts(queries)
+                # Shielded: a timeout here must not cancel the tree lookup, which keeps its own bound
+                trees = await asyncio.shield(trees_task)
+                with track('vector_search'):
+                    points = await self.vector_store.aretrieve(self._tree_point_ids(trees))
+                return query_vectors, points
+
+            trees_task = asyncio.ensure_future(self._aticket_trees(ticket_ids, deadline))
+            try:
+                query_vectors, points = await asyncio.wait_for(
+                    rank_inputs(trees_task), timeout=deadline.timeout('subgraphs') if deadline else None
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Subgraph node ranking ran out of time, keeping tree order")
+                if deadline:
+                    deadline.degrade('subgraphs', 'tree_order')
+                query_vectors, points = [[] for _ in queries], []
+            trees = await trees_task
+            return [
+                self._select_by_embedding(candidates, trees, points, query_vector)
+                for candidates, query_vector in zip(candidates_list, query_vectors)
+            ]
+
+        except Exception as e:
+            logger.error(f"Embedding subgraph selection failed: {str(e)}")
+            return [[[] for _ in candidates] for candidates in candidates_list]
+
+    async def _aextract_subgraphs_by_embedding(self, candidates: List[Dict[str, Any]], query: str,
+                                               deadline: Optional[Deadline] = None) -> List[List[Dict[str, Any]]]:
+        """Async variant of _extract_subgraphs_by_embedding"""
+        if not candidates:
             return []
+        return (await self._aselect_subgraphs_by_embedding([candidates], [query], deadline))[0]
 
+    def _extract_subgraphs(self, candidates: List[Dict[str, Any]], query: str,
+                           timeout: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Extract subgraphs for all candidates in a bounded thread pool. Candidates
+        not finished when the deadline passes get an empty subgraph, so they fall
+        back to their contributions.
+        """
+        if not candidates:
+            return []
+
+        workers = max(1, min(self.subgraph_concurrency, len(candidates)))
+        # Every wave of `workers` tickets gets one per-ticket timeout
+        deadline = self.subgraph_timeout * -(-len(candidates) // workers)
+        if timeout is not None:
+            deadline = min(deadline, timeout)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
         try:
-            # 1. Ask LLM to generate Cypher query
-            prompt = f"""You are a Neo4j Cypher expert.
+            futures = [
+                executor.submit(self._extract_subgraph, candidate['ticket_id'], query)
+                for candidate in candidates
+            ]
+            wait(futures, timeout=deadline)
+
+            subgraphs = []
+            for candidate, future in zip(candidates, futures):
+                if future.done() and not future.exception():
+                    subgraphs.append(future.result())
+                else:
+                    logger.warning(f"Subgraph extraction timed out for {candidate['ticket_id']}")
+                    subgraphs.append([])
+            return subgraphs
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _aextract_subgraphs(self, candidates: List[Dict[str, Any]], query: str,
+                                  deadline: Optional[Deadline] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Async variant of _extract_subgraphs with a semaphore and per-ticket timeout.
+        Tickets not finished within the deadline's share get an empty subgraph;
+        the finished ones are kept.
+        """
+        if not candidates:
+            return []
+        semaphore = asyncio.Semaphore(max(1, self.subgraph_concurrency))
+
+        async def extract(ticket_id: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(
+                        self._aextract_subgraph(ticket_id, query),
+                        timeout=self.subgraph_timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"Subgraph extraction timed out for {ticket_id}")
+                    return []
+
+        tasks = [asyncio.ensure_future(extract(c['ticket_id'])) for c in candidates]
+        done, pending = await asyncio.wait(tasks, timeout=deadline.timeout('subgraphs') if deadline else None)
+        for task in pending:
+            task.cancel()
+        self._drop_tickets([c['ticket_id'] for c, task in zip(candidates, tasks) if task in pending], deadline)
+        return [task.result() if task in done and not task.exception() else [] for task in tasks]
+
+    def _build_subgraph_prompt(self, ticket_id: str, query: str) -> str:
+        """Prompt asking the LLM for a Cypher query over one intra-issue tree"""
+        return f"""You are a Neo4j Cypher expert.
 User Query: "{query}"
 Target Ticket ID: "{ticket_id}"
 
@@ -288,35 +963,78 @@ Example: MATCH (i:Issue {{id: "{ticket_id}"}})-[:HAS_DESCRIPTION]->(d) RETURN d.
 
 Return ONLY the Cypher query. No explanation."""
 
-            response = ollama.chat(
-                model=os.getenv("LLM_MODEL", "llama2:7b-chat-q4_0"),
-                messages=[{'role': 'user', 'content': prompt}]
-            )
-            
-            cypher = response['message']['content'].strip()
-            # Basic sanitization
-            cypher = cypher.replace('```cypher', '').replace('```', '').strip()
-            
-            if not cypher.upper().startswith("MATCH"):
-                logger.warning(f"Invalid Cypher generated: {cypher}")
+    @staticmethod
+    def _clean_cypher(content: str) -> Optional[str]:
+        """Strip markdown fences from generated Cypher and reject non-MATCH queries"""
+        cypher = content.strip()
+        # Basic sanitization
+        cypher = cypher.replace('```cypher', '').replace('```', '').strip()
+
+        if not cypher.upper().startswith("MATCH"):
+            logger.warning(f"Invalid Cypher generated: {cypher}")
+            return None
+        return cypher
+
+    @staticmethod
+    def _record_to_node(ticket_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Standardize a subgraph record for AnswerGenerator"""
+        # We expect keys like 'text', 'content', 'type' or whole nodes
+        return {
+            'ticket_id': ticket_id,
+            'text': data.get('text') or data.get('content') or str(data),
+            'node_type': data.get('type') or 'SubNode'
+        }
+
+    def _extract_subgraph(self, ticket_id: str, query: str) -> List[Dict[str, Any]]:
+        """
+        Use LLM to generate a Cypher query to extract a relevant subgraph from an intra-issue tree.
+        SIGIR '24 Step 2.1 implementation.
+        """
+        if not self.graph_store:
+            return []
+
+        try:
+            # 1. Ask LLM to generate Cypher query
+            with track('cypher_generation'):
+                response = ollama.chat(
+                    model=self.llm_model,
+                    messages=[{'role': 'user', 'content': self._build_subgraph_prompt(ticket_id, query)}]
+                )
+            count_tokens('cypher_generation', response)
+
+            cypher = self._clean_cypher(response['message']['content'])
+            if not cypher:
                 return []
 
             # 2. Execute the Cypher query
-            results = []
-            with self.neo4j_driver.session() as session:
-                result = session.run(cypher)
-                for record in result:
-                    # We expect keys like 'text', 'content', 'type' or whole nodes
-                    data = dict(record)
-                    # Standardize format for AnswerGenerator
-                    node_data = {
-                        'ticket_id': ticket_id,
-                        'text': data.get('text') or data.get('content') or str(data),
-                        'node_type': data.get('type') or 'SubNode'
-                    }
-                    results.append(node_data)
-            
-            return results
+            with track('graph_query'):
+                records = self.graph_store.run_cypher(cypher)
+            return [self._record_to_node(ticket_id, record) for record in records]
+
+        except Exception as e:
+            logger.error(f"Subgraph extraction failed for {ticket_id}: {str(e)}")
+            return []
+
+    async def _aextract_subgraph(self, ticket_id: str, query: str) -> List[Dict[str, Any]]:
+        """Async variant of _extract_subgraph"""
+        if not self.graph_store:
+            return []
+
+        try:
+            with track('cypher_generation'):
+                response = await self.async_ollama.chat(
+                    model=self.llm_model,
+                    messages=[{'role': 'user', 'content': self._build_subgraph_prompt(ticket_id, query)}]
+                )
+            count_tokens('cypher_generation', response)
+
+            cypher = self._clean_cypher(response['message']['content'])
+            if not cypher:
+                return []
+
+            with track('graph_query'):
+                records = await self.graph_store.arun_cypher(cypher)
+            return [self._record_to_node(ticket_id, record) for record in records]
 
         except Exception as e:
             logger.error(f"Subgraph extraction failed for {ticket_id}: {str(e)}")
@@ -331,36 +1049,18 @@ Return ONLY the Cypher query. No explanation."""
             'tickets': 0
         }
 
-        # Neo4j stats
-        if self.neo4j_driver:
+        # Graph stats
+        if self.graph_store:
             try:
-                with self.neo4j_driver.session() as session:
-                    result = session.run("MATCH (n) RETURN count(n) as nodes")
-                    stats['nodes'] = result.single()['nodes']
-
-                    result = session.run("MATCH ()-[r]->() RETURN count(r) as relationships")
-                    stats['relationships'] = result.single()['relationships']
-
-                    result = session.run("MATCH (i:Issue) RETURN count(i) as tickets")
-                    stats['tickets'] = result.single()['tickets']
+                stats.update(self.graph_store.stats())
             except Exception as e:
-                logger.error(f"Neo4j stats failed: {str(e)}")
+                logger.error(f"Graph stats failed: {str(e)}")
 
-        # Qdrant stats
-        if self.qdrant_client:
+        # Vector store stats
+        if self.vector_store:
             try:
-                # This might fail due to client version issues, but we'll try
-                info = self.qdrant_client.get_collection(self.collection_name)
-                stats['vectors'] = getattr(info, 'points_count', 0)
-            except Exception:
-                # Fallback: try to count via scroll
-                try:
-                    result = self.qdrant_client.scroll(
-                        collection_name=self.collection_name,
-                        limit=1000
-                    )
-                    stats['vectors'] = len(result[0]) if result else 0
-                except Exception as e:
-                    logger.error(f"Qdrant stats failed: {str(e)}")
+                stats['vectors'] = self.vector_store.count()
+            except Exception as e:
+                logger.error(f"Vector store stats failed: {str(e)}")
 
         return stats
\ No newline at end of file
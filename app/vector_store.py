@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+Vector Stores for RAG-KG Customer Service QA System
+
+Retrieval and embedding generation go through a VectorStore instead of
+talking to Qdrant directly. Two backends are available (VECTOR_BACKEND):
+
+- qdrant: the Qdrant server (default)
+- local: an in-process index persisted to a directory. Vectors are kept in a
+  memory-mapped float16 embedding store (app/embedding_store.py) shared by
+  all workers. Small collections are searched exactly (brute-force top-k over
+  the mapped matrix); above HNSW_THRESHOLD vectors an HNSW graph is used when
+  hnswlib is installed. It needs no server, so tests and benchmarks can run
+  offline.
+
+Both backends can quantize vectors (VECTOR_QUANTIZATION=int8 or binary, see
+app/quantization.py): search runs over the compressed vectors and rescores
+the top `limit * QUANTIZATION_OVERSAMPLING` candidates with the originals.
+
+Points are dicts {'id', 'vector', 'payload'} and hits are dicts
+{'id', 'score', 'payload'}. Point ids are derived from graph node ids with
+`point_id`, so a node's vector can be fetched by id (`retrieve`). Payload filters map a field to a value or a list
+of accepted values; all fields must match.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import importlib.util
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+from app.embedding_store import SEARCH_BLOCK_ROWS, EmbeddingStore, exact_top_k
+from app.lazy import lazy_import
+from app.quantization import create_quantizer, encode_blocks, load_quantizer, quantized_top_k
+
+np = lazy_import('numpy')
+hnswlib = lazy_import('hnswlib')
+qdrant_client = lazy_import('qdrant_client')
+qdrant_models = lazy_import('qdrant_client.models')
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCAL_INDEX_DIR = "data/vector_index"
+
+
+def point_id(node_id: str) -> int:
+    """Stable point id of a graph node id (unlike hash(), which is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(node_id.encode('utf-8'), digest_size=8).digest(), 'big') % 2**63
+
+
+class VectorStore:
+    """Interface shared by the vector backends"""
+
+    backend = 'base'
+
+    def connect(self):
+        """Open connections or load the index"""
+
+    def close(self):
+        """Release connections"""
+
+    async def aclose(self):
+        self.close()
+
+    def create_collection(self, vector_size: int):
+        """Create the collection if it does not exist"""
+        raise NotImplementedError
+
+    def create_payload_indexes(self, fields: List[str]):
+        """Index payload fields used in search filters (the local index builds its postings on first use)"""
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        """Insert or replace points {'id', 'vector', 'payload'}"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Make upserted points durable (no-op for servers)"""
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def check(self) -> bool:
+        """Whether the store is reachable and holds a collection"""
+        try:
+            return self.count() > 0
+        except Exception:
+            return False
+
+    async def awarm(self):
+        """Open the first connection / load the index before the first query"""
+        await asyncio.to_thread(self.count)
+
+    def search_batch(self, vectors: List[List[float]], limit: int,
+                     score_threshold: Optional[float] = None,
+                     filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Top-`limit` hits per query vector, best first"""
+        raise NotImplementedError
+
+    async def asearch_batch(self, vectors: List[List[float]], limit: int,
+                            score_threshold: Optional[float] = None,
+                            filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Async variant of search_batch (runs in a worker thread by default)"""
+        return await asyncio.to_thread(self.search_batch, vectors, limit, score_threshold, filters)
+
+    def search(self, vector: List[float], limit: int, score_threshold: Optional[float] = None,
+               filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self.search_batch([vector], limit, score_threshold, filters)[0]
+
+    def retrieve(self, ids: List[Any]) -> List[Dict[str, Any]]:
+        """Points {'id', 'vector', 'payload'} with these ids; unknown ids are skipped"""
+        raise NotImplementedError
+
+    async def aretrieve(self, ids: List[Any]) -> List[Dict[str, Any]]:
+        """Async variant of retrieve (runs in a worker thread by default)"""
+        return await asyncio.to_thread(self.retrieve, ids)
+
+    async def asearch(self, vector: List[float], limit: int, score_threshold: Optional[float] = None,
+                      filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return (await self.asearch_batch([vector], limit, score_threshold, filters))[0]
+
+
+class QdrantStore(VectorStore):
+    """Vector store backed by a Qdrant server"""
+
+    backend = 'qdrant'
+
+    def __init__(self, url: str, collection_name: str, timeout: Optional[int] = None,
+                 quantization: Optional[str] = None, oversampling: Optional[float] = None):
+        self.url = url
+        self.collection_name = collection_name
+        self.timeout = timeout
+        self.quantization = (quantization or os.getenv("VECTOR_QUANTIZATION", "none")).lower()
+        self.oversampling = float(oversampling or os.getenv("QUANTIZATION_OVERSAMPLING", 4))
+        self.client = None
+        self.async_client = None
+
+    def connect(self):
+        self.client = qdrant_client.QdrantClient(url=self.url, timeout=self.timeout)
+        self.async_client = qdrant_client.AsyncQdrantClient(url=self.url, timeout=self.timeout)
+
+    def close(self):
+        if self.client:
+            self.client.close()
+
+    async def aclose(self):
+        if self.async_client:
+            await self.async_client.close()
+
+    def _quantization_config(self):
+        if self.quantization == 'int8':
+            return qdrant_models.ScalarQuantization(scalar=qdrant_models.ScalarQuantizationConfig(
+                type=qdrant_models.ScalarType.INT8, quantile=0.99, always_ram=True
+            ))
+        if self.quantization == 'binary':
+            return qdrant_models.BinaryQuantization(binary=qdrant_models.BinaryQuantizationConfig(always_ram=True))
+        if self.quantization != 'none':
+            raise ValueError(f"Unknown quantization '{self.quantization}'")
+        return None
+
+    def create_collection(self, vector_size: int):
+        quantization_config = self._quantization_config()
+        try:
+            self.client.create_collection(
+                collection_name=self.collection_name,
+                # Quantized vectors stay in RAM; the originals, only read for rescoring, go to disk
+                vectors_config=qdrant_models.VectorParams(
+                    size=vector_size, distance=qdrant_models.Distance.COSINE,
+                    on_disk=quantization_config is not None
+                ),
+                quantization_config=quantization_config
+            )
+            logger.info(f"Created collection '{self.collection_name}' with vector size {vector_size}"
+                        f" (quantization: {self.quantization})")
+        except Exception as e:
+            if "already exists" in str(e).lower():
+                logger.info(f"Collection '{self.collection_name}' already exists")
+            else:
+                raise e
+
+    def create_payload_indexes(self, fields: List[str]):
+        # Keyword indexes let filtered searches skip non-matching points instead of scanning them
+        for field in fields:
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field,
+                field_schema=qdrant_models.PayloadSchemaType.KEYWORD
+            )
+        logger.info(f"Created payload indexes on {', '.join(fields)} in '{self.collection_name}'")
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        self.client.upsert(
+            collection_name=self.collection_name,
+            points=[qdrant_models.PointStruct(**point) for point in points]
+        )
+
+    def count(self) -> int:
+        info = self.client.get_collection(self.collection_name)
+        return getattr(info, 'points_count', 0) or 0
+
+    async def awarm(self):
+        await self.async_client.get_collection(self.collection_name)
+
+    @staticmethod
+    def _filter(filters: Optional[Dict[str, Any]]):
+        if not filters:
+            return None
+        conditions = []
+        for key, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                match = qdrant_models.MatchAny(any=list(value))
+            else:
+                match = qdrant_models.MatchValue(value=value)
+            conditions.append(qdrant_models.FieldCondition(key=key, match=match))
+        return qdrant_models.Filter(must=conditions)
+
+    def _requests(self, vectors, limit, score_threshold, filters) -> List['qdrant_models.SearchRequest']:
+        query_filter = self._filter(filters)
+        search_params = None
+        if self.quantization != 'none':
+            search_params = qdrant_models.SearchParams(quantization=qdrant_models.QuantizationSearchParams(
+                rescore=True, oversampling=self.oversampling
+            ))
+        return [
+            qdrant_models.SearchRequest(
+                vector=vector,
+                limit=limit,
+                score_threshold=score_threshold,
+                filter=query_filter,
+                params=search_params,
+                with_payload=True
+            )
+            for vector in vectors
+        ]
+
+    @staticmethod
+    def _hits(batch_result) -> List[List[Dict[str, Any]]]:
+        return [
+            [{'id': hit.id, 'score': hit.score, 'payload': hit.payload or {}} for hit in hits]
+            for hits in batch_result
+        ]
+
+    def search_batch(self, vectors, limit, score_threshold=None, filters=None):
+        batch_result = self.client.search_batch(
+            collection_name=self.collection_name,
+            requests=self._requests(vectors, limit, score_threshold, filters)
+        )
+        return self._hits(batch_result)
+
+    @staticmethod
+    def _points(records) -> List[Dict[str, Any]]:
+        return [{'id': record.id, 'vector': record.vector, 'payload': record.payload or {}} for record in records]
+
+    def retrieve(self, ids):
+        if not ids:
+            return []
+        return self._points(self.client.retrieve(self.collection_name, ids=ids, with_payload=True, with_vectors=True))
+
+    async def aretrieve(self, ids):
+        if not ids:
+            return []
+        records = await self.async_client.retrieve(self.collection_name, ids=ids, with_payload=True, with_vectors=True)
+        return self._points(records)
+
+    async def asearch_batch(self, vectors, limit, score_threshold=None, filters=None):
+        batch_result = await self.async_client.search_batch(
+            collection_name=self.collection_name,
+            requests=self._requests(vectors, limit, score_threshold, filters)
+        )
+        return self._hits(batch_result)
+
+
+class LocalVectorStore(VectorStore):
+    """In-process cosine index persisted to a directory: exact top-k, HNSW when large"""
+
+    backend = 'local'
+
+    POINTS_FILE = 'points.json'
+    HNSW_FILE = 'hnsw.bin'
+    CODES_FILE = 'codes.npy'
+
+    def __init__(self, path: str, hnsw_threshold: Optional[int] = None, hnsw_m: Optional[int] = None,
+                 hnsw_ef_construction: Optional[int] = None, hnsw_ef_search: Optional[int] = None,
+                 quantization: Optional[str] = None, oversampling: Optional[float] = None):
+        self.path = Path(path)
+        # Chosen when the index is built; a loaded index keeps the quantization it was saved with
+        self.quantization = (quantization or os.getenv("VECTOR_QUANTIZATION", "none")).lower()
+        self.oversampling = float(oversampling or os.getenv("QUANTIZATION_OVERSAMPLING", 4))
+        self.hnsw_threshold = int(hnsw_threshold or os.getenv("HNSW_THRESHOLD", 20000))
+        self.hnsw_m = int(hnsw_m or os.getenv("HNSW_M", 16))
+        self.hnsw_ef_construction = int(hnsw_ef_construction or os.getenv("HNSW_EF_CONSTRUCTION", 200))
+        self.hnsw_ef_search = int(hnsw_ef_search or os.getenv("HNSW_EF_SEARCH", 64))
+
+        self.dim: Optional[int] = None
+        # (n, dim) rows L2-normalized: the mapped float16 store once loaded,
+        # float32 in memory while points are being upserted
+        self._matrix = None
+        self._pending: List[Any] = []  # upserted rows not yet stacked into the matrix
+        self.ids: Any = []  # list while building, mapped array once loaded
+        self.payloads: List[Dict[str, Any]] = []
+        self._row_of: Optional[Dict[Any, int]] = None
+        self._postings: Dict[str, Dict[Any, List[int]]] = {}  # field -> value -> rows
+        self._hnsw = None
+        self._quantizer = None
+        self._codes = None  # quantized rows, memory-mapped once saved
+        self._lock = threading.Lock()
+
+    def connect(self):
+        self.load()
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def check(self) -> bool:
+        return self.count() > 0
+
+    def create_collection(self, vector_size: int):
+        if self.dim is not None and self.dim != vector_size:
+            raise ValueError(f"Local index at {self.path} has vector size {self.dim}, not {vector_size}")
+        self.dim = vector_size
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def upsert(self, points: List[Dict[str, Any]]):
+        if not points:
+            return
+        # Repeated ids in one batch: the last copy wins, as in Qdrant
+        points = list({point['id']: point for point in points}.values())
+        vectors = self._normalize([point['vector'] for point in points])
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+
+        with self._lock:
+            self._consolidate()
+            if isinstance(self._matrix, np.memmap):
+                # Copy a loaded (read-only, shared) index into memory before changing it
+                self._matrix = np.array(self._matrix, dtype=np.float32)
+                self.ids = self.ids.tolist()
+            if self._row_of is None:
+                self._row_of = {point_id: row for row, point_id in enumerate(self.ids)}
+            for point, vector in zip(points, vectors):
+                row = self._row_of.get(point['id'])
+                if row is None:
+                    self._row_of[point['id']] = len(self.ids)
+                    self.ids.append(point['id'])
+                    self.payloads.append(point.get('payload') or {})
+                    self._pending.append(vector)
+                else:
+                    self.payloads[row] = point.get('payload') or {}
+                    self._matrix[row] = vector
+            self._postings = {}
+            self._hnsw = None
+            self._quantizer = None
+            self._codes = None
+
+    def _consolidate(self):
+        """Stack pending rows into the matrix (caller holds the lock)"""
+        if not self._pending:
+            return
+        pending = np.vstack(self._pending)
+        self._matrix = pending if self._matrix is None else np.vstack([self._matrix, pending])
+        self._pending = []
+
+    def flush(self):
+        self.save()
+
+    def save(self):
+        """Write the float16 embedding store, quantized codes, payloads and (if built) the HNSW graph"""
+        with self._lock:
+            self._consolidate()
+            matrix = self._matrix if self._matrix is not None else np.zeros((0, self.dim or 0), np.float32)
+            EmbeddingStore.write(str(self.path), list(self.ids), matrix)
+            self._save_codes(matrix)
+
+            points_tmp = self.path / f"{self.POINTS_FILE}.tmp"
+            with open(points_tmp, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'dim': self.dim,
+                    'quantization': self._quantizer.state() if self._quantizer else None,
+                    'payloads': self.payloads
+                }, f)
+            os.replace(points_tmp, self.path / self.POINTS_FILE)
+
+            hnsw = self._build_hnsw() if self._wants_hnsw() else None
+            hnsw_path = self.path / self.HNSW_FILE
+            if hnsw is not None:
+                hnsw.save_index(str(hnsw_path))
+            elif hnsw_path.exists():
+                hnsw_path.unlink()
+
+        logger.info(f"Saved local vector index ({self.count()} vectors, quantization: {self.quantization}) to {self.path}")
+
+    def _save_codes(self, matrix):
+        """Quantize the matrix into codes.npy and map it (caller holds the lock)"""
+        codes_path = self.path / self.CODES_FILE
+        quantizer = create_quantizer(self.quantization)
+        if quantizer is None:
+            if codes_path.exists():
+                codes_path.unlink()
+            self._quantizer, self._codes = None, None
+            return
+
+        quantizer.fit(matrix)
+        codes_tmp = self.path / f"tmp-{self.CODES_FILE}"
+        codes = np.lib.format.open_memmap(
+            codes_tmp, mode='w+', dtype=quantizer.code_dtype,
+            shape=(matrix.shape[0], quantizer.code_width(matrix.shape[1]))
+        )
+        encode_blocks(quantizer, matrix, codes)
+        codes.flush()
+        del codes
+        os.replace(codes_tmp, codes_path)
+        self._quantizer, self._codes = quantizer, np.load(codes_path, mmap_mode='r')
+
+    def load(self):
+        """Map a saved index; a missing directory leaves the store empty"""
+        points_path = self.path / self.POINTS_FILE
+        if not points_path.exists() or not EmbeddingStore.exists(str(self.path)):
+            logger.info(f"No local vector index at {self.path}, starting empty")
+            return
+
+        with open(points_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        embeddings = EmbeddingStore.open(str(self.path))
+        with self._lock:
+            self.dim = saved['dim']
+            self.payloads = saved['payloads']
+            self._matrix = embeddings.matrix
+            self.ids = embeddings.ids
+            self._row_of = None
+            self._pending = []
+            self._postings = {}
+            self._hnsw = None
+
+            self._quantizer = load_quantizer(saved.get('quantization'))
+            self._codes = None
+            self.quantization = self._quantizer.kind if self._quantizer else 'none'
+            if self._quantizer is not None:
+                self._codes = np.load(self.path / self.CODES_FILE, mmap_mode='r')
+
+            hnsw_path = self.path / self.HNSW_FILE
+            if hnsw_path.exists() and self._wants_hnsw():
+                index = hnswlib.Index(space='cosine', dim=self.dim)
+                index.load_index(str(hnsw_path), max_elements=self.count())
+                self._hnsw = index
+
+        logger.info(f"Loaded local vector index ({self.count()} vectors, quantization: {self.quantization})"
+                    f" from {self.path}" + (" with HNSW graph" if self._hnsw is not None else ""))
+
+    def _wants_hnsw(self) -> bool:
+        # A quantized index is scanned instead: the graph would hold float32 copies of the vectors
+        if self.quantization != 'none' or self.count() < self.hnsw_threshold:
+            return False
+        if importlib.util.find_spec('hnswlib') is None:
+            logger.warning("hnswlib is not installed, the local index will use exact search")
+            self.hnsw_threshold = float('inf')  # warn once
+            return False
+        return True
+
+    def _build_hnsw(self):
+        """Build the HNSW graph over the current matrix (caller holds the lock)"""
+        if self._hnsw is None:
+            index = hnswlib.Index(space='cosine', dim=self.dim)
+            index.init_index(max_elements=self.count(), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+            for start in range(0, self.count(), SEARCH_BLOCK_ROWS):
+                block = np.asarray(self._matrix[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                index.add_items(block, np.arange(start, start + len(block)))
+            self._hnsw = index
+            logger.info(f"Built HNSW graph over {self.count()} vectors")
+        return self._hnsw
+
+    def _allowed_rows(self, filters: Dict[str, Any]):
+        """Rows whose payload matches every filter, as a sorted array"""
+        rows = None
+        for key, value in filters.items():
+            if key not in self._postings:
+                postings: Dict[Any, List[int]] = {}
+                for row, payload in enumerate(self.payloads):
+                    if key in payload:
+                        postings.setdefault(payload[key], []).append(row)
+                self._postings[key] = postings
+            accepted = value if isinstance(value, (list, tuple, set)) else [value]
+            matched = set()
+            for item in accepted:
+                matched.update(self._postings[key].get(item, ()))
+            rows = matched if rows is None else rows & matched
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def _approximate(self, index, queries, rows, limit: int):
+        k = min(limit, index.get_current_count() if rows is None else len(rows))
+        index.set_ef(max(self.hnsw_ef_search, k))
+        if rows is None:
+            labels, distances = index.knn_query(queries, k=k)
+        else:
+            allowed = set(rows.tolist())
+            labels, distances = index.knn_query(queries, k=k, filter=lambda label: label in allowed)
+        return labels, 1.0 - distances
+
+    def search_batch(self, vectors, limit, score_threshold=None, filters=None):
+        if not vectors:
+            return []
+        with self._lock:
+            self._consolidate()
+            if not self.count() or limit <= 0:
+                return [[] for _ in vectors]
+            matrix, ids, payloads = self._matrix, self.ids, self.payloads
+            quantizer, codes = self._quantizer, self._codes
+            rows = self._allowed_rows(filters) if filters else None
+            candidates = len(ids) if rows is None else len(rows)
+            # Exact search is faster than the graph for small (or heavily filtered) sets
+            index = self._build_hnsw() if candidates >= self.hnsw_threshold and self._wants_hnsw() else None
+
+        if candidates == 0:
+            return [[] for _ in vectors]
+
+        queries = self._normalize(vectors)
+        if index is not None:
+            labels, scores = self._approximate(index, queries, rows, limit)
+        elif codes is not None:
+            labels, scores = quantized_top_k(quantizer, codes, matrix, queries, limit, self.oversampling, rows)
+        else:
+            labels, scores = exact_top_k(matrix, queries, limit, rows)
+
+        results = []
+        for query_labels, query_scores in zip(labels, scores):
+            hits = []
+            for row, score in zip(query_labels.tolist(), query_scores.tolist()):
+                if score_threshold is not None and score < score_threshold:
+                    break
+                point_id = ids[row]
+                hits.append({
+                    'id': point_id.item() if hasattr(point_id, 'item') else point_id,
+                    'score': score,
+                    'payload': payloads[row]
+                })
+            results.append(hits)
+        return results
+
+    def retrieve(self, ids):
+        if not ids:
+            return []
+        with self._lock:
+            self._consolidate()
+            if self._row_of is None:
+                ids_list = self.ids.tolist() if hasattr(self.ids, 'tolist') else self.ids
+                self._row_of = {point_id: row for row, point_id in enumerate(ids_list)}
+            rows = [(wanted, self._row_of.get(wanted)) for wanted in ids]
+            matrix, payloads = self._matrix, self.payloads
+
+        found = [(wanted, row) for wanted, row in rows if row is not None]
+        if not found:
+            return []
+        vectors = np.asarray(matrix[[row for _, row in found]], dtype=np.float32)
+        return [
+            {'id': wanted, 'vector': vector, 'payload': payloads[row]}
+            for (wanted, row), vector in zip(found, vectors.tolist())
+        ]
+
+    async def awarm(self):
+        await asyncio.to_thread(self.search_batch, [[0.0] * (self.dim or 1)], 1)
+
+
+def create_vector_store(backend: Optional[str] = None, collection_name: Optional[str] = None,
+                        url: Optional[str] = None, index_dir: Optional[str] = None,
+                        timeout: Optional[int] = None, quantization: Optional[str] = None) -> VectorStore:
+    """Vector store for VECTOR_BACKEND ('qdrant' or 'local'); not connected yet"""
+    backend = (backend or os.getenv("VECTOR_BACKEND", "qdrant")).lower()
+    collection_name = collection_name or os.getenv("COLLECTION_NAME", "tickets")
+
+    if backend == 'qdrant':
+        return QdrantStore(url or os.getenv("QDRANT_URL", "http://localhost:6333"), collection_name, timeout,
+                           quantization=quantization)
+    if backend == 'local':
+        index_dir = index_dir or os.getenv("LOCAL_INDEX_DIR", DEFAULT_LOCAL_INDEX_DIR)
+        return LocalVectorStore(str(Path(index_dir) / collection_name), quantization=quantization)
+    raise ValueError(f"Unknown vector backend '{backend}' (expected 'qdrant' or 'local')")
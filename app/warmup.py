@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Startup Warm-up for RAG-KG Customer Service QA System
+
+After the components are built, opens the graph store and vector store connections,
+loads the Ollama models and runs one synthetic query end to end, so the first
+real request does not pay for cold connections and model loading. Progress is
+tracked in a Readiness record served by /ready and /health.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP_QUESTION = "How do I fix a login error on the mobile app?"
+
+
+class Readiness:
+    """Startup progress: warm-up steps, whether the API is ready, and the cold-start time"""
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.cold_start_ms: Optional[float] = None
+        self.steps: List[Dict[str, Any]] = []
+
+    async def step(self, name: str, action: Callable[[], Awaitable[Any]]) -> bool:
+        """Run one warm-up step; a failure is recorded but does not stop the warm-up"""
+        entry = {'name': name, 'status': 'running', 'ms': None}
+        self.steps.append(entry)
+        start = time.perf_counter()
+        try:
+            await action()
+            entry['status'] = 'ok'
+        except Exception as e:
+            logger.warning(f"Warm-up step '{name}' failed: {str(e)}")
+            entry.update(status='failed', error=str(e))
+        entry['ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return entry['status'] == 'ok'
+
+    def finish(self):
+        self.ready = True
+        self.cold_start_ms = round((time.monotonic() - self.started_at) * 1000, 1)
+        failed = [s['name'] for s in self.steps if s['status'] == 'failed']
+        logger.info(f"Ready after {self.cold_start_ms:.0f}ms" +
+                    (f" (failed warm-up steps: {', '.join(failed)})" if failed else ""))
+
+    @property
+    def status(self) -> str:
+        if not self.ready:
+            return 'starting'
+        return 'degraded' if any(s['status'] == 'failed' for s in self.steps) else 'healthy'
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'status': self.status,
+            'cold_start_ms': self.cold_start_ms,
+            'uptime_seconds': round(time.monotonic() - self.started_at, 1),
+            'steps': self.steps
+        }
+
+
+async def warm_up(query_processor, retrieval_system, answer_generator, readiness: Readiness):
+    """Warm connections and models, then answer one synthetic question"""
+    logger.info("Warming up connections and models...")
+
+    # Connections first (concurrently), then one model at a time so Ollama
+    # does not load them all at once
+    await asyncio.gather(
+        readiness.step('graph_store_connection', retrieval_system.awarm_graph_store),
+        readiness.step('vector_store_connection', retrieval_system.awarm_vector_store)
+    )
+    await readiness.step('embedding_model', retrieval_system.awarm_embedding_model)
+    await readiness.step('parsing_model', query_processor.awarm)
+    await readiness.step('answer_model', answer_generator.awarm)
+
+    async def synthetic_query():
+        question = os.getenv("WARMUP_QUESTION", DEFAULT_WARMUP_QUESTION)
+        processed_query = await query_processor.aprocess(question)
+        sources = await retrieval_system.aretrieve(processed_query)
+        await answer_generator.agenerate(question, sources, processed_query)
+
+    await readiness.step('synthetic_query', synthetic_query)
+    readiness.finish()
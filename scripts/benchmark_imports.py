@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Import-Time Benchmark for RAG-KG Customer Service QA System
+
+Measures the startup cost of the API module and each CLI script with
+`python -X importtime`, in fresh interpreters, and summarizes the slowest
+top-level imports. Results can be written to JSON and compared against a
+previous run to catch import-time regressions.
+"""
+
+import json
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Targets: a module imported with -c, or a script run with --help
+TARGETS: Dict[str, List[str]] = {
+    'app': ['-c', 'import app'],
+    'app.main': ['-c', 'import app.main'],
+    'build_graph': ['scripts/build_graph.py', '--help'],
+    'generate_embeddings': ['scripts/generate_embeddings.py', '--help'],
+    'parse_tickets': ['scripts/parse_tickets.py', '--help'],
+    'validate_data': ['scripts/validate_data.py', '--help'],
+}
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """Parse '-X importtime' lines into {module, self_us, cumulative_us, depth}"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append({
+            'module': name.strip(),
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+            'depth': depth
+        })
+    return rows
+
+
+def measure(args: List[str]) -> Dict[str, Any]:
+    """Run one target in a fresh interpreter and collect wall time and import times"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    rows = parse_importtime(result.stderr)
+    # Top-level imports are the shallowest entries (depth 0 after '-c'/script)
+    min_depth = min((row['depth'] for row in rows), default=0)
+    top_level = [row for row in rows if row['depth'] == min_depth]
+    return {
+        'ok': result.returncode == 0,
+        'error': result.stderr.strip().splitlines()[-1] if result.returncode else None,
+        'wall_ms': wall_ms,
+        'import_ms': sum(row['cumulative_us'] for row in top_level) / 1000,
+        'top_level': top_level
+    }
+
+
+def benchmark(targets: List[str], repeat: int, top: int) -> Dict[str, Any]:
+    """Median wall and import time per target, plus its slowest top-level imports"""
+    results = {}
+    for name in targets:
+        runs = [measure(TARGETS[name]) for _ in range(repeat)]
+        last = runs[-1]
+        slowest = sorted(last['top_level'], key=lambda row: row['cumulative_us'], reverse=True)[:top]
+        results[name] = {
+            'ok': all(run['ok'] for run in runs),
+            'error': last['error'],
+            'wall_ms': round(statistics.median(run['wall_ms'] for run in runs), 1),
+            'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+            'slowest_imports': [
+                {'module': row['module'], 'cumulative_ms': round(row['cumulative_us'] / 1000, 1)}
+                for row in slowest
+            ]
+        }
+    return results
+
+
+def print_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"{'target':<22} {'wall_ms':>9} {'import_ms':>10} {'vs_baseline':>12}  slowest imports")
+    for name, result in results.items():
+        delta = ''
+        if baseline and name in baseline.get('results', {}):
+            delta = f"{result['import_ms'] - baseline['results'][name]['import_ms']:+.1f}"
+        slowest = ", ".join(f"{row['module']} {row['cumulative_ms']:.0f}ms" for row in result['slowest_imports'])
+        if not result['ok']:
+            slowest = f"FAILED: {result['error']}"
+        print(f"{name:<22} {result['wall_ms']:>9.1f} {result['import_ms']:>10.1f} {delta:>12}  {slowest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time of the API and CLI scripts")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS),
+                       help="Targets to measure")
+    parser.add_argument("--repeat", type=int, default=5,
+                       help="Fresh interpreter runs per target (median is reported)")
+    parser.add_argument("--top", type=int, default=5,
+                       help="Slowest top-level imports listed per target")
+    parser.add_argument("--output", type=str, default=None,
+                       help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None,
+                       help="Compare against a previous --output file")
+    args = parser.parse_args()
+
+    results = benchmark(args.targets, args.repeat, args.top)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        output = {
+            'python': sys.version.split()[0],
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat,
+            'results': results
+        }
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Vector Search Benchmark for RAG-KG Customer Service QA System
+
+Compares the local vector index modes offline: exact float16 search, int8 and
+binary quantization (at several oversampling factors) and the HNSW graph.
+For each mode it reports recall@k against exact float32 search, the memory
+held by the searched structure, and per-query latency. Vectors come from an
+existing local index (--index_dir) or are generated (clustered, so that the
+nearest neighbours are meaningful).
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import importlib.util
+from pathlib import Path
+from typing import Dict, List, Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.embedding_store import EmbeddingStore, exact_top_k
+from app.lazy import lazy_import
+from app.vector_store import LocalVectorStore
+
+np = lazy_import('numpy')
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, seed: int):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return (centers[rng.integers(0, clusters, count)] + 0.5 * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def directory_mb(path: Path, names: List[str]) -> float:
+    return sum((path / name).stat().st_size for name in names if (path / name).exists()) / 2**20
+
+
+def run_mode(vectors, queries, truth, k: int, workdir: Path, quantization: str,
+             oversampling: float, hnsw: bool) -> Dict[str, Any]:
+    """Build one index, then time single-query searches and measure recall@k"""
+    store = LocalVectorStore(
+        str(workdir), quantization=quantization, oversampling=oversampling,
+        hnsw_threshold=1 if hnsw else 2**62
+    )
+    start = time.perf_counter()
+    store.upsert([{'id': i, 'vector': vector, 'payload': {}} for i, vector in enumerate(vectors)])
+    store.save()
+    build_s = time.perf_counter() - start
+
+    store = LocalVectorStore(str(workdir), oversampling=oversampling, hnsw_threshold=1 if hnsw else 2**62)
+    store.load()
+
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = store.search(query.tolist(), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len({hit['id'] for hit in hits} & set(expected)) / k)
+
+    # Memory held by the structure each query scans; the float16 originals are
+    # only read for the rescored candidates when quantized
+    if hnsw:
+        searched = [LocalVectorStore.HNSW_FILE]
+    elif quantization != 'none':
+        searched = [LocalVectorStore.CODES_FILE]
+    else:
+        searched = [EmbeddingStore.MATRIX_FILE]
+    on_disk = [EmbeddingStore.MATRIX_FILE, EmbeddingStore.IDS_FILE, LocalVectorStore.CODES_FILE,
+               LocalVectorStore.HNSW_FILE, LocalVectorStore.POINTS_FILE]
+
+    latencies.sort()
+    return {
+        'mode': 'hnsw' if hnsw else quantization,
+        'oversampling': oversampling if quantization != 'none' else None,
+        f'recall@{k}': round(statistics.mean(recalls), 4),
+        'memory_mb': round(directory_mb(workdir, searched), 2),
+        'disk_mb': round(directory_mb(workdir, on_disk), 2),
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 3),
+        'build_s': round(build_s, 2)
+    }
+
+
+def benchmark(vectors, query_count: int, k: int, modes: List[str], oversampling: List[float],
+              seed: int) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed + 1)
+    # Queries are perturbed copies of stored vectors, like a paraphrased question
+    picks = rng.choice(len(vectors), size=min(query_count, len(vectors)), replace=False)
+    queries = normalize(vectors[picks] + 0.3 * vectors.std() * rng.normal(size=(len(picks), vectors.shape[1])))
+    truth, _ = exact_top_k(normalize(vectors), queries.astype(np.float32), k)
+    truth = truth.tolist()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in modes:
+            if mode == 'hnsw' and importlib.util.find_spec('hnswlib') is None:
+                print("Skipping hnsw: hnswlib is not installed")
+                continue
+            factors = oversampling if mode in ('int8', 'binary') else [1.0]
+            for factor in factors:
+                workdir = Path(tmp) / f"{mode}-{factor}"
+                quantization = 'none' if mode == 'hnsw' else mode
+                results.append(run_mode(vectors, queries, truth, k, workdir, quantization, factor, mode == 'hnsw'))
+                print_row(results[-1], k)
+    return results
+
+
+def print_header(k: int):
+    print(f"{'mode':<8} {'oversample':>10} {f'recall@{k}':>10} {'memory_mb':>10} {'disk_mb':>9} "
+          f"{'p50_ms':>8} {'p95_ms':>8} {'build_s':>8}")
+
+
+def print_row(result: Dict[str, Any], k: int):
+    oversampling = f"{result['oversampling']:g}" if result['oversampling'] else '-'
+    print(f"{result['mode']:<8} {oversampling:>10} {result[f'recall@{k}']:>10.4f} {result['memory_mb']:>10.2f} "
+          f"{result['disk_mb']:>9.2f} {result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f} {result['build_s']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall, memory and latency of the local vector index modes")
+    parser.add_argument("--index_dir", type=str, default=None,
+                       help="Use the vectors of an existing local index (LOCAL_INDEX_DIR/<collection>)")
+    parser.add_argument("--vectors", type=int, default=50000,
+                       help="Number of synthetic vectors (without --index_dir)")
+    parser.add_argument("--dim", type=int, default=768,
+                       help="Dimension of synthetic vectors")
+    parser.add_argument("--clusters", type=int, default=500,
+                       help="Clusters the synthetic vectors are drawn around")
+    parser.add_argument("--queries", type=int, default=200,
+                       help="Number of queries")
+    parser.add_argument("--k", type=int, default=10,
+                       help="Neighbours per query (recall@k)")
+    parser.add_argument("--modes", nargs="+", choices=["none", "int8", "binary", "hnsw"],
+                       default=["none", "int8", "binary", "hnsw"],
+                       help="Index modes to compare")
+    parser.add_argument("--oversampling", nargs="+", type=float, default=[1, 2, 4, 8],
+                       help="Candidates rescored per result for the quantized modes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None,
+                       help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.index_dir:
+        vectors = np.asarray(EmbeddingStore.open(args.index_dir).matrix, dtype=np.float32)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim, args.clusters, args.seed)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries, k={args.k}\n")
+
+    print_header(args.k)
+    results = benchmark(vectors, args.queries, args.k, args.modes, args.oversampling, args.seed)
+
+    if args.output:
+        output = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'vectors': len(vectors),
+            'dim': int(vectors.shape[1]),
+            'queries': args.queries,
+            'k': args.k,
+            'results': results
+        }
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
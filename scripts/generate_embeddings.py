@@ -2,44 +2,49 @@
 """
 Embedding Generation Script for RAG-KG Customer Service QA System
 
-Generates vector embeddings for graph nodes using OLLAMA models and stores in Qdrant
+Generates vector embeddings for graph nodes using OLLAMA models and stores them in
+the vector store (Qdrant, or the local in-process index with --backend local)
 """
 
 import json
 import os
+import sys
 from pathlib import Path
 from typing import Dict, List, Any, Tuple
 import argparse
-import ollama
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
 import logging
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.data_version import bump_data_version
+from app.lazy import lazy_import
+from app.lexical_index import DEFAULT_LEXICAL_INDEX_DIR, LexicalIndex, lexical_index_path
+from app.quantization import QUANTIZATION_KINDS
+from app.query_filters import PAYLOAD_INDEX_FIELDS, ticket_filter_payload
+from app.vector_store import VectorStore, create_vector_store, point_id
+
+# Client libraries are imported on first use, so --help stays fast
+ollama = lazy_import('ollama')
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class EmbeddingGenerator:
-    def __init__(self, model_name: str, qdrant_client: QdrantClient, collection_name: str):
+    def __init__(self, model_name: str, store: VectorStore, lexical_index: LexicalIndex):
         self.model_name = model_name
-        self.qdrant = qdrant_client
-        self.collection_name = collection_name
+        self.store = store
+        self.lexical_index = lexical_index
 
     def create_collection(self, vector_size: int = 768):
-        """Create Qdrant collection if it doesn't exist."""
+        """Create the vector collection if it doesn't exist, with indexes on the filtered payload fields."""
+        self.store.create_collection(vector_size)
+        self.store.create_payload_indexes(PAYLOAD_INDEX_FIELDS)
 
-        try:
-            self.qdrant.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE)
-            )
-            logger.info(f"Created collection '{self.collection_name}' with vector size {vector_size}")
-        except Exception as e:
-            if "already exists" in str(e).lower():
-                logger.info(f"Collection '{self.collection_name}' already exists")
-            else:
-                raise e
+    def upsert(self, points: List[Dict[str, Any]]):
+        """Write points to the vector store and their node texts to the lexical index."""
+        self.store.upsert(points)
+        self.lexical_index.upsert(points)
 
     def generate_text_embedding(self, text: str) -> List[float]:
         """Generate embedding for a text string using OLLAMA."""
@@ -87,7 +92,7 @@ class EmbeddingGenerator:
         else:
             return f"{node_type}: {node_id}"
 
-    def process_ticket_embeddings(self, ticket_data: Dict[str, Any]) -> List[PointStruct]:
+    def process_ticket_embeddings(self, ticket_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Generate embeddings for all nodes in a ticket."""
 
         ticket_id = ticket_data['ticket_id']
@@ -97,8 +102,8 @@ class EmbeddingGenerator:
         issue_text = self.create_node_text(ticket_data, 'Issue', ticket_id)
         issue_embedding = self.generate_text_embedding(issue_text)
         if issue_embedding:
-            points.append(PointStruct(
-                id=hash(f"{ticket_id}_issue") % 2**63,  # Convert to positive integer
+            points.append(dict(
+                id=point_id(f"{ticket_id}_issue"),
                 vector=issue_embedding,
                 payload={
                     'ticket_id': ticket_id,
@@ -113,8 +118,8 @@ class EmbeddingGenerator:
             desc_text = self.create_node_text(ticket_data, 'Description', f"{ticket_id}_desc")
             desc_embedding = self.generate_text_embedding(desc_text)
             if desc_embedding:
-                points.append(PointStruct(
-                    id=hash(f"{ticket_id}_desc") % 2**63,
+                points.append(dict(
+                    id=point_id(f"{ticket_id}_desc"),
                     vector=desc_embedding,
                     payload={
                         'ticket_id': ticket_id,
@@ -129,8 +134,8 @@ class EmbeddingGenerator:
             comment_text = self.create_node_text(ticket_data, 'Comment', f"{ticket_id}_comment_{idx}")
             comment_embedding = self.generate_text_embedding(comment_text)
             if comment_embedding:
-                points.append(PointStruct(
-                    id=hash(f"{ticket_id}_comment_{idx}") % 2**63,
+                points.append(dict(
+                    id=point_id(f"{ticket_id}_comment_{idx}"),
                     vector=comment_embedding,
                     payload={
                         'ticket_id': ticket_id,
@@ -147,8 +152,8 @@ class EmbeddingGenerator:
             res_text = self.create_node_text(ticket_data, 'Resolution', f"{ticket_id}_res")
             res_embedding = self.generate_text_embedding(res_text)
             if res_embedding:
-                points.append(PointStruct(
-                    id=hash(f"{ticket_id}_res") % 2**63,
+                points.append(dict(
+                    id=point_id(f"{ticket_id}_res"),
                     vector=res_embedding,
                     payload={
                         'ticket_id': ticket_id,
@@ -166,8 +171,8 @@ class EmbeddingGenerator:
                 entity_text = self.create_node_text(ticket_data, 'Entity', entity)
                 entity_embedding = self.generate_text_embedding(entity_text)
                 if entity_embedding:
-                    points.append(PointStruct(
-                        id=hash(entity_id) % 2**63,
+                    points.append(dict(
+                        id=point_id(entity_id),
                         vector=entity_embedding,
                         payload={
                             'ticket_id': ticket_id,
@@ -185,8 +190,8 @@ class EmbeddingGenerator:
             tag_text = self.create_node_text(ticket_data, 'Tag', tag)
             tag_embedding = self.generate_text_embedding(tag_text)
             if tag_embedding:
-                points.append(PointStruct(
-                    id=hash(tag_id) % 2**63,
+                points.append(dict(
+                    id=point_id(tag_id),
                     vector=tag_embedding,
                     payload={
                         'ticket_id': ticket_id,
@@ -197,6 +202,11 @@ class EmbeddingGenerator:
                     }
                 ))
 
+        # The ticket's product/status/priority on every node, for filtered search
+        scope = ticket_filter_payload(ticket_data)
+        for point in points:
+            point['payload'].update(scope)
+
         return points
 
 def process_ticket_batch(tickets: List[Dict[str, Any]], generator: EmbeddingGenerator,
@@ -214,13 +224,10 @@ def process_ticket_batch(tickets: List[Dict[str, Any]], generator: EmbeddingGene
             processed_tickets += 1
             total_embeddings += len(points)
 
-            # Upload batch to Qdrant
+            # Upload batch to the vector store
             if len(all_points) >= batch_size:
-                generator.qdrant.upsert(
-                    collection_name=generator.collection_name,
-                    points=all_points
-                )
-                logger.info(f"Uploaded {len(all_points)} embeddings to Qdrant")
+                generator.upsert(all_points)
+                logger.info(f"Uploaded {len(all_points)} embeddings to the {generator.store.backend} vector store")
                 all_points = []
 
         except Exception as e:
@@ -228,11 +235,8 @@ def process_ticket_batch(tickets: List[Dict[str, Any]], generator: EmbeddingGene
 
     # Upload remaining points
     if all_points:
-        generator.qdrant.upsert(
-            collection_name=generator.collection_name,
-            points=all_points
-        )
-        logger.info(f"Uploaded final {len(all_points)} embeddings to Qdrant")
+        generator.upsert(all_points)
+        logger.info(f"Uploaded final {len(all_points)} embeddings to the {generator.store.backend} vector store")
 
     return processed_tickets, total_embeddings
 
@@ -240,10 +244,20 @@ def main():
     parser = argparse.ArgumentParser(description="Generate embeddings for graph nodes")
     parser.add_argument("--input_dir", type=str, default="data/processed",
                        help="Input directory with parsed tickets")
+    parser.add_argument("--backend", type=str, choices=["qdrant", "local"],
+                       default=os.getenv("VECTOR_BACKEND", "qdrant"),
+                       help="Vector store: Qdrant server or local in-process index")
     parser.add_argument("--qdrant_url", type=str, default="http://localhost:6333",
                        help="Qdrant server URL")
+    parser.add_argument("--index_dir", type=str, default=os.getenv("LOCAL_INDEX_DIR", "data/vector_index"),
+                       help="Directory of the local vector index (--backend local)")
     parser.add_argument("--collection", type=str, default="tickets",
-                       help="Qdrant collection name")
+                       help="Vector collection name")
+    parser.add_argument("--quantization", type=str, choices=list(QUANTIZATION_KINDS),
+                       default=os.getenv("VECTOR_QUANTIZATION", "none"),
+                       help="Quantize stored vectors (int8 scalar or binary), rescored with the originals at search time")
+    parser.add_argument("--lexical_dir", type=str, default=os.getenv("LEXICAL_INDEX_DIR", DEFAULT_LEXICAL_INDEX_DIR),
+                       help="Directory of the BM25 lexical index built next to the embeddings")
     parser.add_argument("--model", type=str, default="nomic-embed-text",
                        help="OLLAMA embedding model name")
     parser.add_argument("--batch_size", type=int, default=10,
@@ -280,11 +294,17 @@ def main():
 
     logger.info(f"Loaded {len(all_tickets)} tickets")
 
-    # Initialize Qdrant client with longer timeout
-    qdrant_client = QdrantClient(url=args.qdrant_url, timeout=60)
+    # Initialize the vector store (Qdrant with a longer timeout)
+    store = create_vector_store(args.backend, args.collection, url=args.qdrant_url,
+                                index_dir=args.index_dir, timeout=60, quantization=args.quantization)
+    store.connect()
+
+    # Lexical index over the same node texts; points are upserted into an existing index
+    lexical_path = lexical_index_path(args.collection, args.lexical_dir)
+    lexical_index = LexicalIndex.open(str(lexical_path)) if lexical_path.exists() else LexicalIndex()
 
     # Initialize embedding generator
-    generator = EmbeddingGenerator(args.model, qdrant_client, args.collection)
+    generator = EmbeddingGenerator(args.model, store, lexical_index)
 
     # Create collection
     generator.create_collection()
@@ -303,16 +323,22 @@ def main():
 
         logger.info(f"Processed {total_processed}/{len(all_tickets)} tickets, {total_embeddings} embeddings generated")
 
+    # Persist the local index (no-op for Qdrant) and the lexical index
+    store.flush()
+    lexical_index.save(str(lexical_path))
+
     elapsed = time.time() - start_time
 
     # Get final collection stats
     try:
-        collection_info = qdrant_client.get_collection(args.collection)
-        vector_count = collection_info.vectors_count
+        vector_count = store.count()
         logger.info(f"Final collection stats: {vector_count} vectors")
     except Exception as e:
         logger.error(f"Failed to get collection stats: {str(e)}")
 
+    # Invalidate API caches built on the previous data
+    bump_data_version('vectors')
+
     logger.info("Embedding generation complete!")
     logger.info(f"Time elapsed: {elapsed:.2f} seconds")
     logger.info(f"Tickets processed: {total_processed}")
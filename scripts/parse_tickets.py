@@ -6,15 +6,21 @@ Implements hybrid parsing: rule-based extraction + LLM-based semantic parsing
 """
 
 import json
-import re
 import os
+import sys
 from pathlib import Path
 from typing import Dict, List, Any
 import argparse
-import ollama
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.lazy import lazy_import
+from app.matcher import ISSUE_TYPE_STEMS, ticket_matcher, unique
+
+# Imported on first use, so --help and rule-based runs stay fast
+ollama = lazy_import('ollama')
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -27,63 +33,23 @@ class TicketParser:
 
         parsed = ticket_data.copy()
 
-        # Extract entities using regex
-        text_content = f"{ticket_data.get('title', '')} {ticket_data.get('description', '')}"
-        for comment in ticket_data.get('comments', []):
-            text_content += f" {comment.get('text', '')}"
-
-        # Product mentions
-        products = []
-        product_patterns = [
-            r'\b(mobile app|web portal|api|desktop client|mobile website)\b',
-            r'\b(ios|android|windows|mac|linux)\b',
-            r'\b(browser|chrome|firefox|safari|edge)\b'
-        ]
-        for pattern in product_patterns:
-            matches = re.findall(pattern, text_content, re.IGNORECASE)
-            products.extend(matches)
-
-        # Error codes and technical terms
-        error_patterns = [
-            r'\b(error|exception|failed|crash|bug)\b',
-            r'\b(404|500|403|401|502)\b',
-            r'\b(null|undefined|timeout|connection)\b'
-        ]
-        errors = []
-        for pattern in error_patterns:
-            matches = re.findall(pattern, text_content, re.IGNORECASE)
-            errors.extend(matches)
-
-        # User actions
-        actions = []
-        action_patterns = [
-            r'\b(login|logout|click|submit|upload|download|search|refresh)\b',
-            r'\b(clear cache|restart|update|install|uninstall)\b'
-        ]
-        for pattern in action_patterns:
-            matches = re.findall(pattern, text_content, re.IGNORECASE)
-            actions.extend(matches)
-
-        # Extract ticket references
-        references = re.findall(r'\b[A-Z]+-\d+\b', text_content)
+        # Extract entities from the title, description and every comment
+        text_content = " ".join(
+            [ticket_data.get('title', ''), ticket_data.get('description', '')] +
+            [comment.get('text', '') for comment in ticket_data.get('comments', [])]
+        )
+
+        # Products, error terms, user actions, ticket references and issue
+        # types all come from one pass of the shared matcher
+        hits = ticket_matcher().scan(text_content)
 
         parsed['entities'] = {
-            'products': list(set(products)),
-            'errors': list(set(errors)),
-            'actions': list(set(actions)),
-            'references': list(set(references))
+            entity_type: unique(hits.get(entity_type, []))
+            for entity_type in ['products', 'errors', 'actions', 'references']
         }
 
         # Classify issue type
-        issue_types = []
-        if any(word in text_content.lower() for word in ['login', 'password', 'auth']):
-            issue_types.append('authentication')
-        if any(word in text_content.lower() for word in ['payment', 'billing', 'charge']):
-            issue_types.append('payment')
-        if any(word in text_content.lower() for word in ['slow', 'performance', 'hang']):
-            issue_types.append('performance')
-        if any(word in text_content.lower() for word in ['crash', 'error', 'bug']):
-            issue_types.append('bug')
+        issue_types = [issue_type for issue_type in ISSUE_TYPE_STEMS if issue_type in hits]
 
         parsed['issue_types'] = issue_types
         parsed['parsing_method'] = 'rule_based'
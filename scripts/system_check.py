@@ -7,12 +7,17 @@ Validates all system components are properly installed and configured.
 
 import os
 import sys
-import requests
-from neo4j import GraphDatabase
-from qdrant_client import QdrantClient
-import ollama
+from pathlib import Path
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.lazy import lazy_import
+
+# Client libraries are imported by the check that uses them
+requests = lazy_import('requests')
+neo4j = lazy_import('neo4j')
+ollama = lazy_import('ollama')
+
 def check_ollama():
     """Check if OLLAMA is running and has required models."""
     try:
@@ -27,7 +32,7 @@ def check_ollama():
 def check_neo4j(uri, user, password):
     """Check if Neo4j is running and accessible."""
     try:
-        driver = GraphDatabase.driver(uri, auth=(user, password))
+        driver = neo4j.GraphDatabase.driver(uri, auth=(user, password))
         with driver.session() as session:
             result = session.run("RETURN 'Hello Neo4j' as message")
             message = result.single()['message']
@@ -7,28 +7,34 @@ Validates graph structure, embedding completeness, and data consistency
 
 import json
 import os
+import sys
 from pathlib import Path
 from typing import Dict, List, Any
 import argparse
-from neo4j import GraphDatabase
-from qdrant_client import QdrantClient
 import logging
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.graph_store import DEFAULT_GRAPH_FILE, GraphStore, create_graph_store
+from app.lazy import lazy_import
+
+# Client libraries are imported on first use, so --help stays fast
+qdrant_client = lazy_import('qdrant_client')
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DataValidator:
-    def __init__(self, neo4j_uri: str, neo4j_user: str, neo4j_password: str,
-                 qdrant_url: str, collection_name: str):
-        self.neo4j_driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password))
-        self.qdrant_client = QdrantClient(url=qdrant_url)
+    def __init__(self, graph_store: GraphStore, qdrant_url: str, collection_name: str):
+        self.graph_store = graph_store
+        self.graph_store.connect()
+        self.qdrant_client = qdrant_client.QdrantClient(url=qdrant_url)
         self.collection_name = collection_name
 
     def close(self):
-        self.neo4j_driver.close()
+        self.graph_store.close()
 
     def validate_graph_structure(self) -> Dict[str, Any]:
-        """Validate Neo4j graph structure and completeness."""
+        """Validate graph structure and completeness."""
 
         results = {
             'node_counts': {},
@@ -36,51 +42,39 @@ class DataValidator:
             'issues': []
         }
 
-        with self.neo4j_driver.session() as session:
-            # Count different node types
-            node_types = ['Issue', 'Description', 'Comment', 'Resolution', 'Entity', 'Tag']
-            for node_type in node_types:
-                count = session.run(f"MATCH (n:{node_type}) RETURN count(n) as count").single()['count']
-                results['node_counts'][node_type] = count
-
-            # Count relationship types
-            rel_types = ['HAS_DESCRIPTION', 'HAS_COMMENT', 'HAS_RESOLUTION',
-                        'MENTIONS_ENTITY', 'HAS_TAG', 'SIMILAR_TO', 'RELATED_TO',
-                        'REFERENCES', 'DEPENDS_ON']
-            for rel_type in rel_types:
-                count = session.run(f"MATCH ()-[r:{rel_type}]->() RETURN count(r) as count").single()['count']
-                results['relationship_counts'][rel_type] = count
-
-            # Check for orphaned nodes
-            orphaned_issues = session.run("""
-                MATCH (i:Issue)
-                WHERE NOT (i)--()
-                RETURN count(i) as count
-                """).single()['count']
-
-            if orphaned_issues > 0:
-                results['issues'].append(f"Found {orphaned_issues} orphaned Issue nodes")
-
-            # Check for issues without descriptions
-            issues_without_desc = session.run("""
-                MATCH (i:Issue)
-                WHERE NOT (i)-[:HAS_DESCRIPTION]->()
-                RETURN count(i) as count
-                """).single()['count']
-
-            if issues_without_desc > 0:
-                results['issues'].append(f"Found {issues_without_desc} issues without descriptions")
-
-            # Check relationship consistency
-            inconsistent_rels = session.run("""
-                MATCH (i:Issue)-[r:HAS_COMMENT]->(c:Comment)
-                WITH i, count(c) as comment_count
-                WHERE comment_count > 10
-                RETURN count(i) as count
-                """).single()['count']
-
-            if inconsistent_rels > 0:
-                results['issues'].append(f"Found issues with unusually high comment counts")
+        # Count different node types
+        node_types = ['Issue', 'Description', 'Comment', 'Resolution', 'Entity', 'Tag']
+        label_counts = self.graph_store.label_counts()
+        for node_type in node_types:
+            results['node_counts'][node_type] = label_counts.get(node_type, 0)
+
+        # Count relationship types
+        rel_types = ['HAS_DESCRIPTION', 'HAS_COMMENT', 'HAS_RESOLUTION',
+                    'MENTIONS_ENTITY', 'HAS_TAG', 'SIMILAR_TO', 'RELATED_TO',
+                    'REFERENCES', 'DEPENDS_ON']
+        rel_counts = self.graph_store.relationship_counts()
+        for rel_type in rel_types:
+            results['relationship_counts'][rel_type] = rel_counts.get(rel_type, 0)
+
+        # Check for orphaned nodes
+        orphaned_issues = sum(1 for degree in self.graph_store.issue_degrees().values() if degree == 0)
+
+        if orphaned_issues > 0:
+            results['issues'].append(f"Found {orphaned_issues} orphaned Issue nodes")
+
+        # Check for issues without descriptions
+        descriptions = self.graph_store.issue_degrees('HAS_DESCRIPTION', direction='out')
+        issues_without_desc = sum(1 for degree in descriptions.values() if degree == 0)
+
+        if issues_without_desc > 0:
+            results['issues'].append(f"Found {issues_without_desc} issues without descriptions")
+
+        # Check relationship consistency
+        comments = self.graph_store.issue_degrees('HAS_COMMENT', direction='out')
+        inconsistent_rels = sum(1 for degree in comments.values() if degree > 10)
+
+        if inconsistent_rels > 0:
+            results['issues'].append(f"Found issues with unusually high comment counts")
 
         return results
 
@@ -139,27 +133,24 @@ class DataValidator:
             # Sample a few files to check consistency
             sample_files = json_files[:5] if len(json_files) > 5 else json_files
 
-            with self.neo4j_driver.session() as session:
-                graph_ticket_ids = set()
-                for record in session.run("MATCH (i:Issue) RETURN i.id as ticket_id"):
-                    graph_ticket_ids.add(record['ticket_id'])
+            graph_ticket_ids = set(self.graph_store.issue_ids())
 
-                file_ticket_ids = set()
-                for filepath in sample_files:
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            ticket = json.load(f)
-                            file_ticket_ids.add(ticket['ticket_id'])
-                    except Exception as e:
-                        results['issues'].append(f"Failed to read {filepath}: {str(e)}")
+            file_ticket_ids = set()
+            for filepath in sample_files:
+                try:
+                    with open(filepath, 'r', encoding='utf-8') as f:
+                        ticket = json.load(f)
+                        file_ticket_ids.add(ticket['ticket_id'])
+                except Exception as e:
+                    results['issues'].append(f"Failed to read {filepath}: {str(e)}")
 
-                # Check coverage
-                coverage = len(file_ticket_ids & graph_ticket_ids) / len(file_ticket_ids) if file_ticket_ids else 0
-                results['graph_coverage'] = coverage
+            # Check coverage
+            coverage = len(file_ticket_ids & graph_ticket_ids) / len(file_ticket_ids) if file_ticket_ids else 0
+            results['graph_coverage'] = coverage
 
-                if coverage < 1.0:
-                    missing = file_ticket_ids - graph_ticket_ids
-                    results['issues'].append(f"Tickets missing from graph: {missing}")
+            if coverage < 1.0:
+                missing = file_ticket_ids - graph_ticket_ids
+                results['issues'].append(f"Tickets missing from graph: {missing}")
 
         return results
 
@@ -201,6 +192,10 @@ class DataValidator:
 
 def main():
     parser = argparse.ArgumentParser(description="Validate data pipeline")
+    parser.add_argument("--graph_backend", choices=['neo4j', 'embedded'], default=None,
+                       help="Graph store to validate (default: GRAPH_BACKEND or neo4j)")
+    parser.add_argument("--graph_file", type=str, default=None,
+                       help=f"Embedded graph file (default: GRAPH_FILE or {DEFAULT_GRAPH_FILE})")
     parser.add_argument("--graph_uri", type=str, default="bolt://localhost:7687",
                        help="Neo4j database URI")
     parser.add_argument("--graph_user", type=str, default="neo4j",
@@ -219,7 +214,7 @@ def main():
 
     # Initialize validator
     validator = DataValidator(
-        args.graph_uri, args.graph_user, args.graph_password,
+        create_graph_store(args.graph_backend, args.graph_uri, args.graph_user, args.graph_password, args.graph_file),
         args.vector_url, args.collection
     )
 
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Import the app package from the repository root, as the scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
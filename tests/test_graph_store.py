@@ -0,0 +1,155 @@
+import pytest
+
+from app.cypher_templates import TREE_RELATIONSHIPS
+from app.graph_store import EmbeddedGraphStore
+
+
+def ticket(ticket_id, product='Mobile App', status='open', **fields):
+    return {
+        'ticket_id': ticket_id,
+        'title': f"Login fails ({ticket_id})",
+        'description': f"Users cannot log in ({ticket_id})",
+        'product': product,
+        'status': status,
+        'priority': 'High',
+        'comments': [{'author': 'agent', 'text': 'Looking into it'}, {'author': 'user', 'text': 'Still broken'}],
+        'resolution': 'Cleared the session cache',
+        'entities': {'products': [product], 'errors': ['502']},
+        'tags': ['bug', 'login'],
+        **fields
+    }
+
+
+@pytest.fixture
+def graph(tmp_path):
+    store = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    store.connect()
+    store.add_ticket_tree(ticket('T1'))
+    store.add_ticket_tree(ticket('T2', product='Web Portal', tags=['bug']))
+    store.add_ticket_tree(ticket('T3', status='Work-in-Progress', resolution=None))
+    store.add_issue_link('T1', 'T2', 'SIMILAR_TO', {'weight': 0.9})
+    store.add_issue_link('T2', 'T1', 'SIMILAR_TO', {'weight': 0.9})  # undirected, merged
+    store.add_issue_link('T1', 'T3', 'REFERENCES')
+    store.add_issue_link('T3', 'T2', 'DEPENDS_ON', {'type': 'blocking'})
+    store.add_issue_link('T1', 'T404', 'REFERENCES')  # unknown ticket, ignored
+    return store
+
+
+def tree_types(record):
+    return [node['type'] for node in record['nodes']]
+
+
+def test_add_ticket_tree_builds_the_tree(graph):
+    assert graph.has_issue('T1') and not graph.has_issue('T404')
+    labels = graph.label_counts()
+    assert labels['Issue'] == 3
+    assert labels['Comment'] == 6
+    assert labels['Resolution'] == 2  # T3 has none
+    # Entities and tags are merged across tickets
+    assert labels['Entity'] == 3  # mobile app, web portal, 502
+    assert labels['Tag'] == 2
+
+    relationships = graph.relationship_counts()
+    assert relationships['HAS_TAG'] == 5
+    assert relationships['SIMILAR_TO'] == 1
+    assert relationships['REFERENCES'] == 1
+    assert relationships['DEPENDS_ON'] == 1
+
+
+def test_ticket_subtrees_follow_rel_type_order(graph):
+    records = graph.ticket_subtrees(['T2', 'T404', 'T1'], ['HAS_RESOLUTION', 'HAS_COMMENT'], True, 2)
+    assert [record['ticket_id'] for record in records] == ['T2', 'T1']
+    assert tree_types(records[0]) == ['Issue', 'Resolution', 'Comment']
+
+    full = graph.ticket_subtrees(['T1'], TREE_RELATIONSHIPS, False, 1000)[0]
+    assert sorted(tree_types(full)) == sorted(['Description', 'Comment', 'Comment', 'Resolution',
+                                               'Entity', 'Entity', 'Tag', 'Tag'])
+    node_ids = {node['node_id'] for node in full['nodes']}
+    assert {'T1_desc', 'T1_res', 'T1_comment_0', 'T1_comment_1'} <= node_ids
+
+
+def test_neighbors_with_filters(graph):
+    linked = {(n['ticket_id'], n['rel_type']) for n in graph.neighbors('T1')}
+    assert linked == {('T2', 'SIMILAR_TO'), ('T3', 'REFERENCES')}
+
+    assert [n['ticket_id'] for n in graph.neighbors('T1', ['SIMILAR_TO'])] == ['T2']
+    assert graph.neighbors('T1', ['SIMILAR_TO'])[0]['properties'] == {'weight': 0.9}
+    assert len(graph.neighbors('T1', limit=1)) == 1
+
+    assert [n['ticket_id'] for n in graph.neighbors('T1', filters={'product': 'mobile_app'})] == ['T3']
+    assert [n['ticket_id'] for n in graph.neighbors('T1', filters={'status': 'work_in_progress'})] == ['T3']
+    assert graph.neighbors('T1', filters={'product': 'desktop_client'}) == []
+
+
+def test_find_issues(graph):
+    assert {issue['id'] for issue in graph.find_issues()} == {'T1', 'T2', 'T3'}
+    assert {issue['id'] for issue in graph.find_issues(products=['mobile app'])} == {'T1', 'T3'}
+    assert {issue['id'] for issue in graph.find_issues(tags=['login'])} == {'T1', 'T3'}
+    assert {issue['id'] for issue in graph.find_issues(filters={'status': ['open']})} == {'T1', 'T2'}
+    assert len(graph.find_issues(limit=2)) == 2
+
+
+def test_issue_degrees(graph):
+    assert graph.issue_degrees('SIMILAR_TO') == {'T1': 1, 'T2': 1, 'T3': 0}
+    assert graph.issue_degrees('REFERENCES', direction='out') == {'T1': 1, 'T2': 0, 'T3': 0}
+    # Tree children count too: T1 has 1 description, 2 comments, 1 resolution, 2 entities, 2 tags
+    assert graph.issue_degrees()['T1'] == 8 + 2
+    with pytest.raises(ValueError):
+        graph.issue_degrees('UNKNOWN')
+
+
+def test_save_load_then_write(graph, tmp_path):
+    graph.save()
+    loaded = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    loaded.connect()
+    assert loaded.label_counts() == graph.label_counts()
+    assert loaded.relationship_counts() == graph.relationship_counts()
+    assert loaded.ticket_subtrees(['T1'], TREE_RELATIONSHIPS, True, 1000) == \
+        graph.ticket_subtrees(['T1'], TREE_RELATIONSHIPS, True, 1000)
+
+    loaded.add_ticket_tree(ticket('T4', tags=['login', 'sso']))
+    loaded.add_issue_link('T4', 'T1', 'SIMILAR_TO', {'weight': 0.95})
+    loaded.add_issue_link('T1', 'T2', 'SIMILAR_TO')  # already linked before the save
+    assert loaded.relationship_counts()['SIMILAR_TO'] == 2
+    assert {n['ticket_id'] for n in loaded.neighbors('T4')} == {'T1'}
+    assert loaded.label_counts()['Tag'] == 3
+
+    loaded.save()
+    reloaded = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    reloaded.connect()
+    assert reloaded.issue_ids() == ['T1', 'T2', 'T3', 'T4']
+    assert reloaded.neighbors('T4', ['SIMILAR_TO'])[0]['properties'] == {'weight': 0.95}
+
+
+def test_rebuilt_ticket_replaces_its_tree(graph, tmp_path):
+    graph.save()
+    loaded = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    loaded.connect()
+    before = loaded.label_counts()
+
+    loaded.add_ticket_tree(ticket('T1', status='resolved', comments=[{'author': 'agent', 'text': 'Fixed'}],
+                                  resolution='Rotated the signing key', tags=['sso']))
+    tree = loaded.ticket_subtrees(['T1'], TREE_RELATIONSHIPS, True, 1000)[0]
+    texts = [node['text'] for node in tree['nodes']]
+    assert any('Rotated the signing key' in text for text in texts)
+    assert not any('Cleared the session cache' in text for text in texts)
+    assert tree_types(tree).count('Comment') == 1
+    assert 'resolved' in tree['nodes'][0]['text']
+
+    # The old children are gone, shared entity/tag nodes stay, issue links are kept
+    counts = loaded.label_counts()
+    assert counts['Issue'] == before['Issue']
+    assert counts['Comment'] == before['Comment'] - 1
+    assert counts['Resolution'] == before['Resolution']
+    assert counts['Tag'] == before['Tag'] + 1
+    assert {n['ticket_id'] for n in loaded.neighbors('T1')} == {'T2', 'T3'}
+    assert loaded.find_issues(filters={'status': 'resolved'})[0]['id'] == 'T1'
+    # Other tickets are untouched
+    assert loaded.ticket_subtrees(['T2'], TREE_RELATIONSHIPS, False, 1000) == \
+        graph.ticket_subtrees(['T2'], TREE_RELATIONSHIPS, False, 1000)
+
+    loaded.save()
+    reloaded = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    reloaded.connect()
+    assert reloaded.ticket_subtrees(['T1'], TREE_RELATIONSHIPS, True, 1000) == [tree]
+    assert reloaded.neighbors('T2', ['SIMILAR_TO'])[0]['properties'] == {'weight': 0.9}
@@ -0,0 +1,90 @@
+import pytest
+
+from app.cache import SubgraphCache
+from app.cypher_templates import FULL_TREE_NODES, TREE_RELATIONSHIPS
+from app.data_version import bump_data_version, ticket_version
+from app.graph_store import EmbeddedGraphStore
+
+
+def ticket(ticket_id, resolution):
+    return {
+        'ticket_id': ticket_id,
+        'title': f"Sync fails ({ticket_id})",
+        'description': 'Contacts do not sync',
+        'product': 'Mobile App',
+        'comments': [{'author': 'agent', 'text': 'Investigating'}],
+        'resolution': resolution,
+        'tags': ['sync']
+    }
+
+
+@pytest.fixture(autouse=True)
+def data_version_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('DATA_VERSION_FILE', str(tmp_path / 'data_version.json'))
+
+
+def build(graph, tickets, clear=False):
+    """What scripts/build_graph.py does for the intra_issue phase"""
+    for data in tickets:
+        graph.add_ticket_tree(data)
+    graph.flush()
+    bump_data_version('graph', ticket_versions={t['ticket_id']: ticket_version(t) for t in tickets},
+                      replace_tickets=clear)
+
+
+def fetch(cache, graph, ticket_ids):
+    """What RetrievalSystem._ticket_trees does: cached trees, misses from the graph"""
+    trees, missing = cache.lookup(ticket_ids)
+    for record in graph.ticket_subtrees(list(missing), TREE_RELATIONSHIPS, True, FULL_TREE_NODES):
+        trees[record['ticket_id']] = record['nodes']
+        cache.put(record['ticket_id'], missing[record['ticket_id']], record['nodes'])
+    return trees, set(missing)
+
+
+def texts(nodes):
+    return [node['text'] for node in nodes]
+
+
+def test_changing_one_ticket_invalidates_only_its_entry(tmp_path):
+    graph = EmbeddedGraphStore(str(tmp_path / 'graph.npz'))
+    tickets = [ticket('T1', 'Re-login fixes it'), ticket('T2', 'Clear the app cache')]
+    build(graph, tickets, clear=True)
+
+    cache = SubgraphCache()
+    trees, missing = fetch(cache, graph, ['T1', 'T2'])
+    assert missing == {'T1', 'T2'}
+    assert fetch(cache, graph, ['T1', 'T2'])[1] == set()
+    assert cache.stats()['hits'] == 2
+
+    # Rebuild both tickets without clearing; only T1's content changed
+    build(graph, [ticket('T1', 'Update to version 4.2'), tickets[1]])
+
+    rebuilt, missing = fetch(cache, graph, ['T1', 'T2'])
+    assert missing == {'T1'}
+    assert cache.stats()['invalidations'] == 1
+    assert any('Update to version 4.2' in text for text in texts(rebuilt['T1']))
+    assert not any('Re-login fixes it' in text for text in texts(rebuilt['T1']))
+    assert rebuilt['T2'] is trees['T2']  # served from the cache
+
+
+def test_tickets_without_a_version_follow_the_global_version(tmp_path):
+    cache = SubgraphCache()
+    bump_data_version('graph')
+    version = cache.lookup(['T1'])[1]['T1']
+    assert version
+    cache.put('T1', version, [{'text': 'a', 'type': 'Issue'}])
+    assert 'T1' in cache.lookup(['T1'])[0]
+
+    bump_data_version('vectors')
+    assert 'T1' in cache.lookup(['T1'])[1]
+
+
+def test_entries_are_evicted_by_bytes():
+    nodes = [{'text': 'x' * 1000, 'type': 'Comment'}]
+    cache = SubgraphCache(max_bytes=2500)
+    for ticket_id in ('T1', 'T2', 'T3'):
+        cache.put(ticket_id, '', nodes)
+    stats = cache.stats()
+    assert stats['bytes'] <= 2500
+    assert stats['evictions'] >= 1
+    assert 'T1' not in cache.lookup(['T1'])[0]  # least recently used goes first
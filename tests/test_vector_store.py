@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from app.vector_store import LocalVectorStore
+
+DIM = 32
+NODE_TYPES = ['Issue', 'Description', 'Resolution']
+
+
+def make_points(count=60, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(count, DIM)).astype(np.float32)
+    return [
+        {
+            'id': i,
+            'vector': vectors[i].tolist(),
+            'payload': {'ticket_id': f"T{i // 3}", 'node_type': NODE_TYPES[i % 3], 'product': 'mobile_app' if i % 2 else 'web_portal'}
+        }
+        for i in range(count)
+    ]
+
+
+def build_store(path, points, quantization='none'):
+    store = LocalVectorStore(str(path), quantization=quantization, oversampling=4)
+    store.connect()
+    store.create_collection(DIM)
+    store.upsert(points)
+    return store
+
+
+def test_search_finds_the_query_point(tmp_path):
+    points = make_points()
+    store = build_store(tmp_path / 'index', points)
+
+    hits = store.search(points[7]['vector'], limit=3)
+
+    assert hits[0]['id'] == 7
+    assert hits[0]['score'] == pytest.approx(1.0, abs=1e-5)
+    assert [hit['score'] for hit in hits] == sorted((hit['score'] for hit in hits), reverse=True)
+
+
+def test_search_applies_payload_filters(tmp_path):
+    points = make_points()
+    store = build_store(tmp_path / 'index', points)
+
+    hits = store.search(points[7]['vector'], limit=10, filters={'node_type': 'Resolution'})
+    assert hits and all(hit['payload']['node_type'] == 'Resolution' for hit in hits)
+    assert 7 not in [hit['id'] for hit in hits]  # point 7 is a Description
+
+    hits = store.search(points[7]['vector'], limit=10,
+                        filters={'node_type': ['Issue', 'Description'], 'product': 'mobile_app'})
+    assert hits[0]['id'] == 7
+    assert all(hit['payload']['node_type'] in ('Issue', 'Description') for hit in hits)
+    assert all(hit['payload']['product'] == 'mobile_app' for hit in hits)
+
+    assert store.search(points[7]['vector'], limit=10, filters={'product': 'desktop_client'}) == []
+
+
+@pytest.mark.parametrize('quantization', ['none', 'int8', 'binary'])
+def test_quantized_search_rescores_with_original_vectors(tmp_path, quantization):
+    points = make_points(count=200)
+    store = build_store(tmp_path / 'index', points, quantization)
+    store.save()
+
+    loaded = LocalVectorStore(str(tmp_path / 'index'), oversampling=4)
+    loaded.connect()
+    assert loaded.quantization == quantization
+    assert (loaded._codes is not None) == (quantization != 'none')
+
+    query = np.asarray(points[42]['vector'], dtype=np.float32)
+    hits = loaded.search(query.tolist(), limit=5)
+    assert hits[0]['id'] == 42
+
+    # Rescored hits carry the cosine of the stored (float16) vectors, not the quantized estimate
+    matrix = np.asarray([point['vector'] for point in points], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    exact = matrix @ (query / np.linalg.norm(query))
+    for hit in hits:
+        assert hit['score'] == pytest.approx(float(exact[hit['id']]), abs=1e-2)
+
+
+def test_save_load_then_upsert(tmp_path):
+    points = make_points()
+    store = build_store(tmp_path / 'index', points)
+    store.save()
+
+    loaded = LocalVectorStore(str(tmp_path / 'index'))
+    loaded.connect()
+    assert loaded.count() == len(points)
+    assert loaded.search(points[5]['vector'], limit=1)[0]['id'] == 5
+
+    # Replace an existing point and add a new one
+    replacement = {'id': 5, 'vector': points[6]['vector'], 'payload': {'node_type': 'Tag'}}
+    added = {'id': 1000, 'vector': points[8]['vector'], 'payload': {'node_type': 'Tag'}}
+    loaded.upsert([replacement, added])
+    assert loaded.count() == len(points) + 1
+    tagged = loaded.search(points[8]['vector'], limit=5, filters={'node_type': 'Tag'})
+    assert [hit['id'] for hit in tagged][:1] == [1000]
+    assert {hit['id'] for hit in tagged} == {5, 1000}
+
+    loaded.save()
+    reloaded = LocalVectorStore(str(tmp_path / 'index'))
+    reloaded.connect()
+    assert reloaded.count() == len(points) + 1
+    assert reloaded.retrieve([1000])[0]['payload'] == {'node_type': 'Tag'}
+
+
+def test_duplicate_ids_in_one_batch_keep_the_last_copy(tmp_path):
+    points = make_points(count=6)
+    duplicate = {'id': 3, 'vector': points[0]['vector'], 'payload': {'node_type': 'Entity'}}
+    store = build_store(tmp_path / 'index', points + [duplicate])
+
+    assert store.count() == 6
+    assert store.retrieve([3])[0]['payload'] == {'node_type': 'Entity'}
+    assert {hit['id'] for hit in store.search(points[0]['vector'], limit=2)} == {0, 3}
+
+    # The same after a save/load, for a new id repeated in the batch
+    store.save()
+    loaded = LocalVectorStore(str(tmp_path / 'index'))
+    loaded.connect()
+    loaded.upsert([
+        {'id': 99, 'vector': points[1]['vector'], 'payload': {'node_type': 'Tag'}},
+        {'id': 99, 'vector': points[2]['vector'], 'payload': {'node_type': 'Comment'}},
+    ])
+    assert loaded.count() == 7
+    assert loaded.retrieve([99])[0]['payload'] == {'node_type': 'Comment'}
+    assert loaded.search(points[2]['vector'], limit=2, filters={'node_type': 'Comment'})[0]['id'] == 99